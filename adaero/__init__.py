@@ -11,8 +11,9 @@ def main(global_config, **settings):  # pylint: disable=unused-argument
     config = Configurator(settings=settings)
     config.include(".security")
     config.include(".models")
+    config.include(".directory")
     config.include(".mail")
-    config.include("pyramid_beaker")
+    config.include(".session")
     config.include("rest_toolkit")
     # migrations do not form part of web app runtime
     config.scan(ignore="adaero.migrations")
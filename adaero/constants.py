@@ -22,6 +22,7 @@ ALLOW_PASSWORDLESS_ACCESS_KEY = "adaero.allow_passwordless_access"
 LOAD_USER_EMAIL_LIST_KEY = "adaero.load_user_email_list"
 CHECK_AND_SEND_EMAIL_INT_KEY = "adaero.check_and_send_email_interval_s"
 RUN_EMAIL_INTERVAL_JOB_KEY = "adaero.run_email_interval_job"
+SCHEDULER_LEASE_TTL_S_KEY = "adaero.scheduler_lease_ttl_s"
 TALENT_MANAGER_ON_EMAIL_KEY = "adaero.talent_manager_on_email"
 SERVED_ON_HTTPS_KEY = "adaero.served_on_https"
 FRONTEND_SERVER_PORT_KEY = "adaero.frontend_server_port"
@@ -29,6 +30,8 @@ PRODUCTION_HOSTNAME_KEY = "adaero.production_hostname"
 PRODUCTION_USER_KEY = "adaero.production_user"
 EMAIL_START_DELAY_S_KEY = "adaero.email_start_delay_s"
 EMAIL_DELAY_BETWEEN_S_KEY = "adaero.email_delay_between_s"
+EMAIL_MAX_PER_S_KEY = "adaero.email_max_per_s"
+EMAIL_SMTP_CONNECTIONS_KEY = "adaero.email_smtp_connections"
 ENABLE_SEND_EMAIL_KEY = "adaero.enable_send_email"
 DISPLAYED_HOSTNAME_KEY = "adaero.displayed_hostname"
 DATABASE_REVISION_KEY = "adaero.database_revision"
@@ -45,6 +48,12 @@ LDAP_SEARCH_PASSWORD_KEY = "adaero.ldap_search_password"
 LDAP_BASE_DN_KEY = "adaero.ldap_base_dn"
 LDAP_DN_USERNAME_ATTRIBUTE_KEY = "adaero.ldap_dn_username_attribute"
 LDAP_DN_USERNAME_REGEX_KEY = "adaero.ldap_dn_username_regex"
+LDAP_POOL_SIZE_KEY = "adaero.ldap_pool_size"
+LDAP_PAGE_SIZE_KEY = "adaero.ldap_page_size"
+LDAP_CACHE_TTL_S_KEY = "adaero.ldap_cache_ttl_s"
+LDAP_CACHE_NEGATIVE_TTL_S_KEY = "adaero.ldap_cache_negative_ttl_s"
+LDAP_CACHE_SIZE_KEY = "adaero.ldap_cache_size"
+LDAP_CACHE_SHARED_KEY = "adaero.ldap_cache_shared"
 
 COMPANY_NAME_KEY = "adaero.company_name"
 SUPPORT_EMAIL_KEY = "adaero.support_email"
@@ -54,6 +63,14 @@ LOGIN_PASSWORD_MSG_KEY = "adaero.login_password_msg"
 TM_UPLOAD_NEW_POPULATION_MSG_KEY = "adaero.tm_upload_new_population_msg"
 TM_GENERATE_POPULATION_MSG_KEY = "adaero.tm_generate_population_msg"
 LOGO_FILENAME_KEY = "adaero.logo_filename"
+STATS_ENGINE_KEY = "adaero.stats_engine"
+PERIOD_CLOCK_TTL_S_KEY = "adaero.period_clock_ttl_s"
+USER_CACHE_TTL_S_KEY = "adaero.user_cache_ttl_s"
+USER_CACHE_SIZE_KEY = "adaero.user_cache_size"
+SESSION_TYPE_KEY = "adaero.session_type"
+SESSION_SECRET_KEY = "adaero.session_secret"
+SESSION_TIMEOUT_S_KEY = "adaero.session_timeout_s"
+SESSION_CLEANUP_INTERVAL_S_KEY = "adaero.session_cleanup_interval_s"
 
 DEFAULT_DISPLAY_DATETIME_FORMAT = "%H:%M%p, %d %B %Y"
 ENROL_START = "enrol_start"
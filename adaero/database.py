@@ -1,14 +1,104 @@
+import threading
+import time
+
 from logging import getLogger as get_logger
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exc
 from sqlalchemy.pool import QueuePool
 
 from adaero import config, constants
 
-
 log = get_logger(__name__)
 
 
+class PoolStats(object):
+    """Counters of the connections handed out by an `InstrumentedQueuePool`
+    since the application started"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.num_checkouts = 0
+        self.num_timeouts = 0
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    def record_wait(self, wait_s, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.num_timeouts += 1
+            else:
+                self.num_checkouts += 1
+            self.total_wait_s += wait_s
+            self.max_wait_s = max(self.max_wait_s, wait_s)
+
+    def to_dict(self):
+        with self._lock:
+            num_waits = self.num_checkouts + self.num_timeouts
+            return {
+                "checkouts": self.num_checkouts,
+                "timeouts": self.num_timeouts,
+                "meanWaitS": self.total_wait_s / num_waits if num_waits else 0.0,
+                "maxWaitS": self.max_wait_s,
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """`QueuePool` recording in `stats` how long it takes to get a connection,
+    which includes waiting for one to be checked in when the pool and its
+    overflow are exhausted"""
+
+    def __init__(self, creator, stats=None, **kwargs):
+        QueuePool.__init__(self, creator, **kwargs)
+        self.stats = stats or PoolStats()
+
+    def recreate(self):
+        pool = QueuePool.recreate(self)
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start_s = time.monotonic()
+        try:
+            connection = QueuePool._do_get(self)
+        except exc.TimeoutError:
+            self.stats.record_wait(time.monotonic() - start_s, timed_out=True)
+            raise
+        self.stats.record_wait(time.monotonic() - start_s)
+        return connection
+
+
+def get_pool_status(engine):
+    """
+    Parameters
+    ----------
+    engine:
+        SQLAlchemy engine
+
+    Returns
+    -------
+    JSON-serialisable usage of the connection pool of `engine`. The sizes are
+    only known for a `QueuePool` and the wait times for an
+    `InstrumentedQueuePool`.
+    """
+    pool = engine.pool
+    status = {"poolClass": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update(
+            {
+                "size": pool.size(),
+                "checkedIn": pool.checkedin(),
+                "checkedOut": pool.checkedout(),
+                # the number of connections beyond `size` currently open
+                "overflow": max(0, pool.overflow()),
+                "maxOverflow": pool._max_overflow,
+            }
+        )
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status.update(stats.to_dict())
+    return status
+
+
 def prepare_db(settings):
     db_url = config.get_config_value(
         settings, constants.DB_URL_KEY, raise_if_not_set=True
@@ -20,6 +110,6 @@ def prepare_db(settings):
         max_overflow=40,
         echo_pool=True,
         pool_recycle=300,
-        poolclass=QueuePool,
+        poolclass=InstrumentedQueuePool,
         echo=False,
     )
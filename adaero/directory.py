@@ -0,0 +1,394 @@
+"""
+Cache of LDAP user lookups in front of `adaero.security.ldapauth.LDAPAuth`,
+as the same people are looked up over and over, such as the invitees on the
+invite page, the talent managers emailed by the email job and the managers
+in population CSVs.
+
+Lookups are cached by attribute and value, including those that found no
+user for `negative_ttl_s`, in an LRU of each process. With
+`adaero.ldap_cache_shared` set, it is backed by the `ldap_directory_cache`
+table so that the processes of a deployment share their lookups. The cache is
+dropped when a new population is uploaded, by every process within
+`GENERATION_CHECK_INTERVAL_S` when shared.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import json
+import threading
+
+import uuid
+
+from logging import getLogger as get_logger
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from adaero import constants
+from adaero.config import get_config_value
+from adaero.models import DirectoryCacheEntry
+
+log = get_logger(__name__)
+
+DEFAULT_TTL_S = 300
+DEFAULT_NEGATIVE_TTL_S = 60
+DEFAULT_MAX_SIZE = 5000
+EMAIL_KEY = "mail"
+DN_KEY = "distinguishedName"
+# row of the table whose details change whenever the cache is dropped, which
+# cannot be mistaken for a lookup as those are keyed by attribute and value
+GENERATION_KEY = "@generation"
+GENERATION_EXPIRES_UTC = datetime(9999, 12, 31)
+GENERATION_CHECK_INTERVAL_S = 5
+EXPIRED_PURGE_INTERVAL_S = 60
+
+
+class DirectoryStats(object):
+    """Lookups of a `CachedLDAPAuth`, counted across threads"""
+
+    def __init__(self):
+        self.num_hits = 0
+        self.num_negative_hits = 0
+        self.num_misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, details, is_hit):
+        with self._lock:
+            if not is_hit:
+                self.num_misses += 1
+            elif details is None:
+                self.num_negative_hits += 1
+            else:
+                self.num_hits += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "hits": self.num_hits,
+                "negativeHits": self.num_negative_hits,
+                "misses": self.num_misses,
+            }
+
+
+class MemoryDirectoryCache(object):
+    """
+    Process level, least recently used cache of LDAP details by lookup key.
+    Caches are used through `get`, `put` and `invalidate`, so other backends
+    can be substituted.
+
+    Parameters
+    ----------
+    ttl_s: `int`
+        Number of seconds the details of a user are cached for
+    negative_ttl_s: `int`
+        Number of seconds a lookup that found no user is cached for
+    max_size: `int`
+        Maximum number of lookups cached
+    """
+
+    def __init__(
+        self,
+        ttl_s=DEFAULT_TTL_S,
+        negative_ttl_s=DEFAULT_NEGATIVE_TTL_S,
+        max_size=DEFAULT_MAX_SIZE,
+    ):
+        self.ttl = timedelta(seconds=ttl_s)
+        self.negative_ttl = timedelta(seconds=negative_ttl_s)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Returns
+        -------
+        Tuple of whether `key` is cached and the details cached for it,
+        `None` if it found no user
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_utc, details = entry
+            if expires_utc <= datetime.utcnow():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, details
+
+    def put(self, key, details, expires_utc=None):
+        if expires_utc is None:
+            ttl = self.ttl if details is not None else self.negative_ttl
+            expires_utc = datetime.utcnow() + ttl
+        if self.max_size <= 0 or expires_utc <= datetime.utcnow():
+            return
+        with self._lock:
+            self._entries[key] = (expires_utc, details)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TableDirectoryCache(object):
+    """
+    Cache of LDAP details by lookup key in the `ldap_directory_cache` table,
+    shared by all processes, in front of which each process keeps a
+    `MemoryDirectoryCache`. The local cache is dropped once the generation
+    row of the table changes, which is checked at most every
+    `generation_check_interval_s` seconds, and expired rows are purged at
+    most every `EXPIRED_PURGE_INTERVAL_S` seconds. Uses `engine` directly so
+    that it does not depend on the transaction of the caller.
+
+    Parameters
+    ----------
+    engine:
+        SQLAlchemy engine of the application database
+    local: `MemoryDirectoryCache`
+        Cache of this process, whose TTLs are also used for the table
+    generation_check_interval_s: `int`
+        Number of seconds the local cache is used for before checking that
+        another process did not drop the cache
+    """
+
+    def __init__(
+        self, engine, local, generation_check_interval_s=GENERATION_CHECK_INTERVAL_S
+    ):
+        self.engine = engine
+        self.local = local
+        self.generation_check_interval = timedelta(seconds=generation_check_interval_s)
+        self._lock = threading.Lock()
+        self._generation = None
+        self._next_generation_check_utc = None
+        self._next_purge_utc = None
+
+    def _check_generation(self):
+        utcnow = datetime.utcnow()
+        with self._lock:
+            if (
+                self._next_generation_check_utc is not None
+                and utcnow < self._next_generation_check_utc
+            ):
+                return
+            self._next_generation_check_utc = utcnow + self.generation_check_interval
+            table = DirectoryCacheEntry.__table__
+            with self.engine.connect() as connection:
+                generation = connection.execute(
+                    select([table.c.details]).where(table.c.key == GENERATION_KEY)
+                ).scalar()
+            if generation != self._generation:
+                if self._generation is not None:
+                    log.info("LDAP directory cache was dropped by another process")
+                self.local.invalidate()
+                self._generation = generation
+
+    def _purge_expired(self, connection, utcnow):
+        with self._lock:
+            if self._next_purge_utc is not None and utcnow < self._next_purge_utc:
+                return
+            self._next_purge_utc = utcnow + timedelta(seconds=EXPIRED_PURGE_INTERVAL_S)
+        table = DirectoryCacheEntry.__table__
+        connection.execute(table.delete().where(table.c.expires_utc <= utcnow))
+
+    def get(self, key):
+        self._check_generation()
+        is_cached, details = self.local.get(key)
+        if is_cached:
+            return is_cached, details
+        table = DirectoryCacheEntry.__table__
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                select([table.c.details, table.c.expires_utc]).where(
+                    (table.c.key == key) & (table.c.expires_utc > datetime.utcnow())
+                )
+            ).first()
+        if row is None:
+            return False, None
+        details = json.loads(row.details) if row.details is not None else None
+        self.local.put(key, details, row.expires_utc)
+        return True, details
+
+    def put(self, key, details):
+        utcnow = datetime.utcnow()
+        ttl = self.local.ttl if details is not None else self.local.negative_ttl
+        expires_utc = utcnow + ttl
+        self.local.put(key, details, expires_utc)
+        table = DirectoryCacheEntry.__table__
+        if len(key) > table.c.key.type.length:
+            return
+        values = {
+            "details": json.dumps(details) if details is not None else None,
+            "expires_utc": expires_utc,
+        }
+        try:
+            with self.engine.begin() as connection:
+                self._purge_expired(connection, utcnow)
+                result = connection.execute(
+                    table.update().where(table.c.key == key).values(**values)
+                )
+                if not result.rowcount:
+                    connection.execute(table.insert().values(key=key, **values))
+        except IntegrityError:
+            # put by another process in the meantime
+            pass
+
+    def invalidate(self):
+        """Drop the cache of every process, those of other processes once
+        they next check the generation"""
+        generation = uuid.uuid4().hex
+        table = DirectoryCacheEntry.__table__
+        with self.engine.begin() as connection:
+            connection.execute(table.delete())
+            connection.execute(
+                table.insert().values(
+                    key=GENERATION_KEY,
+                    details=generation,
+                    expires_utc=GENERATION_EXPIRES_UTC,
+                )
+            )
+        with self._lock:
+            self.local.invalidate()
+            self._generation = generation
+
+    def __len__(self):
+        return len(self.local)
+
+
+def _build_key(param, value):
+    # attribute values such as usernames and emails match regardless of case
+    return "%s=%s" % (param, str(value).lower())
+
+
+class CachedLDAPAuth(object):
+    """
+    `LDAPAuth` whose user lookups go through `cache`, everything else being
+    delegated to `ldapsource`. Details returned are shared between callers,
+    so should not be changed.
+
+    Parameters
+    ----------
+    ldapsource: `adaero.security.ldapauth.LDAPAuth`
+    cache:
+        `MemoryDirectoryCache` or `TableDirectoryCache`
+    """
+
+    def __init__(self, ldapsource, cache):
+        self.ldapsource = ldapsource
+        self.cache = cache
+        self.stats = DirectoryStats()
+
+    def __getattr__(self, name):
+        return getattr(self.ldapsource, name)
+
+    def _lookup(self, param, value, fetch):
+        key = _build_key(param, value)
+        is_cached, details = self.cache.get(key)
+        self.stats.record(details, is_cached)
+        if not is_cached:
+            details = fetch(value)
+            self.cache.put(key, details or None)
+        return details
+
+    def get_ldap_user_by_kv(self, param, value):
+        return self._lookup(
+            param, value, lambda v: self.ldapsource.get_ldap_user_by_kv(param, v)
+        )
+
+    def get_ldap_user_by_dn(self, dn):
+        return self._lookup(DN_KEY, dn, self.ldapsource.get_ldap_user_by_dn)
+
+    def get_ldap_user_by_username(self, user_name):
+        return self._lookup(
+            self.ldapsource.username_key,
+            user_name,
+            self.ldapsource.get_ldap_user_by_username,
+        )
+
+    def get_ldap_user_by_uid(self, user_name):
+        return self._lookup(
+            self.ldapsource.uid_key, user_name, self.ldapsource.get_ldap_user_by_uid
+        )
+
+    def get_ldap_user_by_email(self, email):
+        return self._lookup(EMAIL_KEY, email, self.ldapsource.get_ldap_user_by_email)
+
+    def get_ldap_users_by_kvs(self, param, values, **kwargs):
+        """Refer to `LDAPAuth.get_ldap_users_by_kvs`, only looking up the
+        values that are not cached"""
+        found = {}
+        missing = []
+        for value in {v for v in values if v}:
+            is_cached, details = self.cache.get(_build_key(param, value))
+            self.stats.record(details, is_cached)
+            if not is_cached:
+                missing.append(value)
+            elif details is not None:
+                found[value] = details
+        if missing:
+            fetched = self.ldapsource.get_ldap_users_by_kvs(param, missing, **kwargs)
+            for value in missing:
+                self.cache.put(_build_key(param, value), fetched.get(value))
+            found.update(fetched)
+        return found
+
+    def invalidate(self):
+        log.info("Dropping the LDAP directory cache")
+        self.cache.invalidate()
+        self.ldapsource.invalidate()
+
+    def get_status(self):
+        """
+        Returns
+        -------
+        JSON-serialisable lookup counts and number of lookups cached in this
+        process
+        """
+        status = self.stats.to_dict()
+        status["size"] = len(self.cache)
+        return status
+
+
+def build_directory_cache(settings, engine=None):
+    """
+    Returns
+    -------
+    Cache configured by `settings`, `None` if disabled
+    """
+    ttl_s = int(
+        get_config_value(settings, constants.LDAP_CACHE_TTL_S_KEY, DEFAULT_TTL_S)
+    )
+    if ttl_s <= 0:
+        return None
+    local = MemoryDirectoryCache(
+        ttl_s,
+        int(
+            get_config_value(
+                settings,
+                constants.LDAP_CACHE_NEGATIVE_TTL_S_KEY,
+                DEFAULT_NEGATIVE_TTL_S,
+            )
+        ),
+        int(
+            get_config_value(settings, constants.LDAP_CACHE_SIZE_KEY, DEFAULT_MAX_SIZE)
+        ),
+    )
+    if engine is not None and get_config_value(
+        settings, constants.LDAP_CACHE_SHARED_KEY
+    ):
+        return TableDirectoryCache(engine, local)
+    return local
+
+
+def includeme(config):
+    """Put the cache in front of the LDAP client registered by
+    `adaero.models`, so that it is used by requests and background jobs"""
+    cache = build_directory_cache(config.get_settings(), config.registry["dbengine"])
+    if cache is None:
+        log.info("LDAP directory cache is disabled")
+        return
+    config.registry["ldapsource"] = CachedLDAPAuth(config.registry["ldapsource"], cache)
@@ -0,0 +1,163 @@
+"""
+Leader election between the processes of a deployment through leases held in
+the `scheduler_leases` table of the application database, so that jobs
+scheduled in every process only run in one of them.
+
+A lease is taken with a conditional update that only succeeds if it is free,
+expired or already held by the same process, which is atomic on any database
+including SQLite. The leader renews it every third of its time to live, so if
+the leader dies another process takes over at most `4 / 3 * ttl_s` seconds
+later. The clocks of the hosts are assumed to be synchronised.
+"""
+
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from logging import getLogger as get_logger
+from sqlalchemy import case, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import and_, or_
+
+from adaero.models import SchedulerLease
+
+log = get_logger(__name__)
+
+DEFAULT_LEASE_TTL_S = 60
+
+
+def _build_holder_id():
+    return "%s:%s:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class LeaderLease(object):
+    """
+    Lease on the `name` row of `scheduler_leases`, using `engine` directly so
+    that it does not depend on the transaction of the caller.
+
+    Parameters
+    ----------
+    engine:
+        SQLAlchemy engine of the application database
+    name: `str`
+        Name of the lease, processes only compete for leases of the same name
+    ttl_s: `int`
+        Number of seconds the lease is held for after each renewal
+    holder: `str`
+        Identifies this process, defaults to the hostname, pid and a random
+        suffix
+    """
+
+    def __init__(self, engine, name, ttl_s=DEFAULT_LEASE_TTL_S, holder=None):
+        self.engine = engine
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_s)
+        self.holder = holder or _build_holder_id()
+        self._lock = threading.Lock()
+        # when the lease expires as far as this process knows, `None` if not
+        # held
+        self._expires_utc = None
+
+    @property
+    def renew_interval_s(self):
+        return self.ttl.total_seconds() / 3
+
+    @property
+    def is_held(self):
+        expires_utc = self._expires_utc
+        return expires_utc is not None and datetime.utcnow() < expires_utc
+
+    def acquire(self):
+        """
+        Take the lease if it is free or expired, or else renew it if already
+        held by this process.
+
+        Returns
+        -------
+        If the lease is held by this process
+        """
+        with self._lock:
+            was_held = self.is_held
+            utcnow = datetime.utcnow()
+            try:
+                if self._update(utcnow) or self._insert(utcnow):
+                    self._expires_utc = utcnow + self.ttl
+                else:
+                    self._expires_utc = None
+            except Exception as e:
+                # no other process can take the lease before it expires, so
+                # it is still held until then
+                log.exception(e)
+            is_held = self.is_held
+            if is_held and not was_held:
+                log.info("%s is now the leader of %s" % (self.holder, self.name))
+            elif was_held and not is_held:
+                log.warning("%s lost the lease of %s" % (self.holder, self.name))
+            return is_held
+
+    def release(self):
+        """Expire the lease if held by this process, so that another process
+        can take over straight away"""
+        with self._lock:
+            if self._expires_utc is None:
+                return
+            self._expires_utc = None
+            table = SchedulerLease.__table__
+            with self.engine.begin() as connection:
+                connection.execute(
+                    table.update()
+                    .where(
+                        and_(table.c.name == self.name, table.c.holder == self.holder)
+                    )
+                    .values(expires_utc=datetime.utcnow())
+                )
+            log.info("%s released the lease of %s" % (self.holder, self.name))
+
+    def _update(self, utcnow):
+        table = SchedulerLease.__table__
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                table.update()
+                .where(
+                    and_(
+                        table.c.name == self.name,
+                        or_(
+                            table.c.holder == self.holder,
+                            table.c.expires_utc <= utcnow,
+                        ),
+                    )
+                )
+                .values(
+                    acquired_utc=case(
+                        [(table.c.holder == self.holder, table.c.acquired_utc)],
+                        else_=utcnow,
+                    ),
+                    holder=self.holder,
+                    expires_utc=utcnow + self.ttl,
+                )
+            )
+            return result.rowcount == 1
+
+    def _insert(self, utcnow):
+        table = SchedulerLease.__table__
+        with self.engine.connect() as connection:
+            if connection.execute(
+                select([table.c.name]).where(table.c.name == self.name)
+            ).first():
+                return False
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(
+                    table.insert().values(
+                        name=self.name,
+                        holder=self.holder,
+                        acquired_utc=utcnow,
+                        expires_utc=utcnow + self.ttl,
+                    )
+                )
+        except IntegrityError:
+            # taken by another process in the meantime
+            return False
+        return True
@@ -1,10 +1,15 @@
 # -*- encoding: utf-8 -*-
+import atexit
 import json
 import os
-import smtplib
 import socket
+import threading
 import time
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
+from functools import lru_cache, partial
+from itertools import islice
+from email.charset import Charset
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
@@ -14,13 +19,20 @@ from logging import getLogger as get_logger
 from apscheduler.events import EVENT_JOB_EXECUTED, EVENT_JOB_ERROR
 from apscheduler.schedulers.background import BackgroundScheduler
 from bs4 import BeautifulSoup
-from sqlalchemy.orm import joinedload
-from sqlalchemy.sql import and_
+from pytz import utc
+from markupsafe import escape
+from sqlalchemy import case, func
+from sqlalchemy.orm import aliased
+from sqlalchemy.sql import or_
 
 from adaero import constants
 from adaero.config import get_config_value
 from adaero.date import datetimeformat
+from adaero.lease import DEFAULT_LEASE_TTL_S, LeaderLease
 from adaero.models import (
+    EmailOutbox,
+    ExternalInvite,
+    Nominee,
     User,
     Period,
     FeedbackForm,
@@ -29,63 +41,103 @@ from adaero.models import (
     get_session_factory,
 )
 from adaero.security.ldapauth import build_ldapauth_from_settings
+from adaero.smtp import SMTPDispatcher, DEFAULT_SMTP_CONNECTIONS
+from adaero.transitions import (
+    TransitionScheduler,
+    freeze_stats_on_review,
+    warm_period_clock,
+)
 
 log = get_logger(__name__)
 
 DEFAULT_EMAIL_DELAY_S = 5
-DEFAULT_EMAIL_DELAY_BETWEEN_S = 0.5
+DEFAULT_EMAIL_MAX_PER_S = 20
+OUTBOX_BATCH_SIZE = 200
+# a failed email is retried after 1, 2, 4 and 8 minutes before giving up
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BACKOFF_S = 60
+# emails claimed by a delivery that did not record their outcome in this time,
+# as it was stopped, are pending again
+OUTBOX_CLAIM_TIMEOUT_S = 15 * 60
+OUTBOX_ALIAS = aliased(EmailOutbox)
+EMAIL_JOB_LEASE_NAME = "email_job"
+OUTBOX_JOB_ID = "outbox_delivery"
+OUTBOX_NOW_JOB_ID = "outbox_delivery_now"
+# each invite has its own code, so that a user invited by several users in a
+# period gets each of the emails
+INVITE_TEMPLATE_CODE_TMPL = "invite-%s"
+AUDIENCE_YIELD_PER = 500
+MANAGER_ALIAS = aliased(User)
+REPORT_ALIAS = aliased(User)
+# stands in for a recipient attribute in a compiled message, so must not be
+# changed by HTML escaping nor by extracting the plain text
+RECIPIENT_FIELD_MARKER = "@@adaero-recipient-%s@@"
+PLAIN_PART_MARKER = RECIPIENT_FIELD_MARKER % "plain-part"
+HTML_PART_MARKER = RECIPIENT_FIELD_MARKER % "html-part"
+UTF8_CHARSET = Charset("utf-8")
 
 
-def get_employee_users(dbsession):
-    with transaction.manager:
-        return (
-            dbsession.query(User)
-            .options(joinedload("manager"))
-            .filter(User.is_staff == True)  # noqa
-            .all()
+def _query_audience(dbsession, *criterion):
+    """
+    Build a query for the details of the users matching `criterion` that are
+    needed to render their emails, streamed `AUDIENCE_YIELD_PER` rows at a
+    time rather than loading every `User`. The query is only run once
+    iterated, which must be within a transaction.
+    """
+    return (
+        dbsession.query(
+            User.username,
+            User.email,
+            User.first_name,
+            User.last_name,
+            User.location,
+            MANAGER_ALIAS.first_name.label("manager_first_name"),
+            MANAGER_ALIAS.last_name.label("manager_last_name"),
         )
+        .outerjoin(MANAGER_ALIAS, MANAGER_ALIAS.username == User.manager_username)
+        .filter(*criterion)
+        .order_by(User.username)
+        .yield_per(AUDIENCE_YIELD_PER)
+    )
 
 
-def get_non_nominated_users(dbsession):
-    with transaction.manager:
+def get_employee_users(dbsession):
+    return _query_audience(dbsession, User.is_staff == True)  # noqa
+
+
+def get_non_nominated_users(dbsession, period=None):
+    if period is None:
         period = Period.get_current_period(dbsession)
-        users = (
-            dbsession.query(User)
-            .options(joinedload("nominations"), joinedload("manager"))
-            .filter(User.is_staff == True)  # noqa
-            .all()
-        )
-        return [
-            u for u in users if period.id not in {n.period_id for n in u.nominations}
-        ]
+    nominated = (
+        dbsession.query(Nominee.id)
+        .filter(Nominee.username == User.username, Nominee.period_id == period.id)
+        .exists()
+    )
+    return _query_audience(dbsession, User.is_staff == True, ~nominated)  # noqa
 
 
 def get_manager_users(dbsession):
-    with transaction.manager:
-        return (
-            dbsession.query(User)
-            .options(joinedload("direct_reports").joinedload("manager"))
-            .filter(User.direct_reports != None)  # noqa
-            .all()
-        )
+    has_direct_reports = (
+        dbsession.query(REPORT_ALIAS.username)
+        .filter(REPORT_ALIAS.manager_username == User.username)
+        .exists()
+    )
+    return _query_audience(dbsession, has_direct_reports)
 
 
-def get_summarised_users(dbsession):
-    with transaction.manager:
+def get_summarised_users(dbsession, period=None):
+    if period is None:
         period = Period.get_current_period(dbsession)
-        return (
-            dbsession.query(User)
-            .options(joinedload("manager"))
-            .join(
-                FeedbackForm,
-                and_(
-                    FeedbackForm.to_username == User.username,
-                    FeedbackForm.period_id == period.id,
-                    FeedbackForm.is_summary == True,
-                ),
-            )  # noqa
-            .all()
+    is_summarised = (
+        dbsession.query(FeedbackForm.id)
+        .filter(
+            FeedbackForm.to_username == User.username,
+            FeedbackForm.period_id == period.id,
+            FeedbackForm.is_summary == True,  # noqa
         )
+        .exists()
+    )
+    return _query_audience(dbsession, is_summarised)
 
 
 def _build_full_subject(company_name, subject):
@@ -123,12 +175,50 @@ def get_root_url(settings):
     return root_url
 
 
-def _generate_message_root(html, from_, subject, reply_to=None):
+def _get_email_rate_per_s(settings, delay_between_s=None):
+    """`adaero.email_delay_between_s` is only used when set and
+    `adaero.email_max_per_s` is not, as it predates concurrent sending"""
+    if delay_between_s is None:
+        max_per_s = get_config_value(settings, constants.EMAIL_MAX_PER_S_KEY)
+        if max_per_s is not None:
+            return float(max_per_s)
+        delay_between_s = get_config_value(
+            settings, constants.EMAIL_DELAY_BETWEEN_S_KEY
+        )
+        if delay_between_s is None:
+            return float(DEFAULT_EMAIL_MAX_PER_S)
+    delay_between_s = float(delay_between_s)
+    return 1 / delay_between_s if delay_between_s > 0 else 0
+
+
+def _build_smtp_dispatcher(settings, delay_between_s=None):
+    num_connections = int(
+        get_config_value(
+            settings, constants.EMAIL_SMTP_CONNECTIONS_KEY, DEFAULT_SMTP_CONNECTIONS
+        )
+    )
+    rate_per_s = _get_email_rate_per_s(settings, delay_between_s)
+    log.info(
+        "Sending emails over %s SMTP connections, %s"
+        % (
+            num_connections,
+            "at most %s a second" % rate_per_s if rate_per_s else "without limit",
+        )
+    )
+    return SMTPDispatcher(num_connections, rate_per_s)
+
+
+def _html_to_plain(html):
     soup = BeautifulSoup(html, "lxml")
     # get_text replaces html with whitespace. passing `strip=True` removes
     # this at the expense of removing whitespace for the url link. so use
     # python strip instead
-    plain = soup.get_text().strip()
+    return soup.get_text().strip()
+
+
+def _generate_message_root(html, from_, subject, reply_to=None, plain=None):
+    if plain is None:
+        plain = _html_to_plain(html)
 
     message_root = MIMEMultipart("alternative")
     # we don't set 'To' so that if the SMTP server amalgamates the emails,
@@ -144,26 +234,211 @@ def _generate_message_root(html, from_, subject, reply_to=None):
     return message_root
 
 
-def check_and_send_email(
-    dbsession,
-    ldapsource,
-    settings,
-    template_key=None,
-    force=False,
-    delay_s=None,
-    delay_between_s=None,
+class _RecipientPlaceholder(object):
+    """Rendered in place of the recipient, each attribute being output as a
+    marker to substitute, apart from `location` that decides the timezone of
+    the dates in the email"""
+
+    def __init__(self, location):
+        self.location = location
+        self.fields = set()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        self.fields.add(name)
+        return RECIPIENT_FIELD_MARKER % name
+
+
+class CompiledMessage(object):
+    """
+    Email rendered once for all recipients sharing a location, with the
+    recipient attributes used by the template substituted per message. The
+    plain text and the MIME structure are only generated once, so the
+    template may only output recipient attributes as is, not use them in
+    conditions or filters.
+
+    Parameters
+    ----------
+    template:
+      jinja2 template, rendered with the recipient as `user`
+    location: `str`
+      location of the recipients
+    from_: `str`
+    subject: `str`
+    context:
+      other variables used by the template
+    """
+
+    def __init__(self, template, location, from_, subject, **context):
+        placeholder = _RecipientPlaceholder(location)
+        html = template.render(user=placeholder, **context)
+        self.fields = sorted(placeholder.fields)
+        self.html = html
+        self.plain = _html_to_plain(html)
+        # substituting the encoded parts in the generated message is
+        # equivalent to generating it with the parts
+        message_root = _generate_message_root(html, from_, subject)
+        plain_part, html_part = message_root.get_payload()
+        plain_part.set_payload(PLAIN_PART_MARKER)
+        html_part.set_payload(HTML_PART_MARKER)
+        self.message_str = message_root.as_string()
+
+    def render(self, user):
+        """Full message for `user`, as given to `smtplib.SMTP.sendmail`"""
+        html, plain = self.html, self.plain
+        for name in self.fields:
+            marker = RECIPIENT_FIELD_MARKER % name
+            value = getattr(user, name)
+            value = "" if value is None else str(value)
+            html = html.replace(marker, escape(value))
+            plain = plain.replace(marker, value)
+        return self.message_str.replace(
+            PLAIN_PART_MARKER, UTF8_CHARSET.body_encode(plain)
+        ).replace(HTML_PART_MARKER, UTF8_CHARSET.body_encode(html))
+
+
+def _render_period_emails(
+    env, template_info, users, current_period, app_host, company_name, from_email
+):
+    """Generate the username, email address and full message of the period
+    email for each of `users` that has an email address. The template is only
+    rendered once per location of the users."""
+    subject = _build_full_subject(company_name, template_info["summary"])
+    template = env.get_template(os.path.join("email", template_info["template"]))
+    compiled_by_location = {}
+    for user in users:
+        if not user.email:
+            log.warning(
+                "Unable to send email for user %s as no email available" % user.username
+            )
+            continue
+        try:
+            compiled = compiled_by_location.get(user.location)
+            if compiled is None:
+                compiled = compiled_by_location[user.location] = CompiledMessage(
+                    template,
+                    user.location,
+                    from_email,
+                    subject,
+                    period=current_period,
+                    app_host=app_host,
+                    company_name=company_name,
+                )
+            yield user.username, user.email, compiled.render(user)
+        except Exception as e:
+            log.exception(e)
+            log.error(
+                "Exception occured with rendering email to %s, "
+                "skipping over and continuing..." % user.email
+            )
+
+
+def enqueue_emails(
+    dbsession, period_id, template_code, from_email, messages, is_confirmation=False
 ):
     """
-    Check current conditions and if we haven't sent the relevant email, send
-    templated both plain text and HTML content to all relevant email addresses
-    using the configured SMTP server.
+    Add emails to the outbox, skipping recipients that already have an email
+    with the same code for the period, so that this can be repeated after
+    being interrupted. Must be called within a transaction, emails are
+    flushed and then expunged from `dbsession` in batches so that `messages`
+    can be streamed from the database in the same transaction.
+
+    Parameters
+    ----------
+    dbsession:
+      sqlalchemy session
+    period_id: `int`
+    template_code: `str`
+      code from `adaero.constants.EMAIL_TEMPLATE_MAP`
+    from_email: `str`
+    messages:
+      iterable of username, email address and full message
+    is_confirmation: `bool`
+      if the emails are the confirmations sent to talent managers
+
+    Returns
+    -------
+    Number of emails added
+    """
+    existing = {
+        to_email
+        for to_email, in dbsession.query(EmailOutbox.to_email).filter(
+            EmailOutbox.period_id == period_id,
+            EmailOutbox.template_code == template_code,
+            EmailOutbox.is_confirmation == is_confirmation,
+        )
+    }
+    num_added = 0
+    messages = iter(messages)
+    while True:
+        batch = list(islice(messages, OUTBOX_BATCH_SIZE))
+        if not batch:
+            break
+        utcnow = datetime.utcnow()
+        emails = []
+        for to_username, to_email, message in batch:
+            if to_email in existing:
+                continue
+            existing.add(to_email)
+            emails.append(
+                EmailOutbox(
+                    period_id=period_id,
+                    template_code=template_code,
+                    is_confirmation=is_confirmation,
+                    to_username=to_username,
+                    to_email=to_email,
+                    from_email=from_email,
+                    message=message,
+                    status=EmailOutbox.PENDING,
+                    attempts=0,
+                    created_utc=utcnow,
+                    next_attempt_utc=utcnow,
+                )
+            )
+        dbsession.add_all(emails)
+        dbsession.flush()
+        for email in emails:
+            dbsession.expunge(email)
+        num_added += len(emails)
+    return num_added
+
+
+def _clear_delivered_from_outbox(dbsession, period_id, template_code):
+    """Remove the delivered emails and confirmations of a period email from
+    the outbox so that it can be sent again. Pending emails are left in
+    place as they were added by an interrupted run, which is now resumed, as
+    are emails being sent."""
+    with transaction.manager:
+        num_rows = (
+            dbsession.query(EmailOutbox)
+            .filter(
+                EmailOutbox.period_id == period_id,
+                EmailOutbox.template_code == template_code,
+                EmailOutbox.status != EmailOutbox.SENDING,
+                or_(
+                    EmailOutbox.status != EmailOutbox.PENDING,
+                    EmailOutbox.is_confirmation == True,  # noqa
+                ),
+            )
+            .delete(synchronize_session=False)
+        )
+    if num_rows:
+        log.info(
+            "Removed %s emails with code %s from the outbox to send them again"
+            % (num_rows, template_code)
+        )
+
+
+def enqueue_period_email(dbsession, settings, template_key=None, force=False):
+    """
+    Check current conditions and if we haven't already, render the relevant
+    period email for all of its audience and add them to the outbox.
 
     Parameters
     ----------
     dbsession:
       sqlalchemy session
-    ldapsource:
-      used for fetching talent manager email information
     settings:
       configpaste settings
     template_key:
@@ -171,14 +446,11 @@ def check_and_send_email(
       `adaero.constants.EMAIL_TEMPLATE_MAP`
     force:
       if particular email already sent, send anyway
-    delay_s:
-      number of seconds to delay before sending emails. If none, look in
-      settings
-    delay_between_s:
-      number of seconds to delay before sending emails. If none, look in
-      settings
+
+    Returns
+    -------
+    Number of emails added to the outbox
     """
-    log.info("Begin: Sending emails")
     current_period = Period.get_current_period(dbsession)
     location = get_config_value(settings, constants.HOMEBASE_LOCATION_KEY)
     if template_key:
@@ -188,27 +460,26 @@ def check_and_send_email(
         template_info = current_period.current_email_template(location)
         if not template_info:
             log.warning("Attempted to send an email while period is inactive")
-            return
+            return 0
 
     last_sent = current_period.get_email_flag_by_code(template_info["code"])
     if not force and last_sent:
-        log.warning(
+        log.info(
             "Email code %s already sent at %s so not doing again, "
             "override with `force=True` kwarg." % (template_info["code"], last_sent)
         )
-        return
+        return 0
 
     audience = template_info["audience"]
     company_name = get_config_value(settings, constants.COMPANY_NAME_KEY, "")
-    subject = _build_full_subject(company_name, template_info["summary"])
     if audience == "employee":
         users = get_employee_users(dbsession)
     elif audience == "non-nominated":
-        users = get_non_nominated_users(dbsession)
+        users = get_non_nominated_users(dbsession, current_period)
     elif audience == "manager":
         users = get_manager_users(dbsession)
     elif audience == "summarised":
-        users = get_summarised_users(dbsession)
+        users = get_summarised_users(dbsession, current_period)
     else:
         raise ValueError(
             'Audience value "%s" not in allowed values "%s". '
@@ -216,86 +487,64 @@ def check_and_send_email(
             % (audience, ", ".join(constants.AUDIENCE_VALUES))
         )
 
-    emailing_enabled = _get_send_email_flag(settings)
-    app_host = get_root_url(settings)
-
-    # calculate email stats
-    users_with_emails = []
-    for user in users:
-        if not user.email:
-            log.warning(
-                "Unable to send email for user %s as no email available" % user.username
-            )
-        else:
-            users_with_emails.append(user)
-
-    if delay_s is None:
-        delay_s = float(
-            get_config_value(
-                settings, constants.EMAIL_START_DELAY_S_KEY, DEFAULT_EMAIL_DELAY_S
-            )
+    num_added = 0
+    if _get_send_email_flag(settings):
+        _clear_delivered_from_outbox(
+            dbsession, current_period.id, template_info["code"]
         )
-    if delay_between_s is None:
-        delay_between_s = float(
-            get_config_value(
-                settings,
-                constants.EMAIL_DELAY_BETWEEN_S_KEY,
-                DEFAULT_EMAIL_DELAY_BETWEEN_S,
+        from_email = get_config_value(settings, constants.SUPPORT_EMAIL_KEY)
+        messages = _render_period_emails(
+            _build_template_env(),
+            template_info,
+            users,
+            current_period,
+            get_root_url(settings),
+            company_name,
+            from_email,
+        )
+        # the audience is streamed while the emails are added
+        with transaction.manager:
+            num_added = enqueue_emails(
+                dbsession,
+                current_period.id,
+                template_info["code"],
+                from_email,
+                messages,
             )
+        log.info(
+            'Added %s "%s" emails to the outbox' % (num_added, template_info["code"])
         )
 
-    log.info(
-        'Sending %s "%s" emails in %s seconds...'
-        % (template_info["code"], len(users_with_emails), delay_s)
-    )
-    time.sleep(delay_s)
-    log.info("Sending %s emails now..." % len(users_with_emails))
+    # only flagged once every email is in the outbox, so that an interrupted
+    # run is completed by the next one
+    with transaction.manager:
+        current_period.set_email_flag_by_code(template_info["code"])
+        dbsession.merge(current_period)
+    return num_added
 
-    env = _build_template_env()
-    have_sent_emails = False
 
-    from_email = get_config_value(settings, constants.SUPPORT_EMAIL_KEY)
+def _get_template_info_by_code(code):
+    for template_info in constants.EMAIL_TEMPLATE_MAP.values():
+        if template_info["code"] == code:
+            return template_info
+    return None
 
-    s = smtplib.SMTP()
-    s.connect()
-
-    for user in users:
-        if not user.email:
-            continue
-        try:
-            # because of the modelling of User <-> Manager, attempting to fetch
-            # manager directly despite being joinloaded will result in an SELECT
-            # to prevent db access by testing against local manager_username
-            template = env.get_template(
-                os.path.join("email", template_info["template"])
-            )
-            rendered_html = template.render(
-                user=user,
-                period=current_period,
-                app_host=app_host,
-                company_name=company_name,
-            )
-            message_root = _generate_message_root(rendered_html, from_email, subject)
-
-            if emailing_enabled:
-                s.sendmail(from_email, [user.email], message_root.as_string())
-                have_sent_emails = True
-            log.debug("Email sent to %s" % user.email)
-        except Exception as e:
-            log.exception(e)
-            log.error(
-                "Exception occured with sending email to %s, "
-                "skipping over and continuing..." % user.email
-            )
-        time.sleep(delay_between_s)
 
+def _get_talent_managers(settings):
     tm_usernames = settings[constants.TALENT_MANAGER_USERNAMES_KEY]
     if not isinstance(tm_usernames, list):
-        talent_managers = json.loads(settings[constants.TALENT_MANAGER_USERNAMES_KEY])
-    else:
-        talent_managers = settings[constants.TALENT_MANAGER_USERNAMES_KEY]
+        return json.loads(tm_usernames)
+    return tm_usernames
 
-    for tm_username in talent_managers:
+
+def _render_confirmation_emails(
+    env, ldapsource, settings, subject, num_sent, num_failed, sent_utc, from_email
+):
+    """Generate the username, email address and full message of the email
+    confirming to each talent manager how many emails were delivered"""
+    company_name = get_config_value(settings, constants.COMPANY_NAME_KEY, "")
+    app_host = get_root_url(settings)
+    for tm_username in _get_talent_managers(settings):
         try:
             tm_ldap = ldapsource.get_ldap_user_by_username(tm_username)
             if not tm_ldap:
@@ -307,15 +556,15 @@ def check_and_send_email(
                 continue
             tm = User.create_from_ldap_details(ldapsource, tm_ldap)
 
-            # send confirmation email
             template = env.get_template(
                 os.path.join("email", "tm_confirmation.html.j2")
             )
             rendered_html = template.render(
                 talent_manager=tm,
                 subject=subject,
-                num_emails=len(users_with_emails),
-                datetime_sent_utc=datetime.utcnow(),
+                num_emails=num_sent,
+                num_failed=num_failed,
+                datetime_sent_utc=sent_utc,
                 app_host=app_host,
             )
             message_root = _generate_message_root(
@@ -323,61 +572,515 @@ def check_and_send_email(
                 from_email,
                 _build_full_subject(company_name, "Emails sent"),
             )
-            if emailing_enabled and have_sent_emails:
-                s.sendmail(from_email, [tm.email], message_root.as_string())
+            yield tm.username, tm.email, message_root.as_string()
         except Exception as e:
             log.exception(e)
             log.error(
-                "Exception occured with sending tm email to %s, "
+                "Exception occured with rendering tm email to %s, "
                 "skipping over and continuing..." % tm_username
             )
 
-    s.close()
 
-    log.info("Sent %s emails!" % (len(users_with_emails) + 1))
+def enqueue_confirmation_emails(dbsession, ldapsource, settings):
+    """
+    Add confirmation emails for talent managers, with the real number of
+    emails delivered, for every period email that has finished delivering
+    and that was not yet confirmed.
+
+    Returns
+    -------
+    Number of emails added to the outbox
+    """
+    confirmed = (
+        dbsession.query(EmailOutbox.id)
+        .filter(
+            EmailOutbox.is_confirmation == True,  # noqa
+            EmailOutbox.period_id == OUTBOX_ALIAS.period_id,
+            EmailOutbox.template_code == OUTBOX_ALIAS.template_code,
+        )
+        .exists()
+    )
+    status_counts = [
+        func.sum(case([(criterion, 1)], else_=0))
+        for criterion in (
+            OUTBOX_ALIAS.status.in_((EmailOutbox.PENDING, EmailOutbox.SENDING)),
+            OUTBOX_ALIAS.status == EmailOutbox.SENT,
+            OUTBOX_ALIAS.status == EmailOutbox.FAILED,
+        )
+    ]
+    with transaction.manager:
+        groups = (
+            dbsession.query(
+                OUTBOX_ALIAS.period_id,
+                OUTBOX_ALIAS.template_code,
+                func.max(OUTBOX_ALIAS.sent_utc),
+                *status_counts
+            )
+            .filter(
+                OUTBOX_ALIAS.is_confirmation == False,  # noqa
+                OUTBOX_ALIAS.invite_id == None,  # noqa
+                ~confirmed,
+            )
+            .group_by(OUTBOX_ALIAS.period_id, OUTBOX_ALIAS.template_code)
+            .all()
+        )
+    env = _build_template_env()
+    company_name = get_config_value(settings, constants.COMPANY_NAME_KEY, "")
+    from_email = get_config_value(settings, constants.SUPPORT_EMAIL_KEY)
+    num_added = 0
+    for period_id, code, sent_utc, num_pending, num_sent, num_failed in groups:
+        template_info = _get_template_info_by_code(code)
+        if num_pending or not num_sent or template_info is None:
+            continue
+        subject = _build_full_subject(company_name, template_info["summary"])
+        messages = _render_confirmation_emails(
+            env,
+            ldapsource,
+            settings,
+            subject,
+            num_sent,
+            num_failed,
+            sent_utc,
+            from_email,
+        )
+        with transaction.manager:
+            num_added += enqueue_emails(
+                dbsession, period_id, code, from_email, messages, is_confirmation=True
+            )
+    return num_added
+
+
+def _release_stale_claims(dbsession):
+    """Make emails claimed by a delivery that stopped before recording their
+    outcome pending again, they may have been sent"""
     with transaction.manager:
-        current_period.set_email_flag_by_code(template_info["code"])
-        dbsession.merge(current_period)
+        num_rows = (
+            dbsession.query(EmailOutbox)
+            .filter(
+                EmailOutbox.status == EmailOutbox.SENDING,
+                EmailOutbox.next_attempt_utc <= datetime.utcnow(),
+            )
+            .update(
+                {EmailOutbox.status: EmailOutbox.PENDING, EmailOutbox.claimed_by: None},
+                synchronize_session=False,
+            )
+        )
+    if num_rows:
+        log.warning(
+            "Released %s emails claimed more than %s seconds ago, they will be "
+            "sent again" % (num_rows, OUTBOX_CLAIM_TIMEOUT_S)
+        )
+
+
+def _claim_outbox_batch(dbsession, claimed_by):
+    """Claim the next batch of pending emails that are due. The claim only
+    applies to the emails still pending, so that a concurrent delivery does
+    not send the emails it claimed first."""
+    utcnow = datetime.utcnow()
+    with transaction.manager:
+        due_ids = [
+            outbox_id
+            for outbox_id, in dbsession.query(EmailOutbox.id)
+            .filter(
+                EmailOutbox.status == EmailOutbox.PENDING,
+                EmailOutbox.next_attempt_utc <= utcnow,
+            )
+            .order_by(EmailOutbox.id)
+            .limit(OUTBOX_BATCH_SIZE)
+        ]
+        if not due_ids:
+            return None
+        dbsession.query(EmailOutbox).filter(
+            EmailOutbox.id.in_(due_ids), EmailOutbox.status == EmailOutbox.PENDING
+        ).update(
+            {
+                EmailOutbox.status: EmailOutbox.SENDING,
+                EmailOutbox.claimed_by: claimed_by,
+                EmailOutbox.next_attempt_utc: utcnow
+                + timedelta(seconds=OUTBOX_CLAIM_TIMEOUT_S),
+            },
+            synchronize_session=False,
+        )
+    with transaction.manager:
+        return (
+            dbsession.query(
+                EmailOutbox.id,
+                EmailOutbox.from_email,
+                EmailOutbox.to_email,
+                EmailOutbox.message,
+            )
+            .filter(
+                EmailOutbox.id.in_(due_ids),
+                EmailOutbox.status == EmailOutbox.SENDING,
+                EmailOutbox.claimed_by == claimed_by,
+            )
+            .order_by(EmailOutbox.id)
+            .all()
+        )
+
+
+def _drain_outbox(dbsession, dispatcher):
+    """Deliver every pending email that is due, a batch at a time, only
+    sending the emails of each batch that were claimed by this call"""
+    _release_stale_claims(dbsession)
+    claimed_by = uuid.uuid4().hex
+    while True:
+        batch = _claim_outbox_batch(dbsession, claimed_by)
+        if batch is None:
+            return
+        errors = {}
+        for outbox_id, from_email, to_email, message in batch:
+            dispatcher.send(
+                from_email, [to_email], message, partial(errors.__setitem__, outbox_id)
+            )
+        dispatcher.wait()
+        _record_outbox_results(dbsession, claimed_by, [row[0] for row in batch], errors)
+
+
+def _record_invite_email_status(dbsession, invite_ids, status, utcnow):
+    if invite_ids:
+        dbsession.query(ExternalInvite).filter(
+            ExternalInvite.id.in_(invite_ids)
+        ).update(
+            {
+                ExternalInvite.email_status: status,
+                ExternalInvite.email_updated_utc: utcnow,
+            },
+            synchronize_session=False,
+        )
+
+
+def _record_outbox_results(dbsession, claimed_by, outbox_ids, errors):
+    """Record the outcome of the emails still claimed by `claimed_by`, those
+    released as stale meanwhile being left to the delivery now sending them,
+    as well as of the invites once their email is sent or given up on"""
+    utcnow = datetime.utcnow()
+    sent_ids = [i for i in outbox_ids if i in errors and errors[i] is None]
+    failed_invite_ids = []
+    with transaction.manager:
+        if sent_ids:
+            sent_invite_ids = [
+                invite_id
+                for invite_id, in dbsession.query(EmailOutbox.invite_id).filter(
+                    EmailOutbox.id.in_(sent_ids),
+                    EmailOutbox.claimed_by == claimed_by,
+                    EmailOutbox.invite_id != None,  # noqa
+                )
+            ]
+            _record_invite_email_status(
+                dbsession, sent_invite_ids, ExternalInvite.EMAIL_SENT, utcnow
+            )
+            dbsession.query(EmailOutbox).filter(
+                EmailOutbox.id.in_(sent_ids), EmailOutbox.claimed_by == claimed_by
+            ).update(
+                {
+                    EmailOutbox.status: EmailOutbox.SENT,
+                    EmailOutbox.claimed_by: None,
+                    EmailOutbox.attempts: EmailOutbox.attempts + 1,
+                    EmailOutbox.sent_utc: utcnow,
+                },
+                synchronize_session=False,
+            )
+        for outbox_id in outbox_ids:
+            if outbox_id in sent_ids:
+                continue
+            row = dbsession.query(EmailOutbox).get(outbox_id)
+            if row is None or row.claimed_by != claimed_by:
+                continue
+            row.claimed_by = None
+            row.attempts += 1
+            row.last_error = str(errors.get(outbox_id, "Not handled"))[:1024]
+            if row.attempts >= OUTBOX_MAX_ATTEMPTS:
+                log.error(
+                    "Giving up on email to %s after %s attempts"
+                    % (row.to_email, row.attempts)
+                )
+                row.status = EmailOutbox.FAILED
+                if row.invite_id is not None:
+                    failed_invite_ids.append(row.invite_id)
+            else:
+                row.status = EmailOutbox.PENDING
+                row.next_attempt_utc = utcnow + timedelta(
+                    seconds=OUTBOX_RETRY_BACKOFF_S * 2 ** (row.attempts - 1)
+                )
+        _record_invite_email_status(
+            dbsession, failed_invite_ids, ExternalInvite.EMAIL_FAILED, utcnow
+        )
+
+
+def deliver_email_outbox(dbsession, ldapsource, settings, delay_between_s=None):
+    """
+    Deliver all pending emails in the outbox that are due, retrying failed
+    ones with exponential backoff, then confirm finished period emails to
+    talent managers.
+
+    Parameters
+    ----------
+    dbsession:
+      sqlalchemy session
+    ldapsource:
+      used for fetching talent manager email information
+    settings:
+      configpaste settings
+    delay_between_s:
+      average number of seconds between each email sent, 0 for no limit. If
+      none, look in settings
+
+    Returns
+    -------
+    Number of emails sent and of those that failed to send
+    """
+    if not _get_send_email_flag(settings):
+        return 0, 0
+    with _build_smtp_dispatcher(settings, delay_between_s) as dispatcher:
+        _drain_outbox(dbsession, dispatcher)
+        if enqueue_confirmation_emails(dbsession, ldapsource, settings):
+            _drain_outbox(dbsession, dispatcher)
+    log.info(
+        "Sent %s emails, %s failed!" % (dispatcher.num_sent, dispatcher.num_failed)
+    )
+    return dispatcher.num_sent, dispatcher.num_failed
+
+
+def check_and_send_email(
+    dbsession,
+    ldapsource,
+    settings,
+    template_key=None,
+    force=False,
+    delay_s=None,
+    delay_between_s=None,
+):
+    """
+    Check current conditions and if we haven't sent the relevant email, send
+    templated both plain text and HTML content to all relevant email addresses
+    using the configured SMTP server.
+
+    The emails go through the `email_outbox` table, so that emails left over
+    by an interrupted run are delivered by the next one without resending
+    those already sent.
+
+    Parameters
+    ----------
+    dbsession:
+      sqlalchemy session
+    ldapsource:
+      used for fetching talent manager email information
+    settings:
+      configpaste settings
+    template_key:
+      override relevant email by providing key from
+      `adaero.constants.EMAIL_TEMPLATE_MAP`
+    force:
+      if particular email already sent, send anyway
+    delay_s:
+      number of seconds to delay before sending emails. If none, look in
+      settings
+    delay_between_s:
+      average number of seconds between each email sent, 0 for no limit. If
+      none, look in settings
+    """
+    log.info("Begin: Sending emails")
+    num_added = enqueue_period_email(dbsession, settings, template_key, force)
+    if num_added:
+        if delay_s is None:
+            delay_s = float(
+                get_config_value(
+                    settings, constants.EMAIL_START_DELAY_S_KEY, DEFAULT_EMAIL_DELAY_S
+                )
+            )
+        log.info("Sending %s emails in %s seconds..." % (num_added, delay_s))
+        time.sleep(delay_s)
+    deliver_email_outbox(dbsession, ldapsource, settings, delay_between_s)
     log.info("End: Sending emails")
 
 
-def send_invite_email(dbsession, settings, inviter, invitee):
-    log.info("Sending invite email to %s..." % invitee.email)
+@lru_cache(maxsize=None)
+def _get_invite_template():
+    return _build_template_env().get_template(os.path.join("email", "invite.html.j2"))
+
+
+def enqueue_invite_email(dbsession, settings, invite, inviter, invitee, period):
+    """
+    Render the email inviting `invitee` to give feedback to `inviter` in
+    `period` and add it to the outbox, replacing any earlier email of
+    `invite` so that inviting again resends it. Must be called within the
+    transaction recording `invite`, which must be flushed.
+
+    Parameters
+    ----------
+    dbsession:
+      sqlalchemy session
+    settings:
+      configpaste settings
+    invite: `adaero.models.ExternalInvite`
+    inviter: `adaero.models.User`
+    invitee: `adaero.models.User`
+    period: `adaero.models.Period`
+    """
     company_name = get_config_value(settings, constants.COMPANY_NAME_KEY, "")
     subject = _build_full_subject(
         company_name, "Invitation to give feedback to %s" % inviter.display_name
     )
-    env = _build_template_env()
-    template = env.get_template(os.path.join("email", "invite.html.j2"))
-    current_period = Period.get_current_period(dbsession)
     app_host = get_root_url(settings)
     from_email = get_config_value(settings, constants.SUPPORT_EMAIL_KEY)
-    rendered_html = template.render(
-        invitee=invitee, inviter=inviter, period=current_period, app_host=app_host
+    rendered_html = _get_invite_template().render(
+        invitee=invitee, inviter=inviter, period=period, app_host=app_host
     )
     message_root = _generate_message_root(
         rendered_html, from_email, subject, reply_to=inviter.email
     )
-    send_emails = _get_send_email_flag(settings)
-    if send_emails:
-        s = smtplib.SMTP()
-        s.connect()
-        s.sendmail(from_email, [invitee.email], message_root.as_string())
-    log.info("Successfully sent an invite email to %s!" % invitee.email)
+    utcnow = datetime.utcnow()
+    email = (
+        dbsession.query(EmailOutbox)
+        .filter(EmailOutbox.invite_id == invite.id)
+        .one_or_none()
+    )
+    if email is None:
+        email = EmailOutbox(
+            period_id=period.id,
+            template_code=INVITE_TEMPLATE_CODE_TMPL % invite.id,
+            is_confirmation=False,
+            invite_id=invite.id,
+            created_utc=utcnow,
+        )
+        dbsession.add(email)
+    email.to_username = invitee.username
+    email.to_email = invitee.email
+    email.from_email = from_email
+    email.message = message_root.as_string()
+    email.status = EmailOutbox.PENDING
+    email.claimed_by = None
+    email.attempts = 0
+    email.last_error = None
+    email.next_attempt_utc = utcnow
+    email.sent_utc = None
+    log.info("Added an invite email to %s to the outbox" % invitee.email)
+
 
+def email_job(settings, session_factory=None, ldapsource=None):
+    """
+    Send the relevant period email if not already sent.
 
-def email_job(settings):
+    Parameters
+    ----------
+    settings:
+      configpaste settings
+    session_factory:
+      the application session factory, so that its engine and connection
+      pool are reused. If none, one is created
+    ldapsource:
+      the application LDAP client. If none, one is created
+    """
     log.info("Starting email job...")
     start_time_s = time.time()
-    engine = get_engine(settings)
-    session_factory = get_session_factory(engine)
+    if session_factory is None:
+        session_factory = get_session_factory(get_engine(settings))
+    if ldapsource is None:
+        ldapsource = build_ldapauth_from_settings(settings)
     dbsession = get_tm_session(session_factory, transaction.manager)
-    ldapsource = build_ldapauth_from_settings(settings)
-    check_and_send_email(dbsession, ldapsource, settings)
+    try:
+        check_and_send_email(dbsession, ldapsource, settings)
+    finally:
+        dbsession.close()
     total_time_s = time.time() - start_time_s
     log.info("Finished email job, took {0:.2f} seconds".format(total_time_s))
 
 
+def send_transition_email(settings, outbox_delivery, dbsession, transition):
+    """`adaero.transitions` hook adding the email of the subperiod the
+    current period entered to the outbox, delivered by `outbox_delivery`"""
+    if transition.period_id != Period.get_current_period(dbsession).id:
+        return
+    if enqueue_period_email(dbsession, settings):
+        outbox_delivery.wake()
+
+
+def leader_outbox_job(lease, settings, session_factory, ldapsource):
+    """Deliver the emails left in the outbox, such as those to retry, only if
+    this process holds the scheduler lease"""
+    if not lease.is_held:
+        log.debug("Not the leader of %s, skipping outbox delivery" % lease.name)
+        return
+    dbsession = get_tm_session(session_factory, transaction.manager)
+    try:
+        deliver_email_outbox(dbsession, ldapsource, settings)
+    finally:
+        dbsession.close()
+
+
+class OutboxDelivery(object):
+    """
+    Deliver the outbox from the scheduler of the process holding the lease,
+    one delivery at a time, every `interval_s` seconds and `delay_s` seconds
+    after being woken up by something adding emails to it.
+
+    Parameters
+    ----------
+    scheduler: `apscheduler.schedulers.base.BaseScheduler`
+        Scheduler to add the jobs to, started by the caller
+    lease: `adaero.lease.LeaderLease`
+    settings:
+        configpaste settings
+    session_factory:
+        SQLAlchemy session factory of the application
+    ldapsource:
+        used for fetching talent manager email information
+    interval_s: `int`
+    delay_s: `float`
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        lease,
+        settings,
+        session_factory,
+        ldapsource,
+        interval_s,
+        delay_s,
+    ):
+        self.scheduler = scheduler
+        self.lease = lease
+        self.settings = settings
+        self.session_factory = session_factory
+        self.ldapsource = ldapsource
+        self.interval_s = interval_s
+        self.delay_s = delay_s
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.scheduler.add_job(
+            self.run, trigger="interval", seconds=self.interval_s, id=OUTBOX_JOB_ID
+        )
+
+    def wake(self):
+        """Deliver the outbox in `delay_s` seconds, if this process is the
+        leader, otherwise the leader delivers it within `interval_s`"""
+        log.info("Delivering the outbox in %s seconds..." % self.delay_s)
+        self.scheduler.add_job(
+            self.run,
+            trigger="date",
+            run_date=datetime.now(utc) + timedelta(seconds=self.delay_s),
+            id=OUTBOX_NOW_JOB_ID,
+            replace_existing=True,
+            misfire_grace_time=None,
+        )
+
+    def run(self):
+        with self._lock:
+            leader_outbox_job(
+                self.lease, self.settings, self.session_factory, self.ldapsource
+            )
+
+
+def _renew_lease(lease, transition_scheduler):
+    was_held = lease.is_held
+    if lease.acquire() and not was_held:
+        # catch up on transitions missed while another process was leader
+        transition_scheduler.resync()
+
+
 def email_event_handler(event):
     """Handle apscheduler event"""
     if event.exception:
@@ -387,7 +1090,7 @@ def email_event_handler(event):
 def includeme(config):
     """Pyramid convention that allows invocation of a function prior to
     server start and is found through `config.scan` in the main function"""
-    scheduler = BackgroundScheduler()
+    scheduler = BackgroundScheduler(timezone=utc)
     settings = config.get_settings()
 
     _get_send_email_flag(settings)
@@ -412,9 +1115,56 @@ def includeme(config):
         )
         raise ValueError(constants.MISCONFIGURATION_MESSAGE.format(error=msg))
 
+    # every process schedules the jobs but only the one holding the lease runs
+    # them, taking over from the leader if it stops renewing the lease
+    lease_ttl_s = int(
+        get_config_value(
+            settings, constants.SCHEDULER_LEASE_TTL_S_KEY, DEFAULT_LEASE_TTL_S
+        )
+    )
+    lease = LeaderLease(config.registry["dbengine"], EMAIL_JOB_LEASE_NAME, lease_ttl_s)
+    session_factory = config.registry["dbsession_factory"]
+    # every email is delivered by this job, so only ever by the leader and
+    # one delivery at a time
+    outbox_delivery = OutboxDelivery(
+        scheduler,
+        lease,
+        settings,
+        session_factory,
+        config.registry["ldapsource"],
+        interval_s,
+        float(
+            get_config_value(
+                settings, constants.EMAIL_START_DELAY_S_KEY, DEFAULT_EMAIL_DELAY_S
+            )
+        ),
+    )
+    config.registry["outbox_delivery"] = outbox_delivery
+    # emails are enqueued when the current period enters a subperiod, the
+    # interval is only used to pick up periods changed by other processes and
+    # to retry emails left in the outbox
+    transition_scheduler = TransitionScheduler(
+        scheduler,
+        session_factory,
+        get_config_value(settings, constants.HOMEBASE_LOCATION_KEY),
+        [
+            warm_period_clock,
+            freeze_stats_on_review,
+            partial(send_transition_email, settings, outbox_delivery),
+        ],
+        interval_s,
+        lease,
+    )
     scheduler.add_job(
-        email_job, trigger="interval", args=(settings,), seconds=interval_s
+        _renew_lease,
+        trigger="interval",
+        args=(lease, transition_scheduler),
+        seconds=lease.renew_interval_s,
+        next_run_time=datetime.now(utc),
     )
+    transition_scheduler.start()
+    outbox_delivery.start()
     scheduler.add_listener(email_event_handler, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
     scheduler.start()
+    atexit.register(lease.release)
     log.info("Email scheduling setup completed!")
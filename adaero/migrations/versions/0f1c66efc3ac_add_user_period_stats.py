@@ -0,0 +1,42 @@
+"""add user_period_stats
+
+Revision ID: 0f1c66efc3ac
+Revises: aa9125020ba8
+Create Date: 2026-10-18 10:12:41.511204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "0f1c66efc3ac"
+down_revision = "aa9125020ba8"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # the table is only populated incrementally, so once upgraded run
+    # `configure_db backfill-user-period-stats` to fill in existing feedback
+    op.create_table(
+        "user_period_stats",
+        sa.Column("username", sa.Unicode(length=32), nullable=False),
+        sa.Column("period_id", sa.Integer(), nullable=False),
+        sa.Column("contributed", sa.Integer(), nullable=False),
+        sa.Column("received", sa.Integer(), nullable=False),
+        sa.Column("is_nominated", sa.Boolean(name="b_is_nominated"), nullable=True),
+        sa.Column("has_summary", sa.Boolean(name="b_has_summary"), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["period_id"],
+            ["periods.id"],
+            name=op.f("fk_user_period_stats_period_id_periods"),
+        ),
+        sa.PrimaryKeyConstraint(
+            "username", "period_id", name=op.f("pk_user_period_stats")
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("user_period_stats")
@@ -0,0 +1,38 @@
+"""add http_sessions
+
+Revision ID: 3a7f1e9c5d20
+Revises: 9d4c2a6e8b13
+Create Date: 2026-10-18 18:47:52.918340
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "3a7f1e9c5d20"
+down_revision = "9d4c2a6e8b13"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "http_sessions",
+        sa.Column("id", sa.Unicode(length=64), nullable=False),
+        sa.Column("data", sa.UnicodeText(), nullable=False),
+        sa.Column("created_utc", sa.DateTime(), nullable=False),
+        sa.Column("expires_utc", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_http_sessions")),
+    )
+    op.create_index(
+        op.f("ix_http_sessions_expires_utc"),
+        "http_sessions",
+        ["expires_utc"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_http_sessions_expires_utc"), table_name="http_sessions")
+    op.drop_table("http_sessions")
@@ -0,0 +1,46 @@
+"""add frozen_period_stats
+
+Revision ID: 5b2e8d7c41fa
+Revises: 0f1c66efc3ac
+Create Date: 2026-10-18 14:03:27.190352
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "5b2e8d7c41fa"
+down_revision = "0f1c66efc3ac"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # existing closed periods are only frozen once
+    # `configure_db freeze-period-stats` is run
+    op.add_column(
+        "periods", sa.Column("stats_frozen_utc", sa.DateTime(), nullable=True)
+    )
+    op.create_table(
+        "frozen_period_stats",
+        sa.Column("username", sa.Unicode(length=32), nullable=False),
+        sa.Column("period_id", sa.Integer(), nullable=False),
+        sa.Column("contributed", sa.Integer(), nullable=False),
+        sa.Column("received", sa.Integer(), nullable=False),
+        sa.Column("is_nominated", sa.Boolean(name="b_is_nominated"), nullable=True),
+        sa.Column("has_summary", sa.Boolean(name="b_has_summary"), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["period_id"],
+            ["periods.id"],
+            name=op.f("fk_frozen_period_stats_period_id_periods"),
+        ),
+        sa.PrimaryKeyConstraint(
+            "username", "period_id", name=op.f("pk_frozen_period_stats")
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("frozen_period_stats")
+    op.drop_column("periods", "stats_frozen_utc")
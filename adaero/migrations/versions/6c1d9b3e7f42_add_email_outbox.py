@@ -0,0 +1,64 @@
+"""add email_outbox
+
+Revision ID: 6c1d9b3e7f42
+Revises: 3a7f1e9c5d20
+Create Date: 2026-10-18 19:40:12.204917
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "6c1d9b3e7f42"
+down_revision = "3a7f1e9c5d20"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "email_outbox",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("period_id", sa.Integer(), nullable=False),
+        sa.Column("template_code", sa.Unicode(length=16), nullable=False),
+        sa.Column(
+            "is_confirmation", sa.Boolean(name="b_is_confirmation"), nullable=False
+        ),
+        sa.Column("to_username", sa.Unicode(length=32), nullable=True),
+        sa.Column("to_email", sa.Unicode(length=256), nullable=False),
+        sa.Column("from_email", sa.Unicode(length=256), nullable=True),
+        sa.Column("message", sa.UnicodeText(), nullable=False),
+        sa.Column("status", sa.Unicode(length=16), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Unicode(length=1024), nullable=True),
+        sa.Column("created_utc", sa.DateTime(), nullable=False),
+        sa.Column("next_attempt_utc", sa.DateTime(), nullable=False),
+        sa.Column("sent_utc", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["period_id"],
+            ["periods.id"],
+            name=op.f("fk_email_outbox_period_id_periods"),
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_email_outbox")),
+        sa.UniqueConstraint(
+            "period_id",
+            "template_code",
+            "is_confirmation",
+            "to_email",
+            name=op.f("uq_email_outbox_recipient"),
+        ),
+    )
+    op.create_index(
+        op.f("ix_email_outbox_status_next_attempt"),
+        "email_outbox",
+        ["status", "next_attempt_utc"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_email_outbox_status_next_attempt"), table_name="email_outbox"
+    )
+    op.drop_table("email_outbox")
@@ -0,0 +1,44 @@
+"""add composite indexes on forms and einvites
+
+Revision ID: 9d4c2a6e8b13
+Revises: 5b2e8d7c41fa
+Create Date: 2026-10-18 16:21:05.433718
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "9d4c2a6e8b13"
+down_revision = "5b2e8d7c41fa"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    # nominees are already covered by the uq_username_to_p constraint
+    op.create_index(
+        op.f("ix_forms_p_id_to_summary"),
+        "forms",
+        ["period_id", "to_username", "is_summary"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_forms_p_id_from"),
+        "forms",
+        ["period_id", "from_username"],
+        unique=False,
+    )
+    op.create_index(
+        op.f("ix_einvites_p_id_to_from"),
+        "einvites",
+        ["period_id", "to_username", "from_username"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_einvites_p_id_to_from"), table_name="einvites")
+    op.drop_index(op.f("ix_forms_p_id_from"), table_name="forms")
+    op.drop_index(op.f("ix_forms_p_id_to_summary"), table_name="forms")
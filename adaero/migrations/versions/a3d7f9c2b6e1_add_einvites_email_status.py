@@ -0,0 +1,30 @@
+"""add einvites email status
+
+Revision ID: a3d7f9c2b6e1
+Revises: f4c8e1a7b935
+Create Date: 2026-10-18 22:05:31.517408
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "a3d7f9c2b6e1"
+down_revision = "f4c8e1a7b935"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        "einvites", sa.Column("email_status", sa.Unicode(length=16), nullable=True)
+    )
+    op.add_column(
+        "einvites", sa.Column("email_updated_utc", sa.DateTime(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("einvites", "email_updated_utc")
+    op.drop_column("einvites", "email_status")
@@ -0,0 +1,39 @@
+"""add ldap_directory_cache
+
+Revision ID: b8e4c1f6a2d9
+Revises: a3d7f9c2b6e1
+Create Date: 2026-10-18 23:14:02.771930
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "b8e4c1f6a2d9"
+down_revision = "a3d7f9c2b6e1"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "ldap_directory_cache",
+        sa.Column("key", sa.Unicode(length=512), nullable=False),
+        sa.Column("details", sa.UnicodeText(), nullable=True),
+        sa.Column("expires_utc", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("key", name=op.f("pk_ldap_directory_cache")),
+    )
+    op.create_index(
+        op.f("ix_ldap_directory_cache_expires_utc"),
+        "ldap_directory_cache",
+        ["expires_utc"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_ldap_directory_cache_expires_utc"), table_name="ldap_directory_cache"
+    )
+    op.drop_table("ldap_directory_cache")
@@ -0,0 +1,26 @@
+"""add email_outbox claims
+
+Revision ID: c5f2a9e3d7b4
+Revises: b8e4c1f6a2d9
+Create Date: 2026-10-18 23:52:08.341276
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "c5f2a9e3d7b4"
+down_revision = "b8e4c1f6a2d9"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column(
+        "email_outbox", sa.Column("claimed_by", sa.Unicode(length=32), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("email_outbox", "claimed_by")
@@ -0,0 +1,39 @@
+"""add email_outbox invites
+
+Revision ID: d9a4e7b2c1f8
+Revises: c5f2a9e3d7b4
+Create Date: 2026-10-19 00:31:46.905113
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "d9a4e7b2c1f8"
+down_revision = "c5f2a9e3d7b4"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    with op.batch_alter_table("email_outbox") as batch_op:
+        batch_op.add_column(sa.Column("invite_id", sa.Integer(), nullable=True))
+        batch_op.create_foreign_key(
+            op.f("fk_email_outbox_invite_id_einvites"),
+            "einvites",
+            ["invite_id"],
+            ["id"],
+        )
+    # invite emails were queued in memory, those still pending were lost
+    op.execute(
+        "UPDATE einvites SET email_status = 'failed' WHERE email_status = 'pending'"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table("email_outbox") as batch_op:
+        batch_op.drop_constraint(
+            op.f("fk_email_outbox_invite_id_einvites"), type_="foreignkey"
+        )
+        batch_op.drop_column("invite_id")
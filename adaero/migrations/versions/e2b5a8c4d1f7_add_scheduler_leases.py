@@ -0,0 +1,31 @@
+"""add scheduler_leases
+
+Revision ID: e2b5a8c4d1f7
+Revises: 6c1d9b3e7f42
+Create Date: 2026-10-18 20:31:05.611734
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "e2b5a8c4d1f7"
+down_revision = "6c1d9b3e7f42"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "scheduler_leases",
+        sa.Column("name", sa.Unicode(length=64), nullable=False),
+        sa.Column("holder", sa.Unicode(length=128), nullable=False),
+        sa.Column("acquired_utc", sa.DateTime(), nullable=False),
+        sa.Column("expires_utc", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("name", name=op.f("pk_scheduler_leases")),
+    )
+
+
+def downgrade():
+    op.drop_table("scheduler_leases")
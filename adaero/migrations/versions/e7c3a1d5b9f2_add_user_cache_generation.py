@@ -0,0 +1,29 @@
+"""add user_cache_generation
+
+Revision ID: e7c3a1d5b9f2
+Revises: d9a4e7b2c1f8
+Create Date: 2026-10-19 09:12:38.402517
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "e7c3a1d5b9f2"
+down_revision = "d9a4e7b2c1f8"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "user_cache_generation",
+        sa.Column("id", sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column("generation", sa.Unicode(length=32), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_user_cache_generation")),
+    )
+
+
+def downgrade():
+    op.drop_table("user_cache_generation")
@@ -0,0 +1,37 @@
+"""add period_transitions
+
+Revision ID: f4c8e1a7b935
+Revises: e2b5a8c4d1f7
+Create Date: 2026-10-18 21:12:44.380126
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = "f4c8e1a7b935"
+down_revision = "e2b5a8c4d1f7"
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table(
+        "period_transitions",
+        sa.Column("period_id", sa.Integer(), nullable=False),
+        sa.Column("subperiod", sa.Unicode(length=32), nullable=False),
+        sa.Column("fired_utc", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["period_id"],
+            ["periods.id"],
+            name=op.f("fk_period_transitions_period_id_periods"),
+        ),
+        sa.PrimaryKeyConstraint(
+            "period_id", "subperiod", name=op.f("pk_period_transitions")
+        ),
+    )
+
+
+def downgrade():
+    op.drop_table("period_transitions")
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+from datetime import timedelta
 import json
 import tempfile
 
@@ -30,8 +31,19 @@ from .all import (  # noqa: F401
     FeedbackTemplateRow,
     SEQUENCES,
 )
-from adaero.models.user import Nominee, User  # noqa: F401
-from .period import Period, OFFSETS  # noqa: F401
+from adaero.models.user import (  # noqa: F401
+    Nominee,
+    User,
+    UserCacheGeneration,
+    USER_CACHE,
+)
+from .period import Period, OFFSETS, PERIOD_CLOCK  # noqa: F401
+from .stats import UserPeriodStats, FrozenPeriodStats  # noqa: F401
+from .session import HTTPSession  # noqa: F401
+from .outbox import EmailOutbox  # noqa: F401
+from .lease import SchedulerLease  # noqa: F401
+from .transition import PeriodTransition  # noqa: F401
+from .directory import DirectoryCacheEntry  # noqa: F401
 
 # run configure_mappers after defining all of the models to ensure all
 # relationships can be # setup. If this is not done, trying to run particular
@@ -91,34 +103,6 @@ def get_tm_session(session_factory, transaction_manager):
     return dbsession
 
 
-def find_external_managers(
-    ldapsource, ldap_details  # type: ldapauth.LDAPAuth  # type: list[dict]
-):
-    """ This will normally add managers that are outside the given set of
-    input ldap details"""
-
-    log.info("Finding external managers")
-    manager_set = set()
-    for detail in ldap_details:
-        manager = detail[ldapsource.manager_key]
-        if manager and manager not in [
-            u[ldapsource.username_key] for u in ldap_details
-        ]:
-            manager_set.add(manager)
-    managers = []
-    for username in manager_set:
-        detail = ldapsource.get_ldap_user_by_username(username)
-        if not detail:
-            log.warning(
-                "Unable to find LDAP details for outside manager with "
-                'dn "%s"' % username
-            )
-            continue
-        log.info('Found external manager member "%s"' % detail[ldapsource.username_key])
-        managers.append(detail)
-    return managers
-
-
 def find_talent_managers(
     settings, ldapsource, ldap_details  # type: ldapauth.LDAPAuth  # type: list[dict]
 ):
@@ -219,6 +203,23 @@ def load_talent_managers_only(
     log.info("Finished syncing Users LDAP cache")
 
 
+def check_user_period_stats_populated(dbsession):
+    """The `user_period_stats` table is only maintained incrementally, so
+    warn if it was created empty on a database that already has feedback."""
+    with transaction.manager:
+        is_empty = dbsession.query(UserPeriodStats.username).first() is None
+        has_feedback = (
+            dbsession.query(FeedbackForm.id).first() is not None
+            or dbsession.query(Nominee.id).first() is not None
+        )
+    if is_empty and has_feedback:
+        log.warning(
+            "The user_period_stats table is empty but feedback exists, so "
+            "feedback stats will be incorrect. Please run the "
+            "`backfill-user-period-stats` command of `configure_db`."
+        )
+
+
 def includeme(config):
     """
     Initialize the model for a Pyramid app.
@@ -251,6 +252,25 @@ def includeme(config):
     should_load_tms = get_config_value(
         settings, constants.LOAD_TALENT_MANAGERS_ON_APP_START_KEY, True
     )
+    PERIOD_CLOCK.ttl = timedelta(
+        seconds=int(
+            get_config_value(
+                settings, constants.PERIOD_CLOCK_TTL_S_KEY, PERIOD_CLOCK.DEFAULT_TTL_S
+            )
+        )
+    )
+    USER_CACHE.ttl = timedelta(
+        seconds=int(
+            get_config_value(
+                settings, constants.USER_CACHE_TTL_S_KEY, USER_CACHE.DEFAULT_TTL_S
+            )
+        )
+    )
+    USER_CACHE.max_size = int(
+        get_config_value(
+            settings, constants.USER_CACHE_SIZE_KEY, USER_CACHE.DEFAULT_MAX_SIZE
+        )
+    )
     engine = get_engine(settings)
 
     for seq in SEQUENCES:
@@ -259,11 +279,15 @@ def includeme(config):
 
     session_factory = get_session_factory(engine)
     config.registry["dbsession_factory"] = session_factory
+    config.registry["dbengine"] = engine
 
     dbsession = get_tm_session(session_factory, transaction.manager)
     ldapsource = ldapauth.build_ldapauth_from_settings(settings)
+    # shared with the jobs scheduled in the background
+    config.registry["ldapsource"] = ldapsource
     if should_load_tms:
         load_talent_managers_only(dbsession, ldapsource, settings)
+    check_user_period_stats_populated(dbsession)
 
     # make request.dbsession available for use in Pyramid
     config.add_request_method(
@@ -7,7 +7,9 @@ from sqlalchemy import (
     event,
     Boolean,
     Column,
+    DateTime,
     ForeignKey,
+    Index,
     Integer,
     Unicode,
     Sequence,
@@ -43,6 +45,7 @@ ANSWER_ID_SEQ = Sequence("answer_id_seq")
 NOMINEE_ID_SEQ = Sequence("nominee_id_seq")
 PERIOD_ID_SEQ = Sequence("period_id_seq")
 EXTERNAL_REQUEST_ID_SEQ = Sequence("erequest_id_seq")
+EMAIL_OUTBOX_ID_SEQ = Sequence("email_outbox_id_seq")
 
 SEQUENCES = (
     PERIOD_ID_SEQ,
@@ -53,6 +56,7 @@ SEQUENCES = (
     ANSWER_ID_SEQ,
     NOMINEE_ID_SEQ,
     EXTERNAL_REQUEST_ID_SEQ,
+    EMAIL_OUTBOX_ID_SEQ,
 )
 
 
@@ -162,6 +166,10 @@ class FeedbackForm(Base):
             "from_username != approved_by_username", name="from_neq_approved"
         ),
         CheckConstraint("to_username != approved_by_username", name="to_neq_approved"),
+        # received feedback and summary lookups
+        Index("ix_forms_p_id_to_summary", "period_id", "to_username", "is_summary"),
+        # given feedback lookups
+        Index("ix_forms_p_id_from", "period_id", "from_username"),
     )
 
     def __repr__(self):
@@ -253,9 +261,14 @@ class ExternalInvite(Base, Checkable, Serializable):
     """
     Represents an invite from a user within the population to a user that is
     in the configured LDAP source (with the population being a subset of the
-    users in the LDAP source)
+    users in the LDAP source). The invite email is delivered through the
+    email outbox, `email_status` being `None` if sending emails is disabled.
     """
 
+    EMAIL_PENDING = "pending"
+    EMAIL_SENT = "sent"
+    EMAIL_FAILED = "failed"
+
     __tablename__ = "einvites"
     id = Column(Integer, EXTERNAL_REQUEST_ID_SEQ, primary_key=True)
     to_username = Column(Unicode(length=32))
@@ -267,6 +280,12 @@ class ExternalInvite(Base, Checkable, Serializable):
     )
     period_id = Column(Integer, ForeignKey("periods.id"))
     period = relationship("Period")
+    email_status = Column(Unicode(length=16))
+    email_updated_utc = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_einvites_p_id_to_from", "period_id", "to_username", "from_username"),
+    )
 
     def check_validity(self, session):
         pass
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, DateTime, Unicode, UnicodeText
+
+from adaero.models.all import Base
+
+
+class DirectoryCacheEntry(Base):
+    """LDAP details of a user found by looking up `key`, or `None` if there
+    is no such user, shared by the processes of a deployment until
+    `expires_utc`. Refer to `adaero.directory`."""
+
+    __tablename__ = "ldap_directory_cache"
+    key = Column(Unicode(length=512), primary_key=True)
+    details = Column(UnicodeText)
+    expires_utc = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return "DirectoryCacheEntry(key=%s, expires_utc=%s)" % (
+            self.key,
+            self.expires_utc,
+        )
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, DateTime, Unicode
+
+from adaero.models.all import Base
+
+
+class SchedulerLease(Base):
+    """Named lease held by at most one process at a time until `expires_utc`,
+    so that scheduled jobs only run in one of the processes of a deployment.
+    Refer to `adaero.lease`."""
+
+    __tablename__ = "scheduler_leases"
+    name = Column(Unicode(length=64), primary_key=True)
+    holder = Column(Unicode(length=128), nullable=False)
+    acquired_utc = Column(DateTime, nullable=False)
+    expires_utc = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return "SchedulerLease(name=%s, holder=%s, expires_utc=%s)" % (
+            self.name,
+            self.holder,
+            self.expires_utc,
+        )
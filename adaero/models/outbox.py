@@ -0,0 +1,72 @@
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    Unicode,
+    UnicodeText,
+    UniqueConstraint,
+)
+
+from adaero.models.all import Base, Checkable, EMAIL_OUTBOX_ID_SEQ
+
+
+class EmailOutbox(Base, Checkable):
+    """An email rendered for a recipient of a period email, of the
+    confirmation sent to talent managers once all of those are delivered, or
+    of an `ExternalInvite` identified by `invite_id`, waiting to be or having
+    been delivered. There is at most one row per
+    recipient, period and email code so that enqueueing can be safely
+    repeated, and delivery picks up `PENDING` rows wherever it stopped.
+    Rows are claimed as `SENDING` by the delivery sending them, until
+    `next_attempt_utc` after which they are pending again. Refer to
+    `adaero.mail`."""
+
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+    __tablename__ = "email_outbox"
+    id = Column(Integer, EMAIL_OUTBOX_ID_SEQ, primary_key=True)
+    period_id = Column(Integer, ForeignKey("periods.id"), nullable=False)
+    template_code = Column(Unicode(length=16), nullable=False)
+    is_confirmation = Column(
+        Boolean(name="b_is_confirmation"), default=False, nullable=False
+    )
+    to_username = Column(Unicode(length=32))
+    to_email = Column(Unicode(length=256), nullable=False)
+    from_email = Column(Unicode(length=256))
+    message = Column(UnicodeText, nullable=False)
+    status = Column(Unicode(length=16), default=PENDING, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Unicode(length=1024))
+    claimed_by = Column(Unicode(length=32))
+    invite_id = Column(Integer, ForeignKey("einvites.id"))
+    created_utc = Column(DateTime, nullable=False)
+    next_attempt_utc = Column(DateTime, nullable=False)
+    sent_utc = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "period_id",
+            "template_code",
+            "is_confirmation",
+            "to_email",
+            name="uq_email_outbox_recipient",
+        ),
+        # rows due for delivery
+        Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_utc"),
+    )
+
+    def __repr__(self):
+        return "EmailOutbox(period_id=%s, template_code=%s, to_email=%s)" % (
+            self.period_id,
+            self.template_code,
+            self.to_email,
+        )
+
+    def check_validity(self, session):
+        pass
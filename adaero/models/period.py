@@ -1,9 +1,20 @@
+from collections import namedtuple
 from datetime import datetime, timedelta
 from functools import partial
+import threading
 
 from pyramid.httpexceptions import HTTPInternalServerError
-from sqlalchemy import Column, Integer, Unicode, ForeignKey, DateTime, CheckConstraint
+from sqlalchemy import (
+    event,
+    Column,
+    Integer,
+    Unicode,
+    ForeignKey,
+    DateTime,
+    CheckConstraint,
+)
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.session import Session
 import transaction
 
 from adaero import constants
@@ -51,6 +62,9 @@ class Period(Base, Checkable, Serializable):
         "ust06_email_last_sent", DateTime, nullable=True
     )
     review_reminder_last_sent = Column("ust07_email_last_sent", DateTime, nullable=True)
+    # set once the stats of the period have been snapshot into
+    # `frozen_period_stats`, refer to `adaero.stats.freeze_period_stats`
+    stats_frozen_utc = Column(DateTime, nullable=True)
 
     __table_args__ = (
         CheckConstraint(
@@ -178,18 +192,7 @@ class Period(Base, Checkable, Serializable):
             return self.review_reminder_last_sent
 
     def subperiod(self, location):
-        utcnow = datetime.utcnow()
-        converted_dt = partial(adjust_dt_for_location, location=location)
-        if converted_dt(self.approval_end_utc) <= utcnow:
-            return self.REVIEW_SUBPERIOD
-        elif converted_dt(self.approval_start_utc) <= utcnow:
-            return self.APPROVAL_SUBPERIOD
-        elif converted_dt(self.entry_start_utc) <= utcnow:
-            return self.ENTRY_SUBPERIOD
-        elif converted_dt(self.enrollment_start_utc) <= utcnow:
-            return self.ENROLLMENT_SUBPERIOD
-        else:
-            return self.INACTIVE_SUBPERIOD
+        return PERIOD_CLOCK.subperiod_of(self, location)
 
     SUBPERIOD_TO_TEMPLATE = {
         REVIEW_SUBPERIOD: constants.EMAIL_TEMPLATE_MAP[constants.REVIEW_START],
@@ -207,32 +210,255 @@ class Period(Base, Checkable, Serializable):
 
     @classmethod
     def get_current_period(cls, dbsession, options=None):
-        utcnow = datetime.utcnow()
-        query = dbsession.query(Period)
-        if options:
-            query = query.options(options)
-        days_into_future = timedelta(days=cls.PERIOD_LOOKAHEAD_DAYS)
-        with transaction.manager:
-            periods_by_date_desc = (
-                query.filter(cls.enrollment_start_utc < utcnow + days_into_future)
-                .order_by(cls.enrollment_start_utc.desc())
-                .all()
-            )
+        """
+        The current period is resolved by `PERIOD_CLOCK` and only loaded
+        by its primary key, which is usually already in the identity map
+        of `dbsession`.
+        """
+        for _ in range(2):
+            period_id = PERIOD_CLOCK.current_period_id(dbsession)
+            query = dbsession.query(Period)
+            if options:
+                query = query.options(options)
+            with transaction.manager:
+                current_period = query.get(period_id)
+            if current_period is not None:
+                return current_period
+            # deleted by another process since it was cached
+            PERIOD_CLOCK.invalidate()
+        msg = "No period data starting on %s is available." % datetime.utcnow()
+        raise HTTPInternalServerError(explanation=msg)
+
+
+PeriodDates = namedtuple(
+    "PeriodDates",
+    [
+        "id",
+        "enrollment_start_utc",
+        "entry_start_utc",
+        "approval_start_utc",
+        "approval_end_utc",
+    ],
+)
+
+
+class PeriodClock(object):
+    """
+    Process level cache of which period is current and of the instants at
+    which each period changes subperiod, per location. Views resolve the
+    current period on nearly every request, so this saves loading every
+    period in the lookahead window each time.
+
+    The cache is dropped whenever a flush adds, changes or deletes a
+    `Period` and again once its transaction ends, once the next instant at which the current period or a
+    subperiod could change has passed, and at the latest after `ttl` so that
+    changes made by other processes are picked up.
+    """
 
-        if not periods_by_date_desc:
-            msg = "No period data starting on %s is available." % utcnow
+    DEFAULT_TTL_S = 60
+
+    def __init__(self, ttl_s=DEFAULT_TTL_S):
+        self.ttl = timedelta(seconds=ttl_s)
+        self._lock = threading.Lock()
+        self._state = None
+
+    def invalidate(self):
+        self._state = None
+
+    def current_period_id(self, dbsession):
+        """
+        Parameters
+        ----------
+        dbsession: `sqlalchemy.orm.session.Session`
+
+        Returns
+        -------
+        id of the current period, refer to `Period.get_current_period`
+        """
+        state = self._get_state(dbsession)
+        if state["current_period_id"] is None:
+            msg = "No period data starting on %s is available." % state["computed_utc"]
             raise HTTPInternalServerError(explanation=msg)
-        elif periods_by_date_desc[0].enrollment_start_utc <= utcnow:
-            current_period = periods_by_date_desc[0]
-        elif (
-            len(periods_by_date_desc) >= 2
-            and (utcnow - periods_by_date_desc[1].enrollment_start_utc).days
-            <= cls.REVIEW_SUBPERIOD_LEN_DAYS
+        return state["current_period_id"]
+
+    def subperiod_of(self, period, location):
+        """
+        Parameters
+        ----------
+        period: `Period`
+        location: `str`
+
+        Returns
+        -------
+        Subperiod that `period` is in at `location`, using boundaries
+        precomputed for the cached periods
+        """
+        utcnow = datetime.utcnow()
+        dates = _period_dates(period)
+        boundaries = None
+        state = self._state
+        if (
+            state is not None
+            and state["computed_utc"] <= utcnow
+            and state["periods"].get(period.id) == dates
         ):
-            current_period = periods_by_date_desc[1]
+            key = (period.id, location)
+            boundaries = state["boundaries"].get(key)
+            if boundaries is None:
+                boundaries = subperiod_boundaries(dates, location)
+                state["boundaries"][key] = boundaries
+        if boundaries is None:
+            boundaries = subperiod_boundaries(dates, location)
+        approval_end, approval_start, entry_start, enrollment_start = boundaries
+        if approval_end <= utcnow:
+            return Period.REVIEW_SUBPERIOD
+        elif approval_start <= utcnow:
+            return Period.APPROVAL_SUBPERIOD
+        elif entry_start <= utcnow:
+            return Period.ENTRY_SUBPERIOD
+        elif enrollment_start <= utcnow:
+            return Period.ENROLLMENT_SUBPERIOD
         else:
-            current_period = periods_by_date_desc[0]
-        return current_period
+            return Period.INACTIVE_SUBPERIOD
+
+    def _get_state(self, dbsession):
+        utcnow = datetime.utcnow()
+        state = self._state
+        if state is not None and state["computed_utc"] <= utcnow < state["expires_utc"]:
+            return state
+        with self._lock:
+            with transaction.manager:
+                periods = get_period_dates(dbsession)
+            current_period_id, next_change_utc = _resolve_current_period(
+                periods, utcnow
+            )
+            expires_utc = utcnow + self.ttl
+            if next_change_utc is not None:
+                expires_utc = min(expires_utc, next_change_utc)
+            state = {
+                "computed_utc": utcnow,
+                "expires_utc": expires_utc,
+                "current_period_id": current_period_id,
+                "periods": {p.id: p for p in periods},
+                "boundaries": {},
+            }
+            self._state = state
+        return state
+
+
+def get_period_dates(dbsession):
+    """`PeriodDates` of every period, without loading the periods"""
+    return [
+        PeriodDates(*row)
+        for row in dbsession.query(
+            Period.id,
+            Period.enrollment_start_utc,
+            Period.entry_start_utc,
+            Period.approval_start_utc,
+            Period.approval_end_utc,
+        )
+    ]
+
+
+def _period_dates(period):
+    return PeriodDates(
+        period.id,
+        period.enrollment_start_utc,
+        period.entry_start_utc,
+        period.approval_start_utc,
+        period.approval_end_utc,
+    )
+
+
+def subperiod_boundaries(dates, location):
+    """Instants at which a period enters review, approval, entry and
+    enrollment at `location`, latest first."""
+    converted_dt = partial(adjust_dt_for_location, location=location)
+    return (
+        converted_dt(dates.approval_end_utc),
+        converted_dt(dates.approval_start_utc),
+        converted_dt(dates.entry_start_utc),
+        converted_dt(dates.enrollment_start_utc),
+    )
+
+
+def _resolve_current_period(periods, utcnow):
+    """
+    Pick the current period out of `periods` as of `utcnow`: the latest
+    period to have started enrollment, unless the next one starts within
+    `Period.PERIOD_LOOKAHEAD_DAYS` and the latest has been in review for
+    more than `Period.REVIEW_SUBPERIOD_LEN_DAYS`.
+
+    Returns
+    -------
+    Tuple of the id of the current period, or `None` if there is no period,
+    and the next instant at which the result could change, or `None`
+    """
+    lookahead = timedelta(days=Period.PERIOD_LOOKAHEAD_DAYS)
+    # `timedelta.days` is floored, so the review window only closes once
+    # a whole extra day has passed
+    review_len = timedelta(days=Period.REVIEW_SUBPERIOD_LEN_DAYS + 1)
+    change_instants = []
+    for p in periods:
+        change_instants.extend(
+            [
+                p.enrollment_start_utc - lookahead,
+                p.enrollment_start_utc,
+                p.enrollment_start_utc + review_len,
+            ]
+        )
+    next_change_utc = min([dt for dt in change_instants if dt > utcnow] or [None])
+
+    periods_by_date_desc = sorted(
+        [p for p in periods if p.enrollment_start_utc < utcnow + lookahead],
+        key=lambda p: p.enrollment_start_utc,
+        reverse=True,
+    )
+    if not periods_by_date_desc:
+        current_period = None
+    elif periods_by_date_desc[0].enrollment_start_utc <= utcnow:
+        current_period = periods_by_date_desc[0]
+    elif (
+        len(periods_by_date_desc) >= 2
+        and (utcnow - periods_by_date_desc[1].enrollment_start_utc).days
+        <= Period.REVIEW_SUBPERIOD_LEN_DAYS
+    ):
+        current_period = periods_by_date_desc[1]
+    else:
+        current_period = periods_by_date_desc[0]
+    current_period_id = current_period.id if current_period else None
+    return current_period_id, next_change_utc
+
+
+PERIOD_CLOCK = PeriodClock()
+# set on sessions that changed periods, so that the clock is invalidated again
+# once they end, as other threads may refresh it from the periods previously
+# committed in the meantime
+PERIOD_CLOCK_STALE_KEY = "adaero.period_clock_stale"
+
+
+@event.listens_for(Session, "after_flush")
+def invalidate_period_clock(session, context):
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Period):
+            PERIOD_CLOCK.invalidate()
+            session.info[PERIOD_CLOCK_STALE_KEY] = True
+            return
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def invalidate_period_clock_after_bulk(context):
+    if context.primary_table is Period.__table__:
+        PERIOD_CLOCK.invalidate()
+        context.session.info[PERIOD_CLOCK_STALE_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def invalidate_period_clock_after_transaction(session):
+    if session.info.pop(PERIOD_CLOCK_STALE_KEY, False):
+        PERIOD_CLOCK.invalidate()
 
 
 OFFSETS = {
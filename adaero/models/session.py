@@ -0,0 +1,20 @@
+from sqlalchemy import Column, DateTime, Index, Unicode, UnicodeText
+
+from adaero.models.all import Base
+
+
+class HTTPSession(Base):
+    """Server side state of a browser session when `adaero.session_type` is
+    `sql`, keyed on the random id held in the signed session cookie. Expired
+    rows are purged periodically, refer to `adaero.session`."""
+
+    __tablename__ = "http_sessions"
+    id = Column(Unicode(length=64), primary_key=True)
+    data = Column(UnicodeText, nullable=False)
+    created_utc = Column(DateTime, nullable=False)
+    expires_utc = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index("ix_http_sessions_expires_utc", "expires_utc"),)
+
+    def __repr__(self):
+        return "HTTPSession(expires_utc=%s)" % self.expires_utc
@@ -0,0 +1,155 @@
+from collections import defaultdict
+
+from sqlalchemy import (
+    event,
+    and_,
+    Boolean,
+    Column,
+    ForeignKey,
+    Integer,
+    Unicode,
+)
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.session import Session
+
+from adaero.models.all import Base, Serializable, FeedbackForm
+from adaero.models.user import Nominee
+
+COUNT_FIELDS = ("contributed", "received")
+FLAG_FIELDS = ("is_nominated", "has_summary")
+
+
+class UserPeriodStats(Base, Serializable):
+    """Materialized feedback stats for a user in a given period, keyed on
+    username and period id. Kept up to date on every flush that adds or
+    deletes a `FeedbackForm` or `Nominee`, so reading stats does not require
+    aggregating `forms` and `nominees`.
+
+    Bulk `Query.delete()` calls and raw SQL bypass the flush, so after
+    correcting data outside of the ORM, run the `backfill-user-period-stats`
+    command of `configure_db`."""
+
+    __tablename__ = "user_period_stats"
+    username = Column(Unicode(length=32), primary_key=True)
+    period_id = Column(Integer, ForeignKey("periods.id"), primary_key=True)
+    contributed = Column(Integer, default=0, nullable=False)
+    received = Column(Integer, default=0, nullable=False)
+    is_nominated = Column(Boolean(name="b_is_nominated"), default=False)
+    has_summary = Column(Boolean(name="b_has_summary"), default=False)
+
+    def __repr__(self):
+        return "UserPeriodStats(username=%s, period_id=%s)" % (
+            self.username,
+            self.period_id,
+        )
+
+    def check_validity(self, session):
+        pass
+
+
+class FrozenPeriodStats(Base, Serializable):
+    """Snapshot of the feedback stats of a user in a closed period. Written
+    by `adaero.stats.freeze_period_stats` and read instead of `forms`,
+    `nominees` and `user_period_stats` for any period with
+    `Period.stats_frozen_utc` set. After correcting the data of a frozen
+    period, re-freeze it with the `freeze-period-stats` command of
+    `configure_db`."""
+
+    __tablename__ = "frozen_period_stats"
+    username = Column(Unicode(length=32), primary_key=True)
+    period_id = Column(Integer, ForeignKey("periods.id"), primary_key=True)
+    contributed = Column(Integer, default=0, nullable=False)
+    received = Column(Integer, default=0, nullable=False)
+    is_nominated = Column(Boolean(name="b_is_nominated"), default=False)
+    has_summary = Column(Boolean(name="b_has_summary"), default=False)
+
+    def __repr__(self):
+        return "FrozenPeriodStats(username=%s, period_id=%s)" % (
+            self.username,
+            self.period_id,
+        )
+
+    def check_validity(self, session):
+        pass
+
+
+def _collect_form_changes(changes, form, sign):
+    if form.is_summary:
+        changes[(form.to_username, form.period_id)]["has_summary"] = sign > 0
+    else:
+        changes[(form.from_username, form.period_id)]["contributed"] += sign
+        changes[(form.to_username, form.period_id)]["received"] += sign
+
+
+def _collect_nominee_changes(changes, nominee, sign):
+    changes[(nominee.username, nominee.period_id)]["is_nominated"] = sign > 0
+
+
+def apply_user_period_stats_changes(connection, username, period_id, changes):
+    """
+    Apply a set of changes for a single user and period to the
+    `user_period_stats` table, inserting the row if it does not exist yet.
+
+    Parameters
+    ----------
+    connection:
+        SQLAlchemy connection to execute against
+    username: `str`
+    period_id: `int`
+    changes: `dict`
+        Deltas for any of `COUNT_FIELDS` and new values for any of
+        `FLAG_FIELDS`
+    """
+    table = UserPeriodStats.__table__
+    values = {}
+    for field in COUNT_FIELDS:
+        if changes.get(field):
+            values[field] = table.c[field] + changes[field]
+    for field in FLAG_FIELDS:
+        if field in changes:
+            values[field] = changes[field]
+    if not values:
+        return
+    update = (
+        table.update()
+        .where(and_(table.c.username == username, table.c.period_id == period_id))
+        .values(**values)
+    )
+    result = connection.execute(update)
+    if result.rowcount:
+        return
+    row = {"username": username, "period_id": period_id}
+    for field in COUNT_FIELDS:
+        row[field] = max(changes.get(field, 0), 0)
+    for field in FLAG_FIELDS:
+        row[field] = bool(changes.get(field, False))
+    # another transaction may have inserted the row since the update, so
+    # insert within a savepoint and fall back to updating the winning row
+    savepoint = connection.begin_nested()
+    try:
+        connection.execute(table.insert().values(**row))
+    except IntegrityError:
+        savepoint.rollback()
+        connection.execute(update)
+    else:
+        savepoint.commit()
+
+
+@event.listens_for(Session, "after_flush")
+def update_user_period_stats(session, context):
+    """Incrementally maintain `UserPeriodStats` from forms and nominations
+    that were added or deleted as part of the flush."""
+    changes = defaultdict(lambda: defaultdict(int))
+    for objects, sign in ((session.new, 1), (session.deleted, -1)):
+        for obj in objects:
+            if isinstance(obj, FeedbackForm):
+                _collect_form_changes(changes, obj, sign)
+            elif isinstance(obj, Nominee):
+                _collect_nominee_changes(changes, obj, sign)
+    if not changes:
+        return
+    connection = session.connection()
+    for (username, period_id), user_changes in changes.items():
+        if username is None or period_id is None:
+            continue
+        apply_user_period_stats_changes(connection, username, period_id, user_changes)
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, Unicode
+
+from adaero.models.all import Base, Checkable
+
+
+class PeriodTransition(Base, Checkable):
+    """Records that the hooks of a period entering a subperiod have run, so
+    that they only run once across every process. Refer to
+    `adaero.transitions`."""
+
+    __tablename__ = "period_transitions"
+    period_id = Column(Integer, ForeignKey("periods.id"), primary_key=True)
+    subperiod = Column(Unicode(length=32), primary_key=True)
+    fired_utc = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return "PeriodTransition(period_id=%s, subperiod=%s)" % (
+            self.period_id,
+            self.subperiod,
+        )
+
+    def check_validity(self, session):
+        pass
@@ -1,5 +1,20 @@
-from sqlalchemy import Column, Integer, ForeignKey, Unicode, UniqueConstraint, Boolean
+from collections import namedtuple, OrderedDict
+from datetime import datetime, timedelta
+import threading
+import uuid
+
+from sqlalchemy import (
+    event,
+    Column,
+    Integer,
+    ForeignKey,
+    Unicode,
+    UniqueConstraint,
+    Boolean,
+)
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import relationship, backref, joinedload
+from sqlalchemy.orm.session import Session
 import transaction
 
 from logging import getLogger as get_logger
@@ -122,17 +137,262 @@ class User(Base, Serializable):
         pass
 
 
-def request_user_callback(request):
-    ldapsource = request.ldapsource
-    user_id = request.unauthenticated_userid
-    if user_id is not None:
+DirectReport = namedtuple("DirectReport", ["username"])
+
+
+class UserSnapshot(object):
+    """
+    Read only copy of a `User` and of the usernames of their direct reports,
+    which unlike the model instance can be shared between requests and
+    threads. `principals` is filled in by the authentication policy the first
+    time they are needed, refer to `adaero.security`.
+    """
+
+    FIELDS = (
+        "username",
+        "first_name",
+        "last_name",
+        "position",
+        "manager_username",
+        "employee_id",
+        "business_unit",
+        "location",
+        "email",
+        "department",
+        "has_direct_reports",
+        "is_staff",
+    )
+
+    def __init__(self, user):
+        for field in self.FIELDS:
+            setattr(self, field, getattr(user, field))
+        self.direct_reports = tuple(
+            DirectReport(direct_report.username)
+            for direct_report in user.direct_reports
+        )
+        self.principals = None
+
+    # only read the attributes copied above
+    display_name = User.display_name
+    to_dict = User.to_dict
+
+    def __repr__(self):
+        return "UserSnapshot(username=%s)" % self.username
+
+
+class UserCacheGeneration(Base):
+    """Single row whose generation changes whenever users are changed, so
+    that every process drops its `UserCache`. Refer to
+    `bump_user_cache_generation`."""
+
+    __tablename__ = "user_cache_generation"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    generation = Column(Unicode(length=32), nullable=False)
+
+    def __repr__(self):
+        return "UserCacheGeneration(generation=%s)" % self.generation
+
+
+USER_CACHE_GENERATION_ID = 1
+
+
+def bump_user_cache_generation(connection):
+    """
+    Change the generation of the users within the transaction of
+    `connection`, so that every process drops its `UserCache` the next time it
+    checks the generation after the transaction is committed.
+
+    Parameters
+    ----------
+    connection:
+        SQLAlchemy connection of the transaction changing the users
+    """
+    table = UserCacheGeneration.__table__
+    update = (
+        table.update()
+        .where(table.c.id == USER_CACHE_GENERATION_ID)
+        .values(generation=uuid.uuid4().hex)
+    )
+    if connection.execute(update).rowcount:
+        return
+    # the row is created by the first change, possibly concurrently
+    savepoint = connection.begin_nested()
+    try:
+        connection.execute(
+            table.insert().values(
+                id=USER_CACHE_GENERATION_ID, generation=uuid.uuid4().hex
+            )
+        )
+    except IntegrityError:
+        savepoint.rollback()
+        connection.execute(update)
+    else:
+        savepoint.commit()
+
+
+class UserCache(object):
+    """
+    Process level, least recently used cache of `UserSnapshot` by username,
+    so that authenticated requests do not each have to load the user and
+    their direct reports.
+
+    The cache is dropped whenever a flush adds, changes or deletes a `User`,
+    which includes population uploads, and again once its transaction ends.
+    Those changes also bump the `UserCacheGeneration` row, which each process
+    checks at most every `generation_check_interval` so that the caches of
+    other processes are dropped too. Entries also expire after `ttl`, which
+    bounds how long changes made directly in the database take to be picked
+    up.
+    """
+
+    DEFAULT_TTL_S = 300
+    DEFAULT_MAX_SIZE = 1000
+    GENERATION_CHECK_INTERVAL_S = 5
+
+    def __init__(
+        self,
+        ttl_s=DEFAULT_TTL_S,
+        max_size=DEFAULT_MAX_SIZE,
+        generation_check_interval_s=GENERATION_CHECK_INTERVAL_S,
+    ):
+        self.ttl = timedelta(seconds=ttl_s)
+        self.max_size = max_size
+        self.generation_check_interval = timedelta(seconds=generation_check_interval_s)
+        self._lock = threading.Lock()
+        self._snapshots = OrderedDict()
+        # bumped on invalidation so that snapshots loaded before it are not
+        # put back in the cache
+        self.generation = 0
+        self._shared_generation = None
+        self._next_generation_check_utc = None
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshots.clear()
+            self.generation += 1
+
+    def check_generation(self, dbsession):
+        """
+        Drop the cache if the `UserCacheGeneration` row changed since the last
+        check, which is done at most every `generation_check_interval`.
+
+        Parameters
+        ----------
+        dbsession: `sqlalchemy.orm.session.Session`
+        """
+        utcnow = datetime.utcnow()
+        with self._lock:
+            if (
+                self._next_generation_check_utc is not None
+                and utcnow < self._next_generation_check_utc
+            ):
+                return
+            self._next_generation_check_utc = utcnow + self.generation_check_interval
         with transaction.manager:
-            user = (
-                request.dbsession.query(User)
-                .options(joinedload("direct_reports").joinedload("manager"))
-                .get(user_id)
+            shared_generation = (
+                dbsession.query(UserCacheGeneration.generation)
+                .filter(UserCacheGeneration.id == USER_CACHE_GENERATION_ID)
+                .scalar()
             )
-            if not user:
-                ext_user_details = ldapsource.get_ldap_user_by_username(user_id)
-                user = User.create_from_ldap_details(ldapsource, ext_user_details)
-            return user
+        with self._lock:
+            if shared_generation != self._shared_generation:
+                if self._shared_generation is not None:
+                    log.info("User cache was dropped by another process")
+                self._snapshots.clear()
+                self.generation += 1
+                self._shared_generation = shared_generation
+
+    def get(self, username):
+        with self._lock:
+            entry = self._snapshots.get(username)
+            if entry is None:
+                return None
+            expires_utc, snapshot = entry
+            if expires_utc <= datetime.utcnow():
+                del self._snapshots[username]
+                return None
+            self._snapshots.move_to_end(username)
+            return snapshot
+
+    def put(self, snapshot, generation):
+        """
+        Parameters
+        ----------
+        snapshot: `UserSnapshot`
+        generation: `int`
+            Value of `generation` before `snapshot` was loaded
+        """
+        if self.max_size <= 0 or self.ttl <= timedelta(0):
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._snapshots[snapshot.username] = (
+                datetime.utcnow() + self.ttl,
+                snapshot,
+            )
+            self._snapshots.move_to_end(snapshot.username)
+            while len(self._snapshots) > self.max_size:
+                self._snapshots.popitem(last=False)
+
+
+USER_CACHE = UserCache()
+# set on sessions that changed users, so that the cache is invalidated again
+# once they end, as other requests may load the users previously committed in
+# the meantime
+USER_CACHE_STALE_KEY = "adaero.user_cache_stale"
+
+
+def _invalidate_user_cache(session):
+    USER_CACHE.invalidate()
+    if not session.info.get(USER_CACHE_STALE_KEY):
+        bump_user_cache_generation(session.connection())
+        session.info[USER_CACHE_STALE_KEY] = True
+
+
+@event.listens_for(Session, "after_flush")
+def invalidate_user_cache(session, context):
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, User):
+            _invalidate_user_cache(session)
+            return
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def invalidate_user_cache_after_bulk(context):
+    if context.primary_table is User.__table__:
+        _invalidate_user_cache(context.session)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def invalidate_user_cache_after_transaction(session):
+    if session.info.pop(USER_CACHE_STALE_KEY, False):
+        USER_CACHE.invalidate()
+
+
+def request_user_callback(request):
+    user_id = request.unauthenticated_userid
+    if user_id is None:
+        return None
+    USER_CACHE.check_generation(request.dbsession)
+    snapshot = USER_CACHE.get(user_id)
+    if snapshot is not None:
+        return snapshot
+    generation = USER_CACHE.generation
+    ldapsource = request.ldapsource
+    with transaction.manager:
+        user = (
+            request.dbsession.query(User)
+            .options(joinedload("direct_reports"))
+            .get(user_id)
+        )
+        if not user:
+            ext_user_details = ldapsource.get_ldap_user_by_username(user_id)
+            user = User.create_from_ldap_details(ldapsource, ext_user_details)
+        if not user:
+            return None
+        snapshot = UserSnapshot(user)
+    USER_CACHE.put(snapshot, generation)
+    return snapshot
@@ -7,17 +7,26 @@ try:
 except ImportError:
     from io import StringIO
 
+from collections import namedtuple
+from itertools import islice
+
 import transaction
 import csv
 
 from logging import getLogger as get_logger
-from adaero.models.user import User
-from adaero.models import find_external_managers
+from sqlalchemy import bindparam, inspect, select
+from zope.sqlalchemy import mark_changed
+
+from adaero.models.user import User, USER_CACHE, bump_user_cache_generation
 
 log = get_logger(__name__)
 
 
 MANAGER_ID = "manager_id"
+# number of users written to each chunk of a population CSV generated from LDAP
+POPULATION_CSV_CHUNK_SIZE = 500
+# number of usernames in each statement deleting the users that were removed
+SYNC_DELETE_BATCH_SIZE = 500
 STANDARD_FIELDNAMES = [
     "first_name",
     "last_name",
@@ -54,6 +63,13 @@ DEFAULT_MANAGER_ONLY_TMPL = (
     "has missing manager ID. Not adding manager as likely not directly "
     "related to population."
 )
+DEFAULT_INVALID_USER_TMPL = (
+    'Unable to add user with payload "{payload}" because of the following: '
+    "{reason}. Ignoring user and continuing.."
+)
+DEFAULT_NO_USERS_MESSAGE = (
+    "No valid users found in the population CSV. Keeping the current population."
+)
 DEFAULT_INVALID_HEADERS_TMPL = (
     "The headings on the population CSV are invalid. The following columns "
     "are missing - {missing}. The following columns are not correct - "
@@ -64,7 +80,11 @@ DEFAULT_INVALID_HEADERS_TMPL = (
 def generate_population_csv_from_business_unit(ldapsource, unit_name):
     """
     Generate population CSV from users stored in LDAP and filtered by
-    configured key `business_unit` on `unit_name`.
+    configured key `business_unit` on `unit_name`, followed by their managers
+    from outside of the business unit.
+
+    Rows are generated in the order the source returns the users, as they
+    arrive, so that neither the users nor the CSV are held in memory at once.
 
     Parameters
     ----------
@@ -75,24 +95,115 @@ def generate_population_csv_from_business_unit(ldapsource, unit_name):
 
     Returns
     -------
-    Populated StringIO buffer
+    Iterator of chunks of the CSV as `str`
     """
     log.info("Generating population CSV for business " 'unit "{}"'.format(unit_name))
-    raw_ldap_users = list(ldapsource.get_all_ldap_users(business_unit=unit_name))
-    if not len(raw_ldap_users):
-        return StringIO(
-            'Business unit "%s" is invalid ' "as no users can be found." % unit_name
+    raw_ldap_users = iter(ldapsource.get_all_ldap_users(business_unit=unit_name))
+    # employee IDs by username of the users written so far
+    written_uids = {}
+    # LDAP details by username of the managers that were not written when
+    # their reports were, `None` if not found
+    managers = {}
+    while True:
+        chunk = list(islice(raw_ldap_users, POPULATION_CSV_CHUNK_SIZE))
+        if not chunk:
+            break
+        yield _write_population_csv_chunk(
+            ldapsource, chunk, written_uids, managers, not written_uids
+        )
+    if not written_uids:
+        yield 'Business unit "%s" is invalid as no users can be found.' % unit_name
+        return
+
+    log.info("Finding external managers")
+    external_managers = []
+    for username, detail in sorted(managers.items()):
+        if username in written_uids:
+            continue
+        if not detail:
+            log.warning(
+                "Unable to find LDAP details for outside manager with "
+                'dn "%s"' % username
+            )
+            continue
+        log.info('Found external manager member "%s"' % username)
+        external_managers.append(detail)
+    if external_managers:
+        yield _write_population_csv_chunk(
+            ldapsource, external_managers, written_uids, managers, False
         )
-    external_managers = list(find_external_managers(ldapsource, raw_ldap_users))
-    raw_ldap_users.extend(external_managers)
+
+
+def _write_population_csv_chunk(
+    ldapsource, ldap_details, written_uids, managers, write_header
+):
+    """
+    Format the users of `ldap_details` as staff rows of the population CSV,
+    looking up the managers that have not been written or looked up yet in
+    one go.
+
+    Parameters
+    ----------
+    ldapsource: `adaero.security.ldapauth.LDAPAuth`
+    ldap_details: `list` of `dict`
+    written_uids: `dict`
+        Employee IDs by username of the users written so far, updated with
+        those of `ldap_details`
+    managers: `dict`
+        LDAP details by username of the managers looked up so far, updated
+        with those looked up for `ldap_details`
+    write_header: `bool`
+
+    Returns
+    -------
+    Rows as `str`
+    """
     users = []
-    for rlu in raw_ldap_users:
+    for rlu in ldap_details:
         u = User.create_from_ldap_details(ldapsource, rlu)
         if u:
             u.is_staff = True
             users.append(u)
-    sorted_ldap_users = sorted(users, key=lambda u: (u.last_name, u.first_name))
-    return _write_population_csv_to_buffer(ldapsource, sorted_ldap_users)
+            written_uids[u.username] = u.employee_id
+    missing = {
+        u.manager_username
+        for u in users
+        if u.manager_username
+        and u.manager_username not in written_uids
+        and u.manager_username not in managers
+    }
+    if missing:
+        found = ldapsource.get_ldap_users_by_kvs(ldapsource.username_key, missing)
+        for username in missing:
+            managers[username] = found.get(username)
+
+    f = StringIO()
+    writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+    if write_header:
+        writer.writeheader()
+    for u in users:
+        u_dict = u.to_dict()
+
+        for c in DROP_COLUMNS:
+            u_dict.pop(c)
+
+        manager_username = u_dict.pop("manager_username", None)
+        if manager_username:
+            manager_uid = written_uids.get(manager_username)
+            if manager_uid is None and managers.get(manager_username):
+                manager_uid = managers[manager_username][ldapsource.uid_key]
+            if manager_uid:
+                u_dict[MANAGER_ID] = manager_uid
+            else:
+                log.warning(
+                    'Could not find manager with username "{}". Not '
+                    'filling in manager id for user with username "{}"'.format(
+                        manager_username, u.username
+                    )
+                )
+
+        writer.writerow(u_dict)
+    return f.getvalue()
 
 
 def generate_population_csv_from_db(ldapsource, dbsession):
@@ -163,16 +274,23 @@ def convert_population_csv_to_user_rows(ldapsource, contents, messages):
             )
         )
         return [], messages
+    rows = list(reader)
+    # resolve every employee and manager in a few searches rather than two
+    # per row
+    ldap_by_uid = ldapsource.get_ldap_users_by_kvs(
+        ldapsource.uid_key,
+        [row["employee_id"] for row in rows] + [row[MANAGER_ID] for row in rows],
+    )
     manager_usernames = set()
     processed_rows = []
-    for i, row in enumerate(reader):
+    for i, row in enumerate(rows):
         row_num = i + 2  # header on row 1
         manager_id = row.pop(MANAGER_ID)
         row["manager_username"] = None
         if manager_id:
             # TODO: fix this so we use strings for uids
             uid = manager_id
-            manager = ldapsource.get_ldap_user_by_kv(ldapsource.uid_key, uid)
+            manager = ldap_by_uid.get(uid)
             if not manager:
                 message = DEFAULT_INVALID_MANAGER_TMPL.format(
                     row_num=row_num, manager_uid=manager_id
@@ -186,7 +304,7 @@ def convert_population_csv_to_user_rows(ldapsource, contents, messages):
 
         # add back username
         uid = row["employee_id"]
-        ldap_data = ldapsource.get_ldap_user_by_kv(ldapsource.uid_key, uid)
+        ldap_data = ldap_by_uid.get(uid)
         if not ldap_data:
             messages.append(MISSING_USER_TMPL.format(row_num=row_num))
             continue
@@ -216,7 +334,17 @@ def generate_required_users(ldapsource, rows, messages):
     messages.
     """
     users = [User(**row) for row in rows]
-    new_one_up_managers = set()
+    usernames = {u.username for u in users}
+    ldap_by_username = ldapsource.get_ldap_users_by_kvs(
+        ldapsource.username_key,
+        [
+            u.manager_username
+            for u in users
+            if u.is_staff and u.manager_username not in usernames
+        ],
+    )
+    # by username, in the order they are first referenced
+    new_one_up_managers = {}
     manager_usernames = set()
     for u in users:
         if u.manager_username:
@@ -224,8 +352,8 @@ def generate_required_users(ldapsource, rows, messages):
         # add missing 1-up managers
         # if manager already exists as User object
         if (
-            u.manager_username in [t.username for t in users]
-            or u.manager_username in [mu.username for mu in new_one_up_managers]
+            u.manager_username in usernames
+            or u.manager_username in new_one_up_managers
             or not u.manager_username
         ):
             continue
@@ -236,18 +364,16 @@ def generate_required_users(ldapsource, rows, messages):
                 )
             )
         else:
-            m_ldap_data = ldapsource.get_ldap_user_by_kv(
-                ldapsource.username_key, u.manager_username
-            )
+            m_ldap_data = ldap_by_username.get(u.manager_username)
             mu = User.create_from_ldap_details(ldapsource, m_ldap_data)
             messages.append(
                 DEFAULT_MISSING_MANAGER_TMPL.format(
                     uid=mu.employee_id, display_name=mu.display_name
                 )
             )
-            new_one_up_managers.add(mu)
+            new_one_up_managers[mu.username] = mu
 
-    users.extend(list(new_one_up_managers))
+    users.extend(new_one_up_managers.values())
 
     for u in users:
         if u.username in manager_usernames:
@@ -278,7 +404,7 @@ def remove_duplicate_users(users, messages):
     for i, u in enumerate(users):
         row_num = i + 2  # header on row 1
 
-        if u.employee_id in list(employee_id_row_map.keys()):
+        if u.employee_id in employee_id_row_map:
             messages.append(
                 DEFAULT_DUPLICATE_USER_TMPL.format(
                     row_num=row_num, first_row_num=employee_id_row_map[u.employee_id]
@@ -289,3 +415,115 @@ def remove_duplicate_users(users, messages):
             processed_users.append(u)
 
     return processed_users, messages
+
+
+PopulationChanges = namedtuple("PopulationChanges", ["added", "updated", "removed"])
+
+
+def _get_user_columns():
+    """
+    Returns
+    -------
+    List of the `User` attribute names and their `users` table columns
+    """
+    return [(attr.key, attr.columns[0]) for attr in inspect(User).column_attrs]
+
+
+def _validate_users(users, columns, messages):
+    """
+    Rows of the `users` table for `users`, leaving out those that the
+    database would reject with a message each, so that they do not fail the
+    whole sync.
+    """
+    rows = {}
+    for u in users:
+        row = {}
+        reason = None
+        for key, column in columns:
+            value = getattr(u, key)
+            if value is None and column.default is not None:
+                value = column.default.arg
+            length = getattr(column.type, "length", None)
+            if length and value is not None and len(value) > length:
+                reason = "{} is longer than {} characters".format(key, length)
+            row[column.name] = value
+        if not u.username:
+            reason = "username is missing"
+        elif u.username in rows:
+            reason = "username is already in the population"
+        if reason:
+            message = DEFAULT_INVALID_USER_TMPL.format(
+                payload=u.to_dict(), reason=reason
+            )
+            log.error(message)
+            messages.append(message)
+            continue
+        rows[u.username] = row
+    return rows
+
+
+def sync_users(dbsession, users, messages):
+    """
+    Make the `users` table match `users` by inserting, updating and deleting
+    only the rows that differ, with bulk statements in a single transaction,
+    so that the population is never seen empty or partially uploaded.
+
+    Users that the database would reject are left out, with a message each.
+    If no user is left, the current population is kept.
+
+    Parameters
+    ----------
+    dbsession: `sqlalchemy.orm.session.Session`
+    users: `list` of `adaero.models.user.User`
+        Transient users of the new population
+    messages: `list` of `str`
+
+    Returns
+    -------
+    `PopulationChanges` with the number of users added, updated and removed,
+    and messages
+    """
+    columns = _get_user_columns()
+    new_rows = _validate_users(users, columns, messages)
+    if not new_rows:
+        messages.append(DEFAULT_NO_USERS_MESSAGE)
+        return PopulationChanges(0, 0, 0), messages
+
+    table = User.__table__
+    with transaction.manager:
+        current_rows = {
+            row[table.c.username]: dict(row)
+            for row in dbsession.execute(select([c for _, c in columns]))
+        }
+        to_insert = []
+        to_update = []
+        for username, row in new_rows.items():
+            current_row = current_rows.get(username)
+            if current_row is None:
+                to_insert.append(row)
+            elif current_row != row:
+                update = {k: v for k, v in row.items() if k != table.c.username.name}
+                update["b_username"] = username
+                to_update.append(update)
+        to_delete = sorted(set(current_rows).difference(new_rows))
+
+        if to_insert:
+            dbsession.execute(table.insert(), to_insert)
+        if to_update:
+            dbsession.execute(
+                table.update().where(table.c.username == bindparam("b_username")),
+                to_update,
+            )
+        for i in range(0, len(to_delete), SYNC_DELETE_BATCH_SIZE):
+            batch = to_delete[i : i + SYNC_DELETE_BATCH_SIZE]
+            dbsession.execute(table.delete().where(table.c.username.in_(batch)))
+        # bulk statements are not seen by the flush listener invalidating it
+        bump_user_cache_generation(dbsession.connection())
+        mark_changed(dbsession)
+    USER_CACHE.invalidate()
+    changes = PopulationChanges(len(to_insert), len(to_update), len(to_delete))
+    log.info(
+        "Added %s, updated %s and removed %s users"
+        % (changes.added, changes.updated, changes.removed)
+    )
+    return changes, messages
@@ -25,6 +25,12 @@ from adaero.models import (
     FeedbackTemplate,
 )
 from adaero.models.all import Base, SEQUENCES
+from adaero.config import get_config_value
+from adaero.stats import (
+    backfill_user_period_stats,
+    freeze_closed_periods,
+    freeze_period_stats,
+)
 
 
 log = get_logger(__name__)
@@ -183,6 +189,45 @@ def nominate_everyone(ctx):
                 dbsession.add(Nominee(user=user, period=period))
 
 
+@cli.command(name="backfill-user-period-stats")
+@click.pass_context
+def backfill_user_period_stats_table(ctx):
+    """Rebuild the materialized feedback stats from forms and nominees"""
+    engine = ctx.obj[ENGINE_KEY]
+    dbsession = get_transaction_scoped_dbsession(engine)
+    num_rows = backfill_user_period_stats(dbsession)
+    print("Backfilled %s rows of user_period_stats" % num_rows)
+
+
+@cli.command(name="freeze-period-stats")
+@click.pass_context
+@click.option(
+    "-p",
+    "--period-name",
+    help="Re-freeze this period, e.g. after a data correction. Defaults to "
+    "freezing every closed period that has not been frozen yet.",
+)
+def freeze_period_stats_snapshots(ctx, period_name):
+    """Snapshot the feedback stats of closed periods"""
+    engine = ctx.obj[ENGINE_KEY]
+    location = get_config_value(ctx.obj[SETTINGS_KEY], constants.HOMEBASE_LOCATION_KEY)
+    dbsession = get_transaction_scoped_dbsession(engine)
+    if period_name is None:
+        period_names = freeze_closed_periods(dbsession, location)
+        print("Froze stats for periods: %s" % ", ".join(period_names))
+        return
+    with transaction.manager:
+        period = dbsession.query(Period).filter(Period.name == period_name).one()
+        period_id = period.id
+        if period.subperiod(location) != Period.REVIEW_SUBPERIOD:
+            raise ValueError(
+                "Period %s is still open, only closed periods can be "
+                "frozen" % period_name
+            )
+    num_rows = freeze_period_stats(dbsession, period_id)
+    print("Froze %s rows of stats for period %s" % (num_rows, period_name))
+
+
 @cli.command()
 @click.pass_context
 def adjust(ctx):
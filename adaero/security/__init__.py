@@ -6,7 +6,7 @@ from pyramid.security import Authenticated, Everyone
 
 from adaero import constants
 from adaero.config import get_config_value, get_envvar_name, check_if_production
-from adaero.models.user import request_user_callback
+from adaero.models.user import request_user_callback, UserSnapshot
 from adaero.security.ldapauth import request_ldapauth_callback
 
 log = get_logger(__name__)
@@ -55,13 +55,31 @@ class SimpleAuthenticationPolicy(SessionAuthenticationPolicy):
         return None
 
     def effective_principals(self, request):
-        principals = [Everyone]
         user = request.user
         if not user:
-            return principals
+            return [Everyone]
+
+        # snapshots are cached across requests, so only walk the direct
+        # reports of each once
+        user_principals = getattr(user, "principals", None)
+        if user_principals is None:
+            user_principals = tuple(self._build_user_principals(user))
+            if isinstance(user, UserSnapshot):
+                user.principals = user_principals
+        principals = [Everyone]
+        principals.extend(user_principals)
+
+        if (
+            user.username
+            in request.registry.settings[constants.TALENT_MANAGER_USERNAMES_KEY]
+        ):
+            principals.append(TALENT_MANAGER_ROLE)
 
-        principals.append(Authenticated)
-        principals.append(user.username)
+        return principals
+
+    @staticmethod
+    def _build_user_principals(user):
+        principals = [Authenticated, user.username]
 
         if user.is_staff:
             principals.append(EMPLOYEE_ROLE)
@@ -74,12 +92,6 @@ class SimpleAuthenticationPolicy(SessionAuthenticationPolicy):
                 principal_string = DIRECT_REPORT_PREFIX + direct_report_user.username
                 principals.append(principal_string)
 
-        if (
-            user.username
-            in request.registry.settings[constants.TALENT_MANAGER_USERNAMES_KEY]
-        ):
-            principals.append(TALENT_MANAGER_ROLE)
-
         return principals
 
 
@@ -1,17 +1,32 @@
 # -*- encoding: utf-8 -*-
 from __future__ import unicode_literals
 
+from datetime import datetime, timedelta
 import ldap
 import ldap.filter
+from ldap.controls import SimplePagedResultsControl
 import re
+import threading
 
 from adaero import constants
 from adaero.config import get_config_value
+from adaero.security.ldappool import DEFAULT_LDAP_POOL_SIZE, LDAPConnectionPool, connect
 from logging import getLogger as get_logger
 
 DIRECT_REPORTS_KEY = "directReports"
 DISPLAY_NAME_KEY = "displayName"
 DISTINGUISHED_NAME_KEY = "distinguishedName"
+# number of values looked up by each search of `get_ldap_users_by_kvs`, to
+# keep the OR filters within what directory servers accept
+DEFAULT_SEARCH_BATCH_SIZE = 100
+# number of users returned by each page of `iter_ldap_user_pages`, within the
+# default MaxPageSize of AD of 1000
+DEFAULT_PAGE_SIZE = 500
+# bounds the memory used to remember the usernames of managers
+MAX_MEMOIZED_DNS = 50000
+# number of seconds the usernames of managers are remembered for, as long as
+# the lookups of `adaero.directory` by default
+DEFAULT_MANAGER_TTL_S = 300
 
 log = get_logger(__name__)
 
@@ -21,7 +36,11 @@ class LDAPConfigurationError(Exception):
 
 
 def request_ldapauth_callback(request):
-    return build_ldapauth_from_settings(request.registry.settings)
+    # shared by all requests so that they reuse its pooled connections
+    ldapsource = request.registry.get("ldapsource")
+    if ldapsource is None:
+        ldapsource = build_ldapauth_from_settings(request.registry.settings)
+    return ldapsource
 
 
 def build_ldapauth_from_settings(settings):
@@ -60,6 +79,17 @@ def build_ldapauth_from_settings(settings):
     dn_username_regex = get_config_value(
         settings, constants.LDAP_DN_USERNAME_REGEX_KEY, raise_if_not_set=True
     )
+    pool_size = int(
+        get_config_value(settings, constants.LDAP_POOL_SIZE_KEY, DEFAULT_LDAP_POOL_SIZE)
+    )
+    page_size = int(
+        get_config_value(settings, constants.LDAP_PAGE_SIZE_KEY, DEFAULT_PAGE_SIZE)
+    )
+    manager_ttl_s = int(
+        get_config_value(
+            settings, constants.LDAP_CACHE_TTL_S_KEY, DEFAULT_MANAGER_TTL_S
+        )
+    )
 
     return LDAPAuth(
         ldap_uri,
@@ -75,10 +105,19 @@ def build_ldapauth_from_settings(settings):
         dn_username_regex,
         department_key,
         business_unit_key,
+        pool_size,
+        page_size,
+        manager_ttl_s,
     )
 
 
 class LDAPAuth(object):
+    """
+    Look up users in LDAP over a pool of connections bound with the search
+    account, and authenticate them over connections of their own, so that an
+    instance can be shared across threads.
+    """
+
     def __init__(
         self,
         uri,
@@ -94,6 +133,9 @@ class LDAPAuth(object):
         dn_username_regex,
         department_key=None,
         business_unit_key=None,
+        pool_size=DEFAULT_LDAP_POOL_SIZE,
+        page_size=DEFAULT_PAGE_SIZE,
+        manager_ttl_s=DEFAULT_MANAGER_TTL_S,
     ):
         self._uri = uri
         self._user_bind_template = user_bind_template
@@ -108,8 +150,10 @@ class LDAPAuth(object):
         self.business_unit_key = business_unit_key
         self._dn_username_attr = dn_username_attr
         self._dn_username_regex = dn_username_regex
-        self._conn = ldap.initialize(self._uri, trace_level=0)
-        self._conn.set_option(ldap.OPT_REFERRALS, 0)
+        self.page_size = page_size
+        self._pool = LDAPConnectionPool(
+            uri, search_username, search_password, pool_size
+        )
         self._default_fields = {
             DISTINGUISHED_NAME_KEY,
             DISPLAY_NAME_KEY,
@@ -127,13 +171,19 @@ class LDAPAuth(object):
             DIRECT_REPORTS_KEY,
         }
         self._default_vector_fields = {DIRECT_REPORTS_KEY}
+        # expiry and username of managers by DN, refer to `normalize_managers`
+        self._manager_usernames = {}
+        self._manager_ttl = timedelta(seconds=manager_ttl_s)
+        self._manager_lock = threading.Lock()
+
+    def invalidate(self):
+        """Forget the usernames of managers, lookups are otherwise cached by
+        `adaero.directory.CachedLDAPAuth`"""
+        with self._manager_lock:
+            self._manager_usernames.clear()
 
     def check_server_is_up(self):
-        try:
-            self._conn.simple_bind()
-        except ldap.SERVER_DOWN as e:
-            log.error("Unable to connect to %s", self._uri)
-            return False
+        return self._pool.is_up()
 
     def auth_user(self, username, password):
         result = False
@@ -143,14 +193,19 @@ class LDAPAuth(object):
             bind_dn = username
         if password == "":
             return result
+        # never bind a pooled connection as the user
+        conn = connect(self._uri)
         try:
-            self._conn.simple_bind_s(bind_dn, password)
+            conn.simple_bind_s(bind_dn, password)
             log.debug("Login %s", bind_dn)
             result = True
         except ldap.INVALID_CREDENTIALS:
             log.info("Invalid credentials for %s", username)
         finally:
-            self._unbind()
+            try:
+                conn.unbind_s()
+            except ldap.LDAPError:
+                pass
         return result
 
     def _get_users(self, fields, search_args):
@@ -159,64 +214,121 @@ class LDAPAuth(object):
 
         for a given user_name returns a dict of DEFAULT_FIELDS information
         from LDAP directory"""
-        self._conn.bind_s(self._search_username, self._search_password)
-        response = self._conn.search_st(*search_args)
+        response = self._pool.search_st(*search_args)
         users = self.extract_fields_from_response(response, fields)
-        for user in users:
-            self.normalize_manager(user)
+        self.normalize_managers(users)
         if len(users) == 1:
             users = users[0]
         return users
 
-    def _unbind(self):
-        self._conn.unbind()
-        self._conn = ldap.initialize(self._uri, trace_level=0)
-
     def normalize_manager(self, user):
+        """Refer to `normalize_managers`"""
+        self.normalize_managers([user])
+
+    def normalize_managers(self, users):
         """
         candidate for proprietary code
 
         `dn` is used as the `manager` attribute value but for AD, the syntax
-        is not standardised, as could be ASN.1 user selector or username"""
-        manager_data = user[self.manager_key]
-        if not manager_data:
+        is not standardised, as could be ASN.1 user selector or username.
+
+        Manager DNs are replaced with usernames, looking up those not
+        resolved by previous calls within `manager_ttl_s` with one search per
+        `DEFAULT_SEARCH_BATCH_SIZE` of them, as many users share a manager.
+        """
+        dns = set()
+        for user in users:
+            manager_data = user[self.manager_key]
+            if manager_data and manager_data.count("=") > 0:
+                dns.add(manager_data)
+        if not dns:
             return
-        is_a_dn = manager_data.count("=") > 0
-        if is_a_dn:
-            username = self.extract_username_from_dn(manager_data)
+        utcnow = datetime.utcnow()
+        manager_usernames = {}
+        with self._manager_lock:
+            for dn in dns:
+                expires_utc, username = self._manager_usernames.get(dn, (None, None))
+                if expires_utc is not None and utcnow < expires_utc:
+                    manager_usernames[dn] = username
+        missing = dns.difference(manager_usernames)
+        if missing:
+            resolved = self._resolve_manager_dns(missing)
+            if self._manager_ttl > timedelta(0):
+                expires_utc = utcnow + self._manager_ttl
+                with self._manager_lock:
+                    if len(self._manager_usernames) + len(resolved) > MAX_MEMOIZED_DNS:
+                        self._manager_usernames.clear()
+                    self._manager_usernames.update(
+                        (dn, (expires_utc, username))
+                        for dn, username in resolved.items()
+                    )
+            manager_usernames.update(resolved)
+        for user in users:
+            manager_username = manager_usernames.get(user[self.manager_key])
+            if manager_username:
+                user[self.manager_key] = manager_username
+
+    def _resolve_manager_dns(self, dns):
+        """
+        Returns
+        -------
+        `dict` of each DN in `dns` that could be resolved to the username of
+        that manager
+        """
+        usernames_by_dn = {}
+        for dn in dns:
+            username = self.extract_username_from_dn(dn)
+            if username is None:
+                log.warning("Unable to extract username from %s, skipping..." % dn)
+            else:
+                usernames_by_dn[dn] = username
+        selectors = sorted({u.lower(): u for u in usernames_by_dn.values()}.values())
+        managers = {}
+        for i in range(0, len(selectors), DEFAULT_SEARCH_BATCH_SIZE):
+            batch = selectors[i : i + DEFAULT_SEARCH_BATCH_SIZE]
+            filter_str = "(|%s)" % "".join(
+                ldap.filter.filter_format("(%s=%s)", [self._dn_username_attr, u])
+                for u in batch
+            )
             try:
-                response = self._conn.search_st(
-                    self._base_dn,
-                    ldap.SCOPE_SUBTREE,
-                    ldap.filter.filter_format(
-                        "(%s=%s)", [self._dn_username_attr, username]
-                    ),
+                response = self._pool.search_st(
+                    self._base_dn, ldap.SCOPE_SUBTREE, filter_str
                 )
             except Exception:
                 log.warning(
                     "Unable to find user info for %s=%s, "
-                    "skipping..." % (self._dn_username_attr, username)
-                )
-                return
-            manager = self.extract_fields_from_response(
-                response, frozenset(self._default_fields)
-            )
-            if not manager:
-                raise Exception(
-                    "Unable to find manager in LDAP with selector " "(cn=%s)" % username
+                    "skipping..." % (self._dn_username_attr, ", ".join(batch))
                 )
-            manager_username = manager[0][self.username_key]
+                continue
+            for manager in self.extract_fields_from_response(
+                response, frozenset({self._dn_username_attr, self.username_key})
+            ):
+                selector = manager[self._dn_username_attr]
+                if selector:
+                    managers.setdefault(selector.lower(), manager)
+            for username in batch:
+                if username.lower() not in managers:
+                    raise Exception(
+                        "Unable to find manager in LDAP with selector "
+                        "(cn=%s)" % username
+                    )
+
+        resolved = {}
+        for dn, username in usernames_by_dn.items():
+            if username.lower() not in managers:
+                continue
+            manager_username = managers[username.lower()][self.username_key]
             if not manager_username:
                 log.warning(
-                    'unable to get AD username of user "%s", assuming '
-                    'it is "%s", extracted from dn'
-                    % (user[self.username_key], username)
+                    'unable to get AD username of manager "%s", assuming '
+                    'it is "%s", extracted from dn' % (dn, username)
                 )
                 manager_username = username
             if len(manager_username) > 32:
                 log.warning("manager username %s is too long, skipping...")
-                return
-            user[self.manager_key] = manager_username
+                continue
+            resolved[dn] = manager_username
+        return resolved
 
     def get_ldap_user_by_kv(self, param, value):
         user = self._get_users(
@@ -232,6 +344,56 @@ class LDAPAuth(object):
             user = None
         return user
 
+    def get_ldap_users_by_kvs(
+        self, param, values, batch_size=DEFAULT_SEARCH_BATCH_SIZE
+    ):
+        """
+        Look up the users whose `param` is one of `values` over a pooled
+        connection, searching with `(|(param=a)(param=b)...)` filters of up to
+        `batch_size` values rather than once per value.
+
+        Parameters
+        ----------
+        param: `str`
+            LDAP attribute to match on
+        values:
+            iterable of `str`, empty values and duplicates are ignored
+        batch_size: `int`
+            Number of values looked up by each search
+
+        Returns
+        -------
+        `dict` of each value that matched a user to the LDAP details of that
+        user, compared case insensitively like the directory does
+        """
+        values = sorted({v for v in values if v})
+        found = {}
+        if not values:
+            return found
+        fields = self._default_fields | {param}
+        users = []
+        for i in range(0, len(values), batch_size):
+            batch = values[i : i + batch_size]
+            filter_str = "(|%s)" % "".join(
+                ldap.filter.filter_format("(%s=%s)", [param, v]) for v in batch
+            )
+            response = self._pool.search_st(
+                self._base_dn, ldap.SCOPE_SUBTREE, filter_str
+            )
+            users_by_value = {}
+            for user in self.extract_fields_from_response(response, fields):
+                if user[param]:
+                    users_by_value.setdefault(user[param].lower(), user)
+            for v in batch:
+                user = users_by_value.get(v.lower())
+                if user:
+                    found[v] = user
+                    users.append(user)
+                else:
+                    log.info("No user found for {} '{}'.".format(param, v))
+        self.normalize_managers(users)
+        return found
+
     def get_ldap_user_by_dn(self, dn):
         return self.get_ldap_user_by_kv("distinguishedName", dn)
 
@@ -245,14 +407,67 @@ class LDAPAuth(object):
         return self.get_ldap_user_by_kv("mail", email)
 
     def get_all_ldap_users(self, business_unit=None):
+        """
+        Returns
+        -------
+        Iterator of the details of every user, or of those in `business_unit`
+        when the business unit key is configured, refer to
+        `iter_ldap_user_pages`
+        """
+        for page in self.iter_ldap_user_pages(business_unit):
+            for user in page:
+                yield user
+
+    def iter_ldap_user_pages(self, business_unit=None):
+        """
+        Search for users a page at a time with the RFC 2696 simple paged
+        results control, so that the search is not cut short by the size limit
+        of the server and the users do not all have to be held at once.
+
+        The search runs on a connection of its own, bound with the search
+        account, as the server ties the paging cookie to the connection and
+        it is held until the last page is consumed.
+
+        Returns
+        -------
+        Iterator of lists of at most `page_size` user details
+        """
         filtered_str = "(&(objectClass=organizationalPerson)"
         if self.business_unit_key:
             filtered_str += "({}={})".format(self.business_unit_key, business_unit)
         filtered_str += ")"
-        users = self._get_users(
-            self._default_fields, [self._base_dn, ldap.SCOPE_SUBTREE, filtered_str]
-        )
-        return users
+        control = SimplePagedResultsControl(True, size=self.page_size, cookie="")
+        connection = connect(self._uri)
+        try:
+            connection.bind_s(self._search_username, self._search_password)
+            while True:
+                msgid = connection.search_ext(
+                    self._base_dn,
+                    ldap.SCOPE_SUBTREE,
+                    filtered_str,
+                    serverctrls=[control],
+                )
+                _, response, _, serverctrls = connection.result3(msgid)
+                # leave out search references, which have no DN
+                users = self.extract_fields_from_response(
+                    [r for r in response if r[0] is not None], self._default_fields
+                )
+                self.normalize_managers(users)
+                if users:
+                    yield users
+                cookies = [
+                    c.cookie
+                    for c in serverctrls
+                    if c.controlType == SimplePagedResultsControl.controlType
+                ]
+                if not cookies or not cookies[0]:
+                    break
+                control.cookie = cookies[0]
+        finally:
+            try:
+                connection.unbind_s()
+            except ldap.LDAPError:
+                pass
 
     def extract_fields_from_response(self, response, fields):
         if not response:
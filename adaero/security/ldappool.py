@@ -0,0 +1,150 @@
+"""
+Connections to the LDAP server bound with the search account and shared
+across request threads, rather than one connection per `LDAPAuth` that is
+rebound before every search.
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+
+import ldap
+
+from logging import getLogger as get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_LDAP_POOL_SIZE = 4
+# connections idle for longer are checked before being reused, as servers and
+# firewalls drop idle connections
+HEALTH_CHECK_IDLE_S = 30
+# errors after which a connection is not reused, other `ldap.LDAPError`s being
+# results reported by the server over a connection that is still usable
+CONNECTION_ERRORS = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT)
+
+
+def connect(uri):
+    """Open a connection to `uri` without binding, as `python-ldap` only
+    connects on the first operation"""
+    connection = ldap.initialize(uri, trace_level=0)
+    connection.set_option(ldap.OPT_REFERRALS, 0)
+    return connection
+
+
+class LDAPConnectionPool(object):
+    """
+    Thread-safe pool of connections bound with the search account. A
+    connection is only used by the thread that checked it out, up to `size`
+    of them being checked out at once. Connections are opened when first
+    needed, checked with a `whoami` if idle for more than
+    `HEALTH_CHECK_IDLE_S` and reopened when the server is down.
+
+    Parameters
+    ----------
+    uri: `str`
+    bind_dn: `str`
+    password: `str`
+        Search account to bind the connections with
+    size: `int`
+        Maximum number of connections
+    """
+
+    def __init__(self, uri, bind_dn, password, size=DEFAULT_LDAP_POOL_SIZE):
+        self.uri = uri
+        self.size = max(1, int(size))
+        self._bind_dn = bind_dn
+        self._password = password
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        # (connection, instant it was last used) of those not checked out,
+        # most recently used last
+        self._idle = []
+        self.num_connects = 0
+
+    @contextmanager
+    def connection(self):
+        """Check out a bound connection, blocking while all `size` of them
+        are in use. It is returned to the pool unless the connection failed
+        or an exception other than `ldap.LDAPError` interrupted its use, such
+        as a bug in the caller or the thread exiting, in which case it is
+        discarded."""
+        self._slots.acquire()
+        try:
+            connection = self._checkout()
+            try:
+                yield connection
+            except CONNECTION_ERRORS:
+                self._discard(connection)
+                raise
+            except ldap.LDAPError:
+                self._checkin(connection)
+                raise
+            except BaseException:
+                self._discard(connection)
+                raise
+            else:
+                self._checkin(connection)
+        finally:
+            self._slots.release()
+
+    def search_st(self, *args, **kwargs):
+        """`search_st` on a pooled connection, retried once on a new one if
+        the server was down, such as after it restarted"""
+        try:
+            with self.connection() as connection:
+                return connection.search_st(*args, **kwargs)
+        except ldap.SERVER_DOWN:
+            log.warning("LDAP server %s is down, reconnecting" % self.uri)
+        with self.connection() as connection:
+            return connection.search_st(*args, **kwargs)
+
+    def is_up(self):
+        try:
+            with self.connection() as connection:
+                connection.whoami_s()
+        except ldap.LDAPError as e:
+            log.error("Unable to connect to %s: %s" % (self.uri, e))
+            return False
+        return True
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def _checkin(self, connection):
+        with self._lock:
+            self._idle.append((connection, time.monotonic()))
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, last_used_s = self._idle.pop()
+            if time.monotonic() - last_used_s < HEALTH_CHECK_IDLE_S:
+                return connection
+            try:
+                connection.whoami_s()
+            except ldap.LDAPError as e:
+                log.info("Discarding stale LDAP connection: %s" % e)
+                self._discard(connection)
+            else:
+                return connection
+        connection = connect(self.uri)
+        try:
+            connection.bind_s(self._bind_dn, self._password)
+        except ldap.LDAPError:
+            self._discard(connection)
+            raise
+        with self._lock:
+            self.num_connects += 1
+        return connection
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.unbind_s()
+        except ldap.LDAPError:
+            pass
@@ -0,0 +1,334 @@
+"""
+Session backends selected through `adaero.session_type`:
+
+* `beaker` (default) - whatever `pyramid_beaker` is configured with through
+  the `beaker.session.*` settings. The `memory` type only works when there is
+  a single worker process.
+* `sql` - session state is kept in the `http_sessions` table on the
+  application database, with only a signed random id in the cookie, so any
+  worker or host can serve any request.
+* `cookie` - session state is kept in a signed cookie. This is enough for
+  the username and CSRF token that are stored in the session.
+"""
+
+import binascii
+import calendar
+from datetime import datetime, timedelta
+import json
+import os
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from logging import getLogger as get_logger
+from pyramid.interfaces import ISession
+from pyramid.session import SignedCookieSessionFactory
+from sqlalchemy import and_
+from webob.cookies import SignedSerializer
+from zope.interface import implementer
+
+from adaero import constants
+from adaero.config import get_config_value
+from adaero.models import HTTPSession
+
+log = get_logger(__name__)
+
+BEAKER_SESSION_TYPE = "beaker"
+SQL_SESSION_TYPE = "sql"
+COOKIE_SESSION_TYPE = "cookie"
+
+SESSION_COOKIE_NAME = "adaero_session"
+DEFAULT_SESSION_TIMEOUT_S = 12 * 60 * 60
+DEFAULT_SESSION_CLEANUP_INTERVAL_S = 60 * 60
+
+
+class _SessionIdSerializer(object):
+    def dumps(self, appstruct):
+        return appstruct.encode("utf-8")
+
+    def loads(self, bstruct):
+        return bstruct.decode("utf-8")
+
+
+class SQLSessionFactory(object):
+    """
+    Pyramid session factory that keeps session state in the `http_sessions`
+    table, using `engine` directly so that saving the session does not
+    depend on the outcome of the transaction of the request.
+
+    Parameters
+    ----------
+    engine:
+        SQLAlchemy engine of the application database
+    secret: `str`
+        Used to sign the session id held in the cookie
+    timeout_s: `int`
+        Number of seconds of inactivity after which a session expires
+    secure: `bool`
+        If `True`, only send the cookie over HTTPS
+    """
+
+    def __init__(self, engine, secret, timeout_s, secure=False):
+        self.engine = engine
+        self.timeout = timedelta(seconds=timeout_s)
+        self.secure = secure
+        self.serializer = SignedSerializer(
+            secret, "adaero.session.", serializer=_SessionIdSerializer()
+        )
+
+    def __call__(self, request):
+        return SQLSession(request, self)
+
+    def get_session_id(self, request):
+        cookie = request.cookies.get(SESSION_COOKIE_NAME)
+        if not cookie:
+            return None
+        try:
+            return self.serializer.loads(cookie.encode("utf-8"))
+        except ValueError:
+            return None
+
+    def load(self, session_id):
+        table = HTTPSession.__table__
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                table.select().where(
+                    and_(
+                        table.c.id == session_id,
+                        table.c.expires_utc > datetime.utcnow(),
+                    )
+                )
+            ).fetchone()
+        if row is None:
+            return None
+        return row.created_utc, row.expires_utc, json.loads(row.data)
+
+    def save(self, session_id, created_utc, data):
+        table = HTTPSession.__table__
+        expires_utc = datetime.utcnow() + self.timeout
+        values = {"data": json.dumps(data), "expires_utc": expires_utc}
+        with self.engine.begin() as connection:
+            result = connection.execute(
+                table.update().where(table.c.id == session_id).values(**values)
+            )
+            if not result.rowcount:
+                connection.execute(
+                    table.insert().values(
+                        id=session_id, created_utc=created_utc, **values
+                    )
+                )
+        return expires_utc
+
+    def delete(self, session_id):
+        table = HTTPSession.__table__
+        with self.engine.begin() as connection:
+            connection.execute(table.delete().where(table.c.id == session_id))
+
+    def set_cookie(self, response, session_id):
+        response.set_cookie(
+            SESSION_COOKIE_NAME,
+            self.serializer.dumps(session_id).decode("utf-8"),
+            max_age=int(self.timeout.total_seconds()),
+            path="/",
+            secure=self.secure,
+            httponly=True,
+        )
+
+    def delete_cookie(self, response):
+        response.delete_cookie(SESSION_COOKIE_NAME, path="/")
+
+
+def _changes(wrapped):
+    def changed(session, *args, **kwargs):
+        session.changed()
+        return wrapped(session, *args, **kwargs)
+
+    return changed
+
+
+@implementer(ISession)
+class SQLSession(dict):
+    """Session backed by `SQLSessionFactory`, saved once the response is
+    ready if it was changed or is about to expire."""
+
+    def __init__(self, request, factory):
+        super(SQLSession, self).__init__()
+        self._factory = factory
+        self._id = None
+        self._expires_utc = None
+        self._dirty = False
+        self._invalidated = False
+        self.new = True
+        self.created_utc = datetime.utcnow()
+        session_id = factory.get_session_id(request)
+        state = factory.load(session_id) if session_id else None
+        if state is not None:
+            self.created_utc, self._expires_utc, data = state
+            dict.update(self, data)
+            self._id = session_id
+            self.new = False
+        request.add_response_callback(self._save)
+
+    @property
+    def created(self):
+        return calendar.timegm(self.created_utc.timetuple())
+
+    def changed(self):
+        self._dirty = True
+
+    def invalidate(self):
+        if self._id is not None:
+            self._factory.delete(self._id)
+        dict.clear(self)
+        self._id = None
+        self._expires_utc = None
+        self._dirty = False
+        self._invalidated = True
+        self.new = True
+        self.created_utc = datetime.utcnow()
+
+    __setitem__ = _changes(dict.__setitem__)
+    __delitem__ = _changes(dict.__delitem__)
+    clear = _changes(dict.clear)
+    update = _changes(dict.update)
+    setdefault = _changes(dict.setdefault)
+    pop = _changes(dict.pop)
+    popitem = _changes(dict.popitem)
+
+    def flash(self, msg, queue="", allow_duplicate=True):
+        storage = self.setdefault("_f_" + queue, [])
+        if allow_duplicate or (msg not in storage):
+            storage.append(msg)
+
+    def pop_flash(self, queue=""):
+        return self.pop("_f_" + queue, [])
+
+    def peek_flash(self, queue=""):
+        return self.get("_f_" + queue, [])
+
+    def new_csrf_token(self):
+        token = binascii.hexlify(os.urandom(20)).decode("ascii")
+        self["_csrft_"] = token
+        return token
+
+    def get_csrf_token(self):
+        token = self.get("_csrft_")
+        if token is None:
+            token = self.new_csrf_token()
+        return token
+
+    def _needs_refresh(self):
+        # only extend sessions once half of their lifetime is used up, to
+        # avoid a write on every request
+        if self._expires_utc is None:
+            return False
+        return self._expires_utc - datetime.utcnow() < self._factory.timeout / 2
+
+    def _save(self, request, response):
+        if not (self._dirty or self._needs_refresh()):
+            if self._invalidated:
+                self._factory.delete_cookie(response)
+            return
+        if self._id is None:
+            self._id = binascii.hexlify(os.urandom(32)).decode("ascii")
+        self._expires_utc = self._factory.save(self._id, self.created_utc, dict(self))
+        self._dirty = False
+        self._factory.set_cookie(response, self._id)
+
+
+def purge_expired_sessions(engine):
+    """
+    Delete every expired row of the `http_sessions` table.
+
+    Parameters
+    ----------
+    engine:
+        SQLAlchemy engine of the application database
+
+    Returns
+    -------
+    Number of sessions deleted
+    """
+    table = HTTPSession.__table__
+    with engine.begin() as connection:
+        result = connection.execute(
+            table.delete().where(table.c.expires_utc <= datetime.utcnow())
+        )
+    log.info("Purged %s expired sessions" % result.rowcount)
+    return result.rowcount
+
+
+def _schedule_session_cleanup(settings, engine):
+    interval_s = int(
+        get_config_value(
+            settings,
+            constants.SESSION_CLEANUP_INTERVAL_S_KEY,
+            DEFAULT_SESSION_CLEANUP_INTERVAL_S,
+        )
+    )
+    if not interval_s:
+        log.info(
+            "Setting %s is 0, not purging expired sessions."
+            % constants.SESSION_CLEANUP_INTERVAL_S_KEY
+        )
+        return
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        purge_expired_sessions, trigger="interval", args=(engine,), seconds=interval_s
+    )
+    scheduler.start()
+
+
+def includeme(config):
+    settings = config.get_settings()
+    session_type = get_config_value(
+        settings, constants.SESSION_TYPE_KEY, BEAKER_SESSION_TYPE
+    )
+    if session_type == BEAKER_SESSION_TYPE:
+        config.include("pyramid_beaker")
+        return
+
+    secret = get_config_value(
+        settings, constants.SESSION_SECRET_KEY, settings.get("beaker.session.secret")
+    )
+    if not secret:
+        raise ValueError(
+            constants.MISCONFIGURATION_MESSAGE.format(
+                error="%s must be set for session type %s"
+                % (constants.SESSION_SECRET_KEY, session_type)
+            )
+        )
+    timeout_s = int(
+        get_config_value(
+            settings, constants.SESSION_TIMEOUT_S_KEY, DEFAULT_SESSION_TIMEOUT_S
+        )
+    )
+    secure = bool(get_config_value(settings, constants.SERVED_ON_HTTPS_KEY))
+
+    if session_type == SQL_SESSION_TYPE:
+        engine = config.registry["dbsession_factory"].kw["bind"]
+        session_factory = SQLSessionFactory(engine, secret, timeout_s, secure=secure)
+        _schedule_session_cleanup(settings, engine)
+    elif session_type == COOKIE_SESSION_TYPE:
+        session_factory = SignedCookieSessionFactory(
+            secret,
+            cookie_name=SESSION_COOKIE_NAME,
+            max_age=timeout_s,
+            timeout=timeout_s,
+            reissue_time=timeout_s // 10,
+            secure=secure,
+            httponly=True,
+        )
+    else:
+        raise ValueError(
+            constants.MISCONFIGURATION_MESSAGE.format(
+                error="Unknown %s %s, must be one of %s"
+                % (
+                    constants.SESSION_TYPE_KEY,
+                    session_type,
+                    ", ".join(
+                        [BEAKER_SESSION_TYPE, SQL_SESSION_TYPE, COOKIE_SESSION_TYPE]
+                    ),
+                )
+            )
+        )
+    log.info("Using %s sessions" % session_type)
+    config.set_session_factory(session_factory)
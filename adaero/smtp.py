@@ -0,0 +1,222 @@
+"""
+Concurrent delivery of emails over a pool of reused SMTP connections, rate
+limited with a token bucket.
+"""
+
+import queue
+import smtplib
+import threading
+import time
+
+from logging import getLogger as get_logger
+
+log = get_logger(__name__)
+
+DEFAULT_SMTP_HOST = "localhost"
+DEFAULT_SMTP_CONNECTIONS = 4
+# number of times a message is attempted when the server drops the connection
+MAX_SEND_ATTEMPTS = 3
+RECONNECT_DELAY_S = 0.5
+# messages rendered ahead of delivery per connection, to bound memory use
+QUEUED_MESSAGES_PER_CONNECTION = 50
+
+_STOP = object()
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket allowing on average `rate_per_s` acquisitions a
+    second, in bursts of up to `burst`. Implemented as the equivalent generic
+    cell rate algorithm, so that each caller reserves its slot and then sleeps
+    at most once rather than polling for tokens.
+
+    Parameters
+    ----------
+    rate_per_s: `float`
+        Average rate, no limit is applied if 0 or less
+    burst: `int`
+        Number of acquisitions allowed back to back, defaults to one second
+        worth of `rate_per_s`
+    """
+
+    def __init__(self, rate_per_s, burst=None):
+        self.interval_s = 1 / rate_per_s if rate_per_s > 0 else 0
+        if burst is None:
+            burst = max(1, int(rate_per_s))
+        self.burst = burst
+        self._lock = threading.Lock()
+        # instant at which a token is next available if none are saved up
+        self._next_s = None
+
+    def acquire(self):
+        if not self.interval_s:
+            return
+        with self._lock:
+            now_s = time.monotonic()
+            next_s = now_s if self._next_s is None else max(self._next_s, now_s)
+            wait_s = next_s - (self.burst - 1) * self.interval_s - now_s
+            self._next_s = next_s + self.interval_s
+        if wait_s > 0:
+            time.sleep(wait_s)
+
+
+class SMTPDispatcher(object):
+    """
+    Send emails from a pool of worker threads, each holding its own SMTP
+    connection that is reused across messages and reopened if the server
+    drops it. Messages are submitted with `send` and delivered in the
+    background, `wait` blocks until all submitted messages are handled.
+
+    Parameters
+    ----------
+    num_connections: `int`
+        Number of worker threads and so of concurrent SMTP connections
+    rate_per_s: `float`
+        Maximum average number of emails sent a second across all
+        connections, no limit is applied if 0 or less
+    host: `str`
+    port: `int`
+        SMTP server to connect to, 0 being the default SMTP port
+    """
+
+    def __init__(
+        self,
+        num_connections=DEFAULT_SMTP_CONNECTIONS,
+        rate_per_s=0,
+        host=DEFAULT_SMTP_HOST,
+        port=0,
+    ):
+        self.num_connections = max(1, int(num_connections))
+        self.host = host
+        self.port = port
+        self.bucket = TokenBucket(rate_per_s)
+        self.num_sent = 0
+        self.num_failed = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(
+            maxsize=self.num_connections * QUEUED_MESSAGES_PER_CONNECTION
+        )
+        self._workers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        for i in range(self.num_connections):
+            worker = threading.Thread(
+                target=self._work, name="smtp-dispatcher-%s" % i, daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def send(self, from_addr, to_addrs, message, callback=None):
+        """
+        Queue a message for delivery, blocking if too many are already
+        queued.
+
+        Parameters
+        ----------
+        from_addr: `str`
+        to_addrs: `list` of `str`
+        message: `str`
+            Full message, as given to `smtplib.SMTP.sendmail`
+        callback: `callable`
+            Called from the worker thread once the message is handled, with
+            `None` if it was sent or else the exception it failed with
+        """
+        self._queue.put((from_addr, to_addrs, message, callback))
+
+    def wait(self):
+        self._queue.join()
+
+    def close(self):
+        """Deliver any queued message and close all connections"""
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def _connect(self):
+        connection = smtplib.SMTP()
+        connection.connect(self.host, self.port)
+        return connection
+
+    def _work(self):
+        connection = None
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    break
+                connection = self._deliver(connection, *item)
+            except Exception as e:
+                # keep the worker alive so that `wait` does not block forever
+                log.exception(e)
+            finally:
+                self._queue.task_done()
+        if connection is not None:
+            try:
+                connection.quit()
+            except OSError:
+                connection.close()
+
+    def _deliver(self, connection, from_addr, to_addrs, message, callback):
+        self.bucket.acquire()
+        error = None
+        for attempt in range(1, MAX_SEND_ATTEMPTS + 1):
+            try:
+                if connection is None:
+                    connection = self._connect()
+                connection.sendmail(from_addr, to_addrs, message)
+            except smtplib.SMTPServerDisconnected as e:
+                error = e
+                connection = self._disconnected(connection, to_addrs, attempt, e)
+            except smtplib.SMTPException as e:
+                # rejected by the server, retrying would not help
+                error = e
+                self._failed(to_addrs, e)
+                break
+            except OSError as e:
+                # refused, reset or timed out connections
+                error = e
+                connection = self._disconnected(connection, to_addrs, attempt, e)
+            except Exception as e:
+                error = e
+                self._failed(to_addrs, e)
+                break
+            else:
+                error = None
+                with self._lock:
+                    self.num_sent += 1
+                log.debug("Email sent to %s" % ", ".join(to_addrs))
+                break
+        if callback is not None:
+            callback(error)
+        return connection
+
+    def _disconnected(self, connection, to_addrs, attempt, e):
+        log.warning(
+            "SMTP connection lost sending email to %s (attempt %s of %s): %s"
+            % (", ".join(to_addrs), attempt, MAX_SEND_ATTEMPTS, e)
+        )
+        if connection is not None:
+            connection.close()
+        if attempt == MAX_SEND_ATTEMPTS:
+            self._failed(to_addrs, e)
+        else:
+            time.sleep(RECONNECT_DELAY_S * attempt)
+        return None
+
+    def _failed(self, to_addrs, e):
+        with self._lock:
+            self.num_failed += 1
+        log.exception(e)
+        log.error(
+            "Exception occured with sending email to %s, "
+            "skipping over and continuing..." % ", ".join(to_addrs)
+        )
@@ -1,14 +1,40 @@
 from __future__ import unicode_literals
 
-from collections import defaultdict, OrderedDict
+from datetime import datetime
 
+from logging import getLogger as get_logger
+import numpy as np
 import pandas as pd
 import transaction
-from sqlalchemy import literal, func, and_, asc
+from sqlalchemy import literal, func, and_, asc, case
 
 from adaero import constants
 from adaero.config import get_config_value
-from adaero.models import User, Period, FeedbackForm, Nominee
+from adaero.models import (
+    User,
+    Period,
+    FeedbackForm,
+    FrozenPeriodStats,
+    Nominee,
+    UserPeriodStats,
+)
+
+log = get_logger(__name__)
+
+
+CROSS_JOIN_STATS_ENGINE = "cross_join"
+AGGREGATE_STATS_ENGINE = "aggregate"
+MATERIALIZED_STATS_ENGINE = "materialized"
+DEFAULT_STATS_ENGINE = MATERIALIZED_STATS_ENGINE
+
+COUNT_COLUMNS = ["contributed", "received", "has_summary", "is_nominated"]
+STANDARD_STATS_COLUMNS = [
+    "start_date",
+    "period_name",
+    "contributed",
+    "received",
+    "has_summary",
+]
 
 
 def build_stats_dataframe(request, username_list, user_columns):
@@ -24,6 +50,10 @@ def build_stats_dataframe(request, username_list, user_columns):
 
     This is also refered to as the "feedback statistics" or "feedback stats"
 
+    The calculation is delegated to the engine named by the configured
+    `adaero.stats_engine` value (see `STATS_ENGINES`). Every engine
+    returns the same dataframe so they can be compared against each other.
+
     Parameters
     ----------
     request: `pyramid.request.Request`
@@ -37,7 +67,38 @@ def build_stats_dataframe(request, username_list, user_columns):
     -------
     `pandas.Dataframe` containing the stats for the filtered list of users.
     """
-    query = request.dbsession.query
+    engine_name = get_config_value(
+        request.registry.settings, constants.STATS_ENGINE_KEY, DEFAULT_STATS_ENGINE
+    )
+    try:
+        build_func = STATS_ENGINES[engine_name]
+    except KeyError:
+        raise ValueError(
+            constants.MISCONFIGURATION_MESSAGE.format(
+                error='Stats engine "%s" is not one of "%s"'
+                % (engine_name, ", ".join(sorted(STATS_ENGINES.keys())))
+            )
+        )
+    return build_func(request.dbsession, username_list, user_columns)
+
+
+def build_stats_dataframe_by_cross_join(dbsession, username_list, user_columns):
+    """
+    Original stats engine. Builds a User x Period cross join in SQL and
+    issues a separate outer joined query against it for contributed,
+    received and nominated counts, merging the results in pandas.
+
+    Parameters
+    ----------
+    dbsession: `sqlalchemy.orm.session.Session`
+    username_list: `list[str]`
+    user_columns: `list[str]`
+
+    Returns
+    -------
+    `pandas.Dataframe`, refer to `build_stats_dataframe`
+    """
+    query = dbsession.query
     with transaction.manager:
         cross_product_stmt = (
             query(
@@ -114,12 +175,10 @@ def build_stats_dataframe(request, username_list, user_columns):
             )
         )
 
-        cross_product_df = pd.read_sql(
-            cross_product_stmt.statement, request.dbsession.bind
-        )
-        contributed_df = pd.read_sql(contributed_stmt.statement, request.dbsession.bind)
-        received_df = pd.read_sql(received_stmt.statement, request.dbsession.bind)
-        nominated_df = pd.read_sql(nominated_stmt.statement, request.dbsession.bind)
+        cross_product_df = pd.read_sql(cross_product_stmt.statement, dbsession.bind)
+        contributed_df = pd.read_sql(contributed_stmt.statement, dbsession.bind)
+        received_df = pd.read_sql(received_stmt.statement, dbsession.bind)
+        nominated_df = pd.read_sql(nominated_stmt.statement, dbsession.bind)
 
         # sanity check
         assert (
@@ -129,23 +188,340 @@ def build_stats_dataframe(request, username_list, user_columns):
             == len(cross_product_df)
         )
 
-        # merge and clean table
+        # merge table
         df = pd.merge(
             pd.merge(pd.merge(cross_product_df, contributed_df), received_df),
             nominated_df,
         )
-        df.loc[df.is_nominated == 0, "received"] = -1
-        df.loc[:, "has_summary"] = df.loc[:, "has_summary"].astype(bool)
-        df = df.drop("is_nominated", axis=1)
-        df = df.drop("p_id", axis=1)
-    standard_columns_to_keep = [
-        "start_date",
-        "period_name",
-        "contributed",
-        "received",
-        "has_summary",
+    return _finalise_stats_dataframe(df, user_columns)
+
+
+def build_stats_dataframe_by_aggregation(dbsession, username_list, user_columns):
+    """
+    Stats engine that runs one grouped query per table instead of
+    re-scanning `forms` and `nominees` against a User x Period cross join.
+    Received feedback and summaries are counted in the same pass over
+    `forms` through conditional aggregation. The cross product is only
+    built in pandas, once the counts are small.
+
+    Periods that have been frozen (see `freeze_period_stats`) are read from
+    their snapshot and are excluded from the aggregation.
+
+    Parameters
+    ----------
+    dbsession: `sqlalchemy.orm.session.Session`
+    username_list: `list[str]`
+    user_columns: `list[str]`
+
+    Returns
+    -------
+    `pandas.Dataframe`, refer to `build_stats_dataframe`
+    """
+    with transaction.manager:
+        user_df, period_df = _read_users_and_periods(
+            dbsession, username_list, user_columns
+        )
+        frozen_df, frozen_period_ids = _read_frozen_stats(dbsession, username_list)
+        count_dfs = [
+            pd.read_sql(stmt.statement, dbsession.bind)
+            for stmt in _build_aggregate_count_stmts(
+                dbsession, username_list, excluded_period_ids=frozen_period_ids
+            )
+        ]
+    live_df = _combine_count_dfs(count_dfs)
+    return _merge_stats_counts(user_df, period_df, [live_df, frozen_df], user_columns)
+
+
+def build_stats_dataframe_from_materialized(dbsession, username_list, user_columns):
+    """
+    Stats engine that reads the counts maintained in the `user_period_stats`
+    table (see `adaero.models.stats.UserPeriodStats`) instead of aggregating
+    `forms` and `nominees`.
+
+    Periods that have been frozen (see `freeze_period_stats`) are read from
+    their snapshot instead.
+
+    Parameters
+    ----------
+    dbsession: `sqlalchemy.orm.session.Session`
+    username_list: `list[str]`
+    user_columns: `list[str]`
+
+    Returns
+    -------
+    `pandas.Dataframe`, refer to `build_stats_dataframe`
+    """
+    with transaction.manager:
+        user_df, period_df = _read_users_and_periods(
+            dbsession, username_list, user_columns
+        )
+        frozen_df, frozen_period_ids = _read_frozen_stats(dbsession, username_list)
+        stats_stmt = dbsession.query(
+            UserPeriodStats.username,
+            UserPeriodStats.period_id.label("p_id"),
+            UserPeriodStats.contributed,
+            UserPeriodStats.received,
+            UserPeriodStats.has_summary,
+            UserPeriodStats.is_nominated,
+        ).filter(UserPeriodStats.username.in_(username_list))
+        if frozen_period_ids:
+            stats_stmt = stats_stmt.filter(
+                ~UserPeriodStats.period_id.in_(frozen_period_ids)
+            )
+        stats_df = pd.read_sql(stats_stmt.statement, dbsession.bind)
+    return _merge_stats_counts(user_df, period_df, [stats_df, frozen_df], user_columns)
+
+
+def backfill_user_period_stats(dbsession):
+    """
+    Rebuild every row of the `user_period_stats` table from `forms` and
+    `nominees`. Needed once after the table is created, and after any data
+    correction made outside of the ORM.
+
+    Parameters
+    ----------
+    dbsession: `sqlalchemy.orm.session.Session`
+
+    Returns
+    -------
+    Number of rows written
+    """
+    with transaction.manager:
+        rows = _read_aggregate_count_rows(dbsession)
+        dbsession.query(UserPeriodStats).delete()
+        if rows:
+            dbsession.execute(UserPeriodStats.__table__.insert(), rows)
+    log.info("Backfilled %s user period stats rows" % len(rows))
+    return len(rows)
+
+
+def freeze_period_stats(dbsession, period_id):
+    """
+    Snapshot the stats of a single period from `forms` and `nominees` into
+    the `frozen_period_stats` table, replacing any previous snapshot, and
+    mark the period as frozen. From then on stats requests read the snapshot
+    for that period instead of computing it. Call again to re-freeze a
+    period after a data correction.
+
+    Parameters
+    ----------
+    dbsession: `sqlalchemy.orm.session.Session`
+    period_id: `int`
+
+    Returns
+    -------
+    Number of rows written
+    """
+    with transaction.manager:
+        rows = _read_aggregate_count_rows(dbsession, period_ids=[period_id])
+        dbsession.query(FrozenPeriodStats).filter(
+            FrozenPeriodStats.period_id == period_id
+        ).delete(synchronize_session=False)
+        if rows:
+            dbsession.execute(FrozenPeriodStats.__table__.insert(), rows)
+        dbsession.query(Period).filter(Period.id == period_id).update(
+            {Period.stats_frozen_utc: datetime.utcnow()}, synchronize_session=False
+        )
+    log.info("Froze %s stats rows for period id %s" % (len(rows), period_id))
+    return len(rows)
+
+
+def freeze_closed_periods(dbsession, location):
+    """
+    Freeze the stats of every period that is in the review subperiod at
+    `location` and has not been frozen yet.
+
+    Parameters
+    ----------
+    dbsession: `sqlalchemy.orm.session.Session`
+    location: `str`
+        Location used to determine the subperiod, normally the configured
+        homebase location
+
+    Returns
+    -------
+    List of names of the periods that were frozen
+    """
+    with transaction.manager:
+        periods = (
+            dbsession.query(Period)
+            .filter(Period.stats_frozen_utc == None)  # noqa: E711
+            .order_by(asc(Period.enrollment_start_utc))
+            .all()
+        )
+        closed_periods = [
+            (p.id, p.name)
+            for p in periods
+            if p.subperiod(location) == Period.REVIEW_SUBPERIOD
+        ]
+    for period_id, _ in closed_periods:
+        freeze_period_stats(dbsession, period_id)
+    return [name for _, name in closed_periods]
+
+
+def _read_frozen_stats(dbsession, username_list):
+    frozen_period_ids = [
+        p_id
+        for (p_id,) in dbsession.query(Period.id).filter(
+            Period.stats_frozen_utc != None  # noqa: E711
+        )
     ]
-    return df[user_columns + standard_columns_to_keep]
+    frozen_stmt = dbsession.query(
+        FrozenPeriodStats.username,
+        FrozenPeriodStats.period_id.label("p_id"),
+        FrozenPeriodStats.contributed,
+        FrozenPeriodStats.received,
+        FrozenPeriodStats.has_summary,
+        FrozenPeriodStats.is_nominated,
+    ).filter(
+        FrozenPeriodStats.username.in_(username_list),
+        FrozenPeriodStats.period_id.in_(frozen_period_ids),
+    )
+    frozen_df = pd.read_sql(frozen_stmt.statement, dbsession.bind)
+    return frozen_df, frozen_period_ids
+
+
+def _read_aggregate_count_rows(dbsession, period_ids=None):
+    """Aggregate counts from `forms` and `nominees` as rows that can be
+    inserted into `user_period_stats` or `frozen_period_stats`."""
+    count_dfs = [
+        pd.read_sql(stmt.statement, dbsession.bind)
+        for stmt in _build_aggregate_count_stmts(dbsession, period_ids=period_ids)
+    ]
+    df = _combine_count_dfs(count_dfs)
+    return [
+        {
+            "username": username,
+            "period_id": int(p_id),
+            "contributed": int(contributed),
+            "received": int(received),
+            "has_summary": bool(has_summary),
+            "is_nominated": bool(is_nominated),
+        }
+        for username, p_id, contributed, received, has_summary, is_nominated in (
+            df[["username", "p_id"] + COUNT_COLUMNS].values
+        )
+    ]
+
+
+def _read_users_and_periods(dbsession, username_list, user_columns):
+    query = dbsession.query
+    user_table = User.__table__
+    selected_user_columns = ["username"] + [c for c in user_columns if c != "username"]
+    users_stmt = (
+        query(*[user_table.c[c] for c in selected_user_columns])
+        .filter(User.username.in_(username_list))
+        .order_by(asc(User.username))
+    )
+    periods_stmt = query(
+        Period.enrollment_start_utc.label("start_date"),
+        Period.name.label("period_name"),
+        Period.id.label("p_id"),
+    ).order_by(asc(Period.id))
+    user_df = pd.read_sql(users_stmt.statement, dbsession.bind)
+    period_df = pd.read_sql(periods_stmt.statement, dbsession.bind)
+    return user_df, period_df
+
+
+def _build_aggregate_count_stmts(
+    dbsession, username_list=None, period_ids=None, excluded_period_ids=None
+):
+    """Grouped contributed, received/has_summary and nominated queries,
+    optionally restricted to `username_list` and `period_ids`, or to periods
+    other than `excluded_period_ids`."""
+    query = dbsession.query
+    contributed_stmt = (
+        query(
+            FeedbackForm.from_username.label("username"),
+            FeedbackForm.period_id.label("p_id"),
+            func.count(FeedbackForm.id).label("contributed"),
+        )
+        .filter(FeedbackForm.is_summary == False)  # noqa: E712
+        .group_by(FeedbackForm.from_username, FeedbackForm.period_id)
+    )
+    received_stmt = query(
+        FeedbackForm.to_username.label("username"),
+        FeedbackForm.period_id.label("p_id"),
+        func.sum(
+            case([(FeedbackForm.is_summary == False, 1)], else_=0)  # noqa: E712
+        ).label("received"),
+        func.sum(
+            case([(FeedbackForm.is_summary == True, 1)], else_=0)  # noqa: E712
+        ).label("has_summary"),
+    ).group_by(FeedbackForm.to_username, FeedbackForm.period_id)
+    nominated_stmt = query(
+        Nominee.username.label("username"),
+        Nominee.period_id.label("p_id"),
+        func.count(Nominee.id).label("is_nominated"),
+    ).group_by(Nominee.username, Nominee.period_id)
+    if username_list is not None:
+        contributed_stmt = contributed_stmt.filter(
+            FeedbackForm.from_username.in_(username_list)
+        )
+        received_stmt = received_stmt.filter(
+            FeedbackForm.to_username.in_(username_list)
+        )
+        nominated_stmt = nominated_stmt.filter(Nominee.username.in_(username_list))
+    if period_ids is not None:
+        contributed_stmt = contributed_stmt.filter(
+            FeedbackForm.period_id.in_(period_ids)
+        )
+        received_stmt = received_stmt.filter(FeedbackForm.period_id.in_(period_ids))
+        nominated_stmt = nominated_stmt.filter(Nominee.period_id.in_(period_ids))
+    if excluded_period_ids:
+        contributed_stmt = contributed_stmt.filter(
+            ~FeedbackForm.period_id.in_(excluded_period_ids)
+        )
+        received_stmt = received_stmt.filter(
+            ~FeedbackForm.period_id.in_(excluded_period_ids)
+        )
+        nominated_stmt = nominated_stmt.filter(
+            ~Nominee.period_id.in_(excluded_period_ids)
+        )
+    return contributed_stmt, received_stmt, nominated_stmt
+
+
+def _combine_count_dfs(count_dfs):
+    """Outer merge per-table counts into a single dataframe with all of
+    `COUNT_COLUMNS`, one row per username and period id."""
+    df = count_dfs[0]
+    for count_df in count_dfs[1:]:
+        df = pd.merge(df, count_df, how="outer", on=["username", "p_id"])
+    return df.dropna(subset=["username", "p_id"]).fillna(0)
+
+
+def _merge_stats_counts(user_df, period_df, count_dfs, user_columns):
+    """Left join counts onto the User x Period cross product. `count_dfs`
+    must each contain all of `COUNT_COLUMNS` and must not overlap."""
+    # .. USER CROSS JOIN PERIOD ...
+    user_df["_key"] = 0
+    period_df["_key"] = 0
+    df = pd.merge(user_df, period_df, on="_key").drop("_key", axis=1)
+    counts_df = pd.concat(
+        [count_df[["username", "p_id"] + COUNT_COLUMNS] for count_df in count_dfs]
+    )
+    counts_df[COUNT_COLUMNS] = counts_df[COUNT_COLUMNS].astype("int64")
+    counts_df["p_id"] = counts_df["p_id"].astype("int64")
+    df = pd.merge(df, counts_df, how="left", on=["username", "p_id"])
+    df[COUNT_COLUMNS] = df[COUNT_COLUMNS].fillna(0).astype("int64")
+    return _finalise_stats_dataframe(df, user_columns)
+
+
+def _finalise_stats_dataframe(df, user_columns):
+    """Clean up the merged counts into the shape returned by
+    `build_stats_dataframe`."""
+    df.loc[df.is_nominated == 0, "received"] = -1
+    df.loc[:, "has_summary"] = df.loc[:, "has_summary"].astype(bool)
+    df = df.drop("is_nominated", axis=1)
+    df = df.drop("p_id", axis=1)
+    return df[user_columns + STANDARD_STATS_COLUMNS]
+
+
+STATS_ENGINES = {
+    CROSS_JOIN_STATS_ENGINE: build_stats_dataframe_by_cross_join,
+    AGGREGATE_STATS_ENGINE: build_stats_dataframe_by_aggregation,
+    MATERIALIZED_STATS_ENGINE: build_stats_dataframe_from_materialized,
+}
 
 
 def generate_stats_payload_from_dataframe(df, dbsession, settings):
@@ -164,7 +540,7 @@ def generate_stats_payload_from_dataframe(df, dbsession, settings):
     -------
     JSON serialisable `dict`
     """
-    # build payload row by row, laying out order according to display
+    # build payload, laying out order according to display
     # on the frontend. this is to exchange frontend complexity for
     # backend complexity, given the app will be maintained by
     # backend-inclined developers
@@ -177,59 +553,10 @@ def generate_stats_payload_from_dataframe(df, dbsession, settings):
             .all()
         )
         asc_period_names = [p[0] for p in asc_periods_by_date]
-    current_period_name = current_period.name
-    current_subperiod = current_period.subperiod(location)
-
-    stats_dict = defaultdict(list)
-    for (
-        username,
-        first_name,
-        last_name,
-        _,
-        period_name,
-        contributed,
-        received,
-        has_summary,
-    ) in df.sort_values(["start_date"]).values:
-        current_user = stats_dict[username]
-
-        # add display_name to beginning of the row
-        if not len(current_user):
-            display_name = " ".join([first_name, last_name])
-            stats_dict[username].append(
-                {"displayName": display_name, "username": username}
-            )
+    values = build_stats_values(
+        df, current_period.name, current_period.subperiod(location)
+    )
 
-        stats_dict[username].extend([contributed, received])
-
-        if period_name == current_period_name:
-            button = {
-                "buttonText": "Review feedback",
-                "username": username,
-                "enable": True,
-                "hasExistingSummary": False,
-            }
-            if current_subperiod not in [
-                Period.APPROVAL_SUBPERIOD,
-                Period.REVIEW_SUBPERIOD,
-            ]:
-                button["buttonText"] = "Not in approval or review period"
-                button["enable"] = False
-            elif received == -1:  # not nominated
-                button["buttonText"] = "Not enrolled for feedback"
-                button["enable"] = False
-            elif has_summary:
-                button["buttonText"] = "Review existing summary"
-                button["enable"] = True
-                button["hasExistingSummary"] = True
-            stats_dict[username].append(button)
-
-    # sort by display name
-    ordered_dict = OrderedDict()
-    for key, value in sorted(stats_dict.items(), key=lambda k_v: k_v[0]):
-        ordered_dict[key] = value
-
-    values = list(ordered_dict.values())
     payload = {
         "periods": asc_period_names,
         "periodColumns": ["Given", "Received"],
@@ -237,3 +564,74 @@ def generate_stats_payload_from_dataframe(df, dbsession, settings):
     }
 
     return {"stats": payload}
+
+
+def build_stats_values(df, current_period_name, current_subperiod):
+    """
+    Lay out the stats of each user as a single row of the payload, ordered
+    by username. A row starts with the display name, followed by the given
+    and received counts of each period in ascending start date order, and
+    ends with the review button state for the current period.
+
+    As `df` holds every user and period combination, sorting it by username
+    then start date and reshaping it gives the counts in their final wide
+    layout, and the button states are picked with masks over the current
+    period column, instead of walking `df` row by row.
+
+    Parameters
+    ----------
+    df: `pandas.Dataframe`
+        Refer to `build_stats_dataframe`, with at least `username`,
+        `first_name` and `last_name` as user columns
+    current_period_name: `str`
+    current_subperiod: `str`
+
+    Returns
+    -------
+    `list` of rows
+    """
+    if df.empty:
+        return []
+    df = df.sort_values(["username", "start_date"], kind="mergesort")
+    num_periods = df["period_name"].nunique()
+    num_users = len(df) // num_periods
+    period_names = df["period_name"].values[:num_periods].tolist()
+    counts = df[["contributed", "received"]].values.reshape(num_users, -1)
+    users = df[["username", "first_name", "last_name"]].values[::num_periods]
+    rows = [
+        [{"displayName": " ".join([first_name, last_name]), "username": username}]
+        + user_counts
+        for (username, first_name, last_name), user_counts in zip(
+            users.tolist(), counts.tolist()
+        )
+    ]
+    if current_period_name not in period_names:
+        return rows
+
+    current_index = period_names.index(current_period_name)
+    if current_subperiod not in [Period.APPROVAL_SUBPERIOD, Period.REVIEW_SUBPERIOD]:
+        button_texts = np.full(num_users, "Not in approval or review period")
+        enabled = np.zeros(num_users, dtype=bool)
+        has_existing_summary = np.zeros(num_users, dtype=bool)
+    else:
+        current_df = df.iloc[current_index::num_periods]
+        is_not_nominated = current_df["received"].values == -1
+        has_existing_summary = ~is_not_nominated & current_df["has_summary"].values
+        button_texts = np.select(
+            [is_not_nominated, has_existing_summary],
+            ["Not enrolled for feedback", "Review existing summary"],
+            "Review feedback",
+        )
+        enabled = ~is_not_nominated
+    for row, button_text, enable, has_summary in zip(
+        rows, button_texts.tolist(), enabled.tolist(), has_existing_summary.tolist()
+    ):
+        row.append(
+            {
+                "buttonText": button_text,
+                "username": row[0]["username"],
+                "enable": enable,
+                "hasExistingSummary": has_summary,
+            }
+        )
+    return rows
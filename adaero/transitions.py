@@ -0,0 +1,272 @@
+"""
+Run hooks when a period enters a subperiod, such as sending the period email,
+rather than checking the current period on a fixed interval.
+
+The instants at which periods change subperiod at the homebase location are
+computed from the `periods` table, and a job is scheduled for the next one.
+Hooks get the `Transition` into the latest subperiod each period has
+entered, which is recorded in `period_transitions` once they have all
+succeeded so that they do not run again after a restart. Together with a
+`adaero.lease.LeaderLease`, they run once across every process. If one of
+them fails, they are all run again on the next resync, so hooks need to be
+safe to repeat.
+
+The schedule is recomputed as soon as a period is changed in this process and
+every `resync_interval_s` otherwise, to pick up changes made by other
+processes such as `configure_db adjust`.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+import threading
+
+from logging import getLogger as get_logger
+from pytz import utc
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.session import Session
+import transaction
+
+from adaero.models import Period, PeriodTransition, get_tm_session
+from adaero.models.period import PERIOD_CLOCK, get_period_dates, subperiod_boundaries
+from adaero.stats import freeze_period_stats
+
+log = get_logger(__name__)
+
+DEFAULT_RESYNC_INTERVAL_S = 5 * 60
+TRANSITION_JOB_ID = "period_transition"
+RESYNC_NOW_JOB_ID = "period_transition_resync"
+PERIODS_CHANGED_KEY = "adaero.periods_changed"
+PERIOD_DATE_KEYS = (
+    "enrollment_start_utc",
+    "entry_start_utc",
+    "approval_start_utc",
+    "approval_end_utc",
+)
+# in the order of `subperiod_boundaries`
+BOUNDARY_SUBPERIODS = (
+    Period.REVIEW_SUBPERIOD,
+    Period.APPROVAL_SUBPERIOD,
+    Period.ENTRY_SUBPERIOD,
+    Period.ENROLLMENT_SUBPERIOD,
+)
+
+Transition = namedtuple("Transition", ["period_id", "subperiod", "utc"])
+
+
+def get_due_transitions(periods, location, utcnow):
+    """
+    Parameters
+    ----------
+    periods:
+        iterable of `adaero.models.period.PeriodDates`
+    location: `str`
+    utcnow: `datetime`
+
+    Returns
+    -------
+    List of the `Transition` into the subperiod each period is in at
+    `location` as of `utcnow`, leaving out periods that are still inactive
+    """
+    transitions = []
+    for dates in periods:
+        boundaries = subperiod_boundaries(dates, location)
+        for subperiod, boundary_utc in zip(BOUNDARY_SUBPERIODS, boundaries):
+            if boundary_utc <= utcnow:
+                transitions.append(Transition(dates.id, subperiod, boundary_utc))
+                break
+    return sorted(transitions, key=lambda t: t.utc)
+
+
+def get_next_transition_utc(periods, location, utcnow):
+    """
+    Returns
+    -------
+    The first instant after `utcnow` at which one of `periods` enters a
+    subperiod at `location`, or `None` if there is none
+    """
+    return min(
+        [
+            boundary_utc
+            for dates in periods
+            for boundary_utc in subperiod_boundaries(dates, location)
+            if boundary_utc > utcnow
+        ]
+        or [None]
+    )
+
+
+def run_due_transitions(dbsession, location, hooks):
+    """
+    Call each of `hooks` with `dbsession` and the `Transition` of every
+    period into its current subperiod at `location`, unless already done.
+
+    Returns
+    -------
+    List of the transitions that were completed
+    """
+    with transaction.manager:
+        fired = {
+            (t.period_id, t.subperiod)
+            for t in dbsession.query(
+                PeriodTransition.period_id, PeriodTransition.subperiod
+            )
+        }
+        periods = get_period_dates(dbsession)
+    completed = []
+    for t in get_due_transitions(periods, location, datetime.utcnow()):
+        if (t.period_id, t.subperiod) in fired:
+            continue
+        log.info("Period id %s entered %s" % (t.period_id, t.subperiod))
+        try:
+            for hook in hooks:
+                hook(dbsession, t)
+        except Exception as e:
+            log.exception(e)
+            log.error(
+                "Hooks of period id %s entering %s failed, retrying on the next "
+                "resync" % (t.period_id, t.subperiod)
+            )
+            continue
+        try:
+            with transaction.manager:
+                dbsession.add(
+                    PeriodTransition(
+                        period_id=t.period_id,
+                        subperiod=t.subperiod,
+                        fired_utc=datetime.utcnow(),
+                    )
+                )
+        except IntegrityError:
+            # recorded by another process in the meantime
+            continue
+        completed.append(t)
+    return completed
+
+
+def warm_period_clock(dbsession, transition):
+    """Hook recomputing which period is current, rather than waiting for the
+    first request to do so"""
+    PERIOD_CLOCK.invalidate()
+    Period.get_current_period(dbsession)
+
+
+def freeze_stats_on_review(dbsession, transition):
+    """Hook freezing the stats of a period once it is closed, unless already
+    frozen, refer to `adaero.stats.freeze_period_stats`"""
+    if transition.subperiod != Period.REVIEW_SUBPERIOD:
+        return
+    with transaction.manager:
+        period = dbsession.query(Period).get(transition.period_id)
+        is_frozen = period is not None and period.stats_frozen_utc is not None
+    if not is_frozen:
+        freeze_period_stats(dbsession, transition.period_id)
+
+
+class TransitionScheduler(object):
+    """
+    Schedule `run_due_transitions` for the next instant a period changes
+    subperiod.
+
+    Parameters
+    ----------
+    scheduler: `apscheduler.schedulers.base.BaseScheduler`
+        Scheduler to add the jobs to, started by the caller
+    session_factory:
+        SQLAlchemy session factory of the application
+    location: `str`
+        Location the subperiods are computed for, normally the homebase
+        location
+    hooks: `list` of `callable`
+        Called with a `sqlalchemy.orm.session.Session` and the `Transition`
+    resync_interval_s: `int`
+        Number of seconds between checks for periods changed by other
+        processes
+    lease: `adaero.lease.LeaderLease`
+        If given, hooks only run in the process holding it
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        session_factory,
+        location,
+        hooks,
+        resync_interval_s=DEFAULT_RESYNC_INTERVAL_S,
+        lease=None,
+    ):
+        self.scheduler = scheduler
+        self.session_factory = session_factory
+        self.location = location
+        self.hooks = list(hooks)
+        self.resync_interval_s = resync_interval_s
+        self.lease = lease
+        self.next_transition_utc = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.scheduler.add_job(
+            self.resync,
+            trigger="interval",
+            seconds=self.resync_interval_s,
+            next_run_time=datetime.now(utc),
+        )
+        event.listen(Session, "after_flush", _flag_period_changes)
+        event.listen(Session, "after_commit", self._resync_after_period_changes)
+
+    def stop(self):
+        event.remove(Session, "after_flush", _flag_period_changes)
+        event.remove(Session, "after_commit", self._resync_after_period_changes)
+
+    def resync(self):
+        """Run the transitions that are due, then schedule the next one"""
+        with self._lock:
+            dbsession = get_tm_session(self.session_factory, transaction.manager)
+            try:
+                if self.lease is None or self.lease.is_held:
+                    run_due_transitions(dbsession, self.location, self.hooks)
+                with transaction.manager:
+                    periods = get_period_dates(dbsession)
+            finally:
+                dbsession.close()
+            next_transition_utc = get_next_transition_utc(
+                periods, self.location, datetime.utcnow()
+            )
+            if next_transition_utc != self.next_transition_utc:
+                self._schedule(next_transition_utc)
+            self.next_transition_utc = next_transition_utc
+
+    def _schedule(self, next_transition_utc):
+        if self.scheduler.get_job(TRANSITION_JOB_ID):
+            self.scheduler.remove_job(TRANSITION_JOB_ID)
+        if next_transition_utc is None:
+            log.info("No upcoming period transition")
+            return
+        log.info("Next period transition is at %s UTC" % next_transition_utc)
+        self.scheduler.add_job(
+            self.resync,
+            trigger="date",
+            run_date=utc.localize(next_transition_utc),
+            id=TRANSITION_JOB_ID,
+            misfire_grace_time=None,
+        )
+
+    def _resync_after_period_changes(self, session):
+        if session.info.pop(PERIODS_CHANGED_KEY, False):
+            self.scheduler.add_job(
+                self.resync, id=RESYNC_NOW_JOB_ID, replace_existing=True
+            )
+
+
+def _flag_period_changes(session, context):
+    """Flag `session` when periods are added, deleted or have their dates
+    changed, so that the schedule is recomputed once committed"""
+    if any(isinstance(obj, Period) for obj in session.new | session.deleted):
+        session.info[PERIODS_CHANGED_KEY] = True
+        return
+    for obj in session.dirty:
+        if isinstance(obj, Period):
+            attrs = inspect(obj).attrs
+            if any(attrs[key].history.has_changes() for key in PERIOD_DATE_KEYS):
+                session.info[PERIODS_CHANGED_KEY] = True
+                return
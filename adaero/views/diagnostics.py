@@ -0,0 +1,32 @@
+from __future__ import unicode_literals
+
+from pyramid.security import Allow
+from rest_toolkit import resource
+
+from adaero.database import get_pool_status
+from adaero.security import TALENT_MANAGER_ROLE
+from adaero.views import Root
+
+
+@resource("/api/v1/diagnostics")
+class Diagnostics(Root):
+    __acl__ = [(Allow, TALENT_MANAGER_ROLE, "read")]
+
+    def __init__(self, request):  # pylint disable=unused-argument
+        pass
+
+
+@Diagnostics.GET(permission="read")
+def get_diagnostics(request):
+    """
+    Returns
+    -------
+    JSON-serialisable usage of the database connection pool and of the LDAP
+    directory cache shared by the requests and background jobs of this
+    process
+    """
+    payload = {"pool": get_pool_status(request.registry["dbengine"])}
+    get_directory_status = getattr(request.ldapsource, "get_status", None)
+    if get_directory_status is not None:
+        payload["directory"] = get_directory_status()
+    return payload
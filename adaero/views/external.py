@@ -1,5 +1,7 @@
 from __future__ import unicode_literals
 
+from datetime import datetime
+
 from logging import getLogger as get_logger
 from pyramid.httpexceptions import HTTPNotFound, HTTPBadRequest
 from pyramid.security import Allow
@@ -8,8 +10,8 @@ import transaction
 
 from adaero import constants
 from adaero import date
-from adaero import mail
 from adaero.config import get_config_value
+from adaero.mail import enqueue_invite_email
 from adaero.models import ExternalInvite, Nominee, Period, User
 from adaero.security import ldapauth, EMPLOYEE_ROLE
 from adaero.text import interpolate_template
@@ -61,7 +63,8 @@ def get_external_invite_status(request):
 
     Returns
     -------
-    JSON-serialisable dict that contains list of external users invited.
+    JSON-serialisable dict that contains list of external users invited,
+    with the delivery state of their invite email.
     """
     ldapsource = request.ldapsource
     location = get_config_value(
@@ -91,27 +94,32 @@ def get_external_invite_status(request):
     invitee_users = []
     with transaction.manager:
         invites = (
-            request.dbsession.query(ExternalInvite.to_username)
+            request.dbsession.query(
+                ExternalInvite.to_username, ExternalInvite.email_status
+            )
             .filter(
                 ExternalInvite.from_username == request.user.username,
                 ExternalInvite.period_id == current_period.id,
             )
             .all()
         )
-    for invitee in invites:
-        ldap_details = ldapsource.get_ldap_user_by_username(invitee[0])
-        invitee_users.append(User.create_from_ldap_details(ldapsource, ldap_details))
+    for to_username, email_status in invites:
+        ldap_details = ldapsource.get_ldap_user_by_username(to_username)
+        invitee_users.append(
+            (User.create_from_ldap_details(ldapsource, ldap_details), email_status)
+        )
 
-    invitee_users.sort(key=lambda x: x.first_name)
+    invitee_users.sort(key=lambda x: x[0].first_name)
 
     payload_users = []
-    for user in invitee_users:
+    for user, email_status in invitee_users:
         payload_users.append(
             {
                 "displayName": user.display_name,
                 "businessUnit": user.business_unit,
                 "department": user.department,
                 "email": user.email,
+                "emailStatus": email_status,
             }
         )
     return {"canInvite": True, "invitees": payload_users}
@@ -121,8 +129,9 @@ def get_external_invite_status(request):
 def post_external_invite(request):
     """
     If allowed, records that `request.user` sent an external invite to a user
-    identified by their email which must be in LDAP, and sends an email to
-    that invited used.
+    identified by their email which must be in LDAP, and queues an email to
+    that invited used. Returns once the invite is recorded, without waiting
+    for the email to be sent.
 
     Parameters
     ----------
@@ -144,6 +153,7 @@ def post_external_invite(request):
     support_email = get_config_value(
         settings, constants.SUPPORT_EMAIL_KEY, "your IT support for this tool"
     )
+    send_emails = get_config_value(settings, constants.ENABLE_SEND_EMAIL_KEY)
     with transaction.manager:
         if current_period.subperiod(location) != Period.ENTRY_SUBPERIOD:
             raise HTTPBadRequest(
@@ -159,12 +169,7 @@ def post_external_invite(request):
             )
 
         ext_user = User.create_from_ldap_details(ldapsource, ext_user_details)
-        invite = ExternalInvite(
-            to_username=ext_user.username,
-            from_username=request.user.username,
-            period=current_period,
-        )
-        invites = (
+        invite = (
             request.dbsession.query(ExternalInvite)
             .filter(
                 ExternalInvite.to_username == ext_user.username,
@@ -173,12 +178,38 @@ def post_external_invite(request):
             )
             .one_or_none()
         )
-        if not invites:
+        if not invite:
+            invite = ExternalInvite(
+                to_username=ext_user.username,
+                from_username=request.user.username,
+                period=current_period,
+            )
             request.dbsession.add(invite)
-    mail.send_invite_email(
-        request.dbsession,
-        request.registry.settings,
-        inviter=request.user,
-        invitee=ext_user,
-    )
+        # inviting again resends the email
+        invite.email_status = ExternalInvite.EMAIL_PENDING if send_emails else None
+        invite.email_updated_utc = datetime.utcnow()
+        request.dbsession.flush()
+        if send_emails:
+            enqueue_invite_email(
+                request.dbsession,
+                settings,
+                invite,
+                request.user,
+                ext_user,
+                current_period,
+            )
+    outbox_delivery = request.registry.get("outbox_delivery")
+    if not send_emails:
+        log.info(
+            "Enable send email is not set, not sending an invite email to %s"
+            % ext_user.email
+        )
+    elif outbox_delivery is not None:
+        outbox_delivery.wake()
+    else:
+        log.warning(
+            "Setting %s is false, the invite email to %s is left in the outbox "
+            "until the email job runs"
+            % (constants.RUN_EMAIL_INTERVAL_JOB_KEY, ext_user.email)
+        )
     return {"success": True}
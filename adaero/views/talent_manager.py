@@ -1,4 +1,5 @@
 import base64
+import csv
 from datetime import datetime
 
 try:
@@ -12,8 +13,7 @@ from pyramid.security import Allow
 from pyramid.response import Response
 from pyramid.httpexceptions import HTTPBadRequest
 from rest_toolkit import resource
-from sqlalchemy.orm import joinedload
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import asc
 import transaction
 
 from logging import getLogger as get_logger
@@ -24,8 +24,14 @@ from adaero.stats import (
     build_stats_dataframe,
     generate_stats_payload_from_dataframe,
 )
-from adaero.models import User, FeedbackForm
-from adaero.mail import check_and_send_email
+from adaero.models import (
+    User,
+    FeedbackAnswer,
+    FeedbackForm,
+    FeedbackQuestion,
+    Period,
+)
+from adaero.mail import enqueue_period_email
 from adaero.views import Root
 from adaero import population
 
@@ -113,41 +119,71 @@ USER_ORDERED_COLUMNS = [
 ]
 
 
+COMPANY_STATS_CSV_CHUNK_SIZE = 500
+
+
 @CompanyFeedbackStatsCSV.GET(permission="read")
 def get_company_feedback_stats_csv(request):
     """
+    The CSV is streamed in chunks of `COMPANY_STATS_CSV_CHUNK_SIZE` users,
+    so the whole company is never held in memory at once.
+
     Returns
     -------
     HTTP Response with feedback statistics for every user saved in
     database, stored as a CSV file attachment to the response. Please refer to
     `adaero/stats.py` for more information on feedback statistics.
     """
+    dbsession = request.dbsession
     with transaction.manager:
         all_usernames = [
-            u.username
-            for u in request.dbsession.query(User)
+            username
+            for (username,) in dbsession.query(User.username)
             .filter(User.is_staff == True)  # noqa
-            .all()
+            .order_by(asc(User.last_name), asc(User.username))
         ]
-    df = build_stats_dataframe(
-        request, username_list=all_usernames, user_columns=USER_ORDERED_COLUMNS
-    )
-    output = StringIO()
-    user_df = df[USER_ORDERED_COLUMNS].drop_duplicates()
-
-    # replace 'manager' column in user_df with manager details without
-    # another database query as df will contain ALL users
-    tmp_df = user_df.loc[:, ["username", "first_name", "last_name", "email"]]
-    tmp_df.loc[:, "line_manager_name"] = (
-        tmp_df.loc[:, "first_name"] + " " + tmp_df.loc[:, "last_name"]
+        # line managers are looked up up front as they may be in another chunk
+        managers_stmt = dbsession.query(
+            User.username, User.first_name, User.last_name, User.email
+        ).filter(
+            User.is_staff == True,  # noqa
+            User.username.in_(dbsession.query(User.manager_username)),
+        )
+        manager_df = pd.read_sql(managers_stmt.statement, dbsession.bind)
+    manager_df.loc[:, "line_manager_name"] = (
+        manager_df.loc[:, "first_name"] + " " + manager_df.loc[:, "last_name"]
     )
-    manager_df = tmp_df.rename(
+    manager_df = manager_df.rename(
         index=int, columns={"username": "manager", "email": "line_manager_email"}
     )
-
     manager_df = manager_df.loc[
         :, ["manager", "line_manager_name", "line_manager_email"]
     ]
+    chunks = _generate_company_stats_csv_chunks(request, all_usernames, manager_df)
+    return _build_streaming_csv_response(chunks, "company-stats.csv")
+
+
+def _generate_company_stats_csv_chunks(request, usernames, manager_df):
+    for i in range(0, len(usernames), COMPANY_STATS_CSV_CHUNK_SIZE):
+        df = build_stats_dataframe(
+            request,
+            username_list=usernames[i : i + COMPANY_STATS_CSV_CHUNK_SIZE],
+            user_columns=USER_ORDERED_COLUMNS,
+        )
+        output = StringIO()
+        _build_company_stats_csv_df(df, manager_df).to_csv(
+            output, encoding="utf-8", index=False, header=i == 0
+        )
+        yield output.getvalue().encode("utf-8")
+
+
+def _build_company_stats_csv_df(df, manager_df):
+    # sorting before the merges keeps the order of the users across chunks
+    user_df = (
+        df[USER_ORDERED_COLUMNS]
+        .drop_duplicates()
+        .sort_values(["last_name", "username"], kind="mergesort")
+    )
     user_df = pd.merge(user_df, manager_df, how="left").drop(
         ["manager", "username"], axis=1
     )
@@ -158,56 +194,85 @@ def get_company_feedback_stats_csv(request):
         :, ["contributed", "received"]
     ]
     pv.columns = ["_".join(reversed(col)).strip() for col in pv.columns.values]
-    df = pd.merge(user_df, pv.reset_index()).sort_values("last_name")
-
-    # build response
-    df.to_csv(output, encoding="utf-8", index=False)
-    return _build_csv_response(output, "company-stats.csv")
+    return pd.merge(user_df, pv.reset_index())
 
 
 @resource("/api/v1/company-raw-feedback.csv")
 class CompanyRawFeedbackCSV(Root):
     __acl__ = [(Allow, TALENT_MANAGER_ROLE, "read")]
 
-    COLUMNS_TO_DROP = [
-        "id",
-        "period_id",
-        "is_draft",
-        "approved_by_username",
-        "q_id",
-        "form_id",
+    COLUMNS = [
+        FeedbackForm.to_username,
+        FeedbackForm.from_username,
+        FeedbackForm.is_summary,
+        Period.name,
+        FeedbackQuestion.question_template,
+        FeedbackAnswer.content,
     ]
 
     def __init__(self, request):  # pylint disable=unused-argument
         pass
 
 
+RAW_FEEDBACK_CSV_CHUNK_SIZE = 1000
+RAW_FEEDBACK_SINCE_FORMAT = "%Y-%m-%d"
+
+
 @CompanyRawFeedbackCSV.GET(permission="read")
 def get_company_raw_feedback_stats_csv(request):
     """
     Generate a CSV with every single feedback entry across all periods. Useful
     for auditing purposes and only accessible by talent managers.
 
+    Rows are read through a server side cursor and written to the response
+    `RAW_FEEDBACK_CSV_CHUNK_SIZE` rows at a time, so the export is never held
+    in memory in full.
+
+    Parameters
+    ----------
+    request:
+        Can optionally contain the query params `period`, to only export a
+        single period by name, and `since`, a date in the form of YYYY-MM-DD,
+        to only export periods that started on or after it
+
     Returns
     -------
     HTTP Response with every single feedback entry, including summarisations,
     stored as a CSV file attachment to the response.
     """
+    query = (
+        request.dbsession.query(*CompanyRawFeedbackCSV.COLUMNS)
+        .outerjoin(Period, Period.id == FeedbackForm.period_id)
+        .outerjoin(FeedbackAnswer, FeedbackAnswer.form_id == FeedbackForm.id)
+        .outerjoin(FeedbackQuestion, FeedbackQuestion.id == FeedbackAnswer.question_id)
+        .order_by(asc(FeedbackForm.id), asc(FeedbackAnswer.id))
+    )
+    period_name = request.params.get("period")
+    if period_name:
+        query = query.filter(Period.name == period_name)
+    since = request.params.get("since")
+    if since:
+        try:
+            since_dt = datetime.strptime(since, RAW_FEEDBACK_SINCE_FORMAT)
+        except ValueError:
+            raise HTTPBadRequest("since query param must be in the form YYYY-MM-DD")
+        query = query.filter(Period.enrollment_start_utc >= since_dt)
+    chunks = _generate_raw_feedback_csv_chunks(query)
+    return _build_streaming_csv_response(chunks, "raw-feedback.csv")
+
+
+def _generate_raw_feedback_csv_chunks(query):
     output = StringIO()
-    dbsession = request.dbsession
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerow([column.key for column in CompanyRawFeedbackCSV.COLUMNS])
     with transaction.manager:
-        df = pd.read_sql(
-            dbsession.query(FeedbackForm)
-            .options(
-                joinedload("period").load_only("name"),
-                joinedload("answers.question").load_only("question_template"),
-            )
-            .statement,
-            dbsession.bind,
-        )
-    df = df.drop(CompanyRawFeedbackCSV.COLUMNS_TO_DROP, axis=1)
-    df.to_csv(output, encoding="utf-8", index=False)
-    return _build_csv_response(output, "raw-feedback.csv")
+        for i, row in enumerate(query.yield_per(RAW_FEEDBACK_CSV_CHUNK_SIZE), 1):
+            writer.writerow(row)
+            if not i % RAW_FEEDBACK_CSV_CHUNK_SIZE:
+                yield output.getvalue().encode("utf-8")
+                output.seek(0)
+                output.truncate()
+    yield output.getvalue().encode("utf-8")
 
 
 @resource("/api/v1/send-email")
@@ -220,13 +285,22 @@ class SendEmail(Root):
 
 @SendEmail.POST(permission="mass_email")
 def send_email(_, request):
-    check_and_send_email(
+    """Add the email to the outbox, which is only delivered by the email job
+    of the process holding the scheduler lease"""
+    num_added = enqueue_period_email(
         request.dbsession,
-        request.ldapsource,
         request.registry.settings,
         template_key=request.json_body["templateKey"],
         force=True,
     )
+    outbox_delivery = request.registry.get("outbox_delivery")
+    if outbox_delivery is not None:
+        outbox_delivery.wake()
+    elif num_added:
+        log.warning(
+            "Setting %s is false, %s emails are left in the outbox until the "
+            "email job runs" % (constants.RUN_EMAIL_INTERVAL_JOB_KEY, num_added)
+        )
     return {"success": True}
 
 
@@ -243,6 +317,15 @@ def _build_csv_response(buffer, filename):
     return response
 
 
+def _build_streaming_csv_response(chunks, filename):
+    response = Response(
+        content_type="text/csv",
+        content_disposition="attachment; " "filename={}.csv".format(filename),
+    )
+    response.app_iter = chunks
+    return response
+
+
 @resource("/api/v1/generate-population.csv")
 class GeneratePopulationCSV(Root):
     __acl__ = [(Allow, TALENT_MANAGER_ROLE, "read")]
@@ -256,10 +339,13 @@ def generate_population_csv(request):
     business_unit = request.params.get("businessUnit")
     if business_unit is None:
         raise HTTPBadRequest("businessUnit query param is empty or missing")
-    buffer_ = population.generate_population_csv_from_business_unit(
+    chunks = population.generate_population_csv_from_business_unit(
         request.ldapsource, business_unit
     )
-    return _build_csv_response(buffer_, "{}-population".format(business_unit))
+    return _build_streaming_csv_response(
+        (chunk.encode("utf-8") for chunk in chunks),
+        "{}-population".format(business_unit),
+    )
 
 
 @resource("/api/v1/get-current-population.csv")
@@ -291,8 +377,9 @@ class UploadNewPopulationCSV(Root):
 def upload_new_population_csv(request):
     """
     Accept a base64 encoded CSV, decode and validate against the configured
-    LDAP source, and attempt to generate user models. If generated, drop all
-    current users and inserts the new user models into the configured database.
+    LDAP source, and attempt to generate user models. If generated, the
+    users in the configured database are made to match them, refer to
+    `adaero.population.sync_users`.
 
     Parameters
     ----------
@@ -304,32 +391,17 @@ def upload_new_population_csv(request):
     JSON-serialisable payload that contains:
     * Any messages that needs to be communicated to the talent manager on
     the outcome of updating the new population according to the uploaded CSV.
+    * The number of users added, updated and removed.
     """
     dbsession = request.dbsession
     content = base64.b64decode(request.json_body["content"])
     content = content.decode()
+    # look up the new population afresh
+    request.ldapsource.invalidate()
     processed_users, messages = population.get_valid_users_from_csv(
         request.ldapsource, content
     )
-    with transaction.manager:
-        num_rows = dbsession.query(User).delete()
-        log.info("Deleted %s old users!" % num_rows)
-    users_added = 0
-    for user in processed_users:
-        try:
-            with transaction.manager:
-                dbsession.add(user)
-                users_added += 1
-        except (TypeError, IntegrityError) as e:
-            message = (
-                'Unable to add user with payload "{}" '
-                "because of the following: {}. Ignoring user "
-                "and continuing..".format(user.to_dict(), e.message)
-            )
-            log.error(message)
-            messages.append(message)
-
-    log.info("Added %s new users!" % (users_added))
+    changes, messages = population.sync_users(dbsession, processed_users, messages)
     if not messages:
         messages.append("No issues found!")
-    return {"messages": messages}
+    return {"messages": messages, "changes": changes._asdict()}
@@ -70,7 +70,7 @@ export class TalentManagerPanelComponent implements OnInit, OnDestroy {
   onClick(event, templateKey: string) {
     event.target.disabled = true;
     this.api.sendEmail(templateKey).subscribe(() => {
-      this.successMsg = 'Emails successfully sent!';
+      this.successMsg = 'Emails queued for sending! You will be emailed a confirmation once they are delivered.';
       event.target.disabled = false;
     }, () => {
       this.errorMsg = `Emails failed to send. Please email ${this.metadata.supportEmail} to look at backend logs.`;
@@ -100,7 +100,9 @@ export class TalentManagerPanelComponent implements OnInit, OnDestroy {
             htmlMessage += `<li>${message}</li>\n`;
         }
         htmlMessage += '</ul>';
-        this.successMsg = '<p>Completed with the following messages:</p> ' + htmlMessage;
+        const changes = payload.changes;
+        this.successMsg = `<p>Added ${changes.added}, updated ${changes.updated} and removed ${changes.removed} users.</p>` +
+          '<p>Completed with the following messages:</p> ' + htmlMessage;
         this.updatePageData();
         this.csvUploadSubmitting = false;
         this.inputFile.nativeElement.value = '';
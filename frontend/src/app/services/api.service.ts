@@ -111,6 +111,7 @@ export class Invitee {
   email: string;
   businessUnit: string;
   department: string;
+  emailStatus?: string;
 }
 
 // refer to adaero/views/metadata.py
@@ -134,8 +135,15 @@ export class TalentManagerPanelData {
 }
 
 // refer to adaero/views/talent_manager.py
+export class PopulationChanges {
+  added: number;
+  updated: number;
+  removed: number;
+}
+
 export class CSVUploadStatusPayload {
   messages: [string];
+  changes: PopulationChanges;
 }
 
 @Injectable()
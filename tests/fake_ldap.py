@@ -0,0 +1,169 @@
+"""
+In-process stand-in for a `python-ldap` connection over a directory of user
+details, such as `tests.integration.constants.TEST_LDAP_FULL_DETAILS`, that
+counts binds and searches and can take `latency_s` to answer each like a
+remote server would, or raise `ldap.SERVER_DOWN` while `is_down` is set.
+Searches returning more than `size_limit` users raise
+`ldap.SIZELIMIT_EXCEEDED` unless paged with the simple paged results control,
+which is answered a page at a time. Patch `ldap.initialize` to return it.
+"""
+
+import re
+import threading
+import time
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+_EQUALITY = re.compile(r"\(([^=()&|!]+)=((?:[^()\\]|\\[0-9a-fA-F]{2})*)\)")
+_ESCAPED = re.compile(r"\\([0-9a-fA-F]{2})")
+
+
+def _unescape(value):
+    return _ESCAPED.sub(lambda m: chr(int(m.group(1), 16)), value)
+
+
+def parse_filter(filter_str):
+    """
+    Parse the equality, `&` and `|` filters that `adaero.security.ldapauth`
+    builds
+
+    Returns
+    -------
+    Tuple of the parsed filter, either `("=", key, value)` or `("&", operands)`
+    or `("|", operands)`, and the rest of `filter_str`
+    """
+    if filter_str[:2] in ("(&", "(|"):
+        operands = []
+        rest = filter_str[2:]
+        while not rest.startswith(")"):
+            operand, rest = parse_filter(rest)
+            operands.append(operand)
+        return (filter_str[1], operands), rest[1:]
+    match = _EQUALITY.match(filter_str)
+    if not match:
+        raise ValueError("Unsupported filter %s" % filter_str)
+    parsed = ("=", match.group(1), _unescape(match.group(2)).lower())
+    return parsed, filter_str[match.end() :]
+
+
+class FakeLDAPConnection(object):
+    """
+    Parameters
+    ----------
+    users: iterable of `dict`
+        LDAP details of each user in the directory
+    latency_s: `float`
+        Time taken to answer each bind and search
+    size_limit: `int`
+        Maximum number of users returned by a search or page, if any
+    """
+
+    def __init__(self, users, latency_s=0, size_limit=None):
+        self.users = list(users)
+        # users by attribute and lower cased value, as searched
+        self._index = {}
+        for user in self.users:
+            for key, value in user.items():
+                if value is not None and not isinstance(value, list):
+                    self._index.setdefault((key, str(value).lower()), []).append(user)
+        self.latency_s = latency_s
+        self.size_limit = size_limit
+        self.num_binds = 0
+        self.num_searches = 0
+        self.filters = []
+        self.is_down = False
+        # results of `search_ext` by message ID, until read by `result3`
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        if self.is_down:
+            raise ldap.SERVER_DOWN()
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+    def set_option(self, *args):
+        pass
+
+    def bind_s(self, *args):
+        self._round_trip()
+        with self._lock:
+            self.num_binds += 1
+
+    simple_bind_s = bind_s
+
+    def whoami_s(self):
+        self._round_trip()
+        return ""
+
+    def unbind(self):
+        pass
+
+    unbind_s = unbind
+
+    def search_st(self, base, scope, filter_str, *args, **kwargs):
+        response = self._search(filter_str)
+        if self.size_limit is not None and len(response) > self.size_limit:
+            raise ldap.SIZELIMIT_EXCEEDED()
+        return response
+
+    def search_ext(self, base, scope, filter_str, serverctrls=None, **kwargs):
+        response = self._search(filter_str)
+        controls = []
+        for control in serverctrls or []:
+            if control.controlType == SimplePagedResultsControl.controlType:
+                size = control.size
+                if self.size_limit is not None:
+                    size = min(size, self.size_limit)
+                start = int(control.cookie or 0)
+                end = start + size
+                cookie = str(end).encode() if end < len(response) else b""
+                response = response[start:end]
+                controls.append(SimplePagedResultsControl(True, size, cookie))
+        if self.size_limit is not None and len(response) > self.size_limit:
+            raise ldap.SIZELIMIT_EXCEEDED()
+        with self._lock:
+            msgid = len(self.filters)
+            self._pending[msgid] = (response, controls)
+        return msgid
+
+    def result3(self, msgid, *args, **kwargs):
+        with self._lock:
+            response, controls = self._pending.pop(msgid)
+        return 101, response, msgid, controls
+
+    def _search(self, filter_str):
+        self._round_trip()
+        with self._lock:
+            self.num_searches += 1
+            self.filters.append(filter_str)
+        parsed, _ = parse_filter(filter_str)
+        return [
+            (user.get("distinguishedName"), self._encode(user))
+            for user in self._match(parsed)
+        ]
+
+    def _match(self, parsed):
+        if parsed[0] == "=":
+            _, key, value = parsed
+            if key == "objectClass":
+                return self.users
+            return self._index.get((key, value), [])
+        operator, operands = parsed
+        matches = [self._match(operand) for operand in operands]
+        if operator == "|":
+            users = {id(u): u for users in matches for u in users}
+            return list(users.values())
+        ids = set.intersection(*[{id(u) for u in users} for users in matches])
+        return [u for u in matches[0] if id(u) in ids]
+
+    @staticmethod
+    def _encode(user):
+        entry = {}
+        for key, value in user.items():
+            if value is None:
+                continue
+            values = value if isinstance(value, list) else [value]
+            entry[key] = [str(v).encode("utf-8") for v in values]
+        return entry
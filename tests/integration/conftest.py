@@ -18,6 +18,10 @@ from adaero.models import (
     FeedbackAnswer,
     User,
     ExternalInvite,
+    UserPeriodStats,
+    FrozenPeriodStats,
+    EmailOutbox,
+    PeriodTransition,
 )
 
 from .constants import TEST_UTCNOW
@@ -96,7 +100,11 @@ def drop_everything_but_users(dbsession_):
         dbsession_.query(FeedbackTemplateRow).delete()
         dbsession_.query(FeedbackQuestion).delete()
         dbsession_.query(Nominee).delete()
+        dbsession_.query(EmailOutbox).delete()
         dbsession_.query(ExternalInvite).delete()
+        dbsession_.query(UserPeriodStats).delete()
+        dbsession_.query(FrozenPeriodStats).delete()
+        dbsession_.query(PeriodTransition).delete()
         dbsession_.query(Period).delete()
         dbsession_.query(FeedbackTemplate).delete()
 
@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+from freezegun import freeze_time
+import pytest
+import transaction
+
+from adaero import directory
+from adaero.directory import MemoryDirectoryCache, TableDirectoryCache
+from adaero.models import DirectoryCacheEntry
+from ..constants import TEST_EMPLOYEE_USERNAME, TEST_LDAP_FULL_DETAILS, TEST_UTCNOW
+
+TEST_KEY = "username=%s" % TEST_EMPLOYEE_USERNAME
+TEST_TTL_S = 60
+TEST_NEGATIVE_TTL_S = 10
+
+
+@pytest.fixture
+def caches(dbsession):
+    """Shared caches of two processes"""
+    engine = dbsession.get_bind()
+    with freeze_time(TEST_UTCNOW):
+        yield [
+            TableDirectoryCache(
+                engine, MemoryDirectoryCache(TEST_TTL_S, TEST_NEGATIVE_TTL_S)
+            )
+            for _ in range(2)
+        ]
+    with transaction.manager:
+        dbsession.query(DirectoryCacheEntry).delete()
+
+
+def _count_rows(dbsession):
+    with transaction.manager:
+        return dbsession.query(DirectoryCacheEntry).count()
+
+
+def test_lookups_are_shared_between_processes(caches):
+    first, second = caches
+    details = TEST_LDAP_FULL_DETAILS[TEST_EMPLOYEE_USERNAME]
+    assert second.get(TEST_KEY) == (False, None)
+    first.put(TEST_KEY, details)
+    assert second.get(TEST_KEY) == (True, details)
+    first.put("username=nobody", None)
+    assert second.get("username=nobody") == (True, None)
+
+    with freeze_time(TEST_UTCNOW + timedelta(seconds=TEST_TTL_S + 1)):
+        assert second.get(TEST_KEY) == (False, None)
+        first.put(TEST_KEY, details)
+        assert first.get(TEST_KEY) == (True, details)
+
+
+def test_invalidate_drops_lookups_of_every_process(caches):
+    first, second = caches
+    details = TEST_LDAP_FULL_DETAILS[TEST_EMPLOYEE_USERNAME]
+    first.put(TEST_KEY, details)
+    assert first.get(TEST_KEY) == (True, details)
+    second.invalidate()
+    assert second.get(TEST_KEY) == (False, None)
+    # other processes keep using their own cache until they next check
+    assert first.get(TEST_KEY) == (True, details)
+    with freeze_time(
+        TEST_UTCNOW + timedelta(seconds=directory.GENERATION_CHECK_INTERVAL_S)
+    ):
+        assert first.get(TEST_KEY) == (False, None)
+        first.put(TEST_KEY, details)
+        assert second.get(TEST_KEY) == (True, details)
+
+
+def test_expired_lookups_are_purged(caches, dbsession):
+    first, second = caches
+    first.put(TEST_KEY, TEST_LDAP_FULL_DETAILS[TEST_EMPLOYEE_USERNAME])
+    first.put("username=nobody", None)
+    with freeze_time(TEST_UTCNOW + timedelta(seconds=TEST_NEGATIVE_TTL_S)):
+        # purged at most once a minute by each process
+        first.put("username=somebody", None)
+        assert 3 == _count_rows(dbsession)
+        second.put("username=somebody", None)
+        assert 2 == _count_rows(dbsession)
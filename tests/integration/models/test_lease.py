@@ -0,0 +1,112 @@
+from datetime import timedelta
+import threading
+import time
+
+from freezegun import freeze_time
+from mock import Mock, patch
+import pytest
+import transaction
+
+from adaero import mail
+from adaero.lease import LeaderLease
+from adaero.models import SchedulerLease
+from ..constants import TEST_UTCNOW
+
+TEST_LEASE_NAME = "test_job"
+TEST_LEASE_TTL_S = 30
+
+
+@pytest.fixture
+def leases(dbsession):
+    engine = dbsession.get_bind()
+    with freeze_time(TEST_UTCNOW):
+        yield [
+            LeaderLease(
+                engine, TEST_LEASE_NAME, TEST_LEASE_TTL_S, holder="host%s:1" % i
+            )
+            for i in range(2)
+        ]
+    with transaction.manager:
+        dbsession.query(SchedulerLease).delete()
+
+
+def test_only_one_process_holds_the_lease(leases):
+    leader, follower = leases
+    assert leader.acquire()
+    assert not follower.acquire()
+    assert leader.is_held
+    assert not follower.is_held
+
+    with freeze_time(TEST_UTCNOW + timedelta(seconds=TEST_LEASE_TTL_S - 1)):
+        assert leader.acquire()
+        assert not follower.acquire()
+
+
+def test_lease_fails_over_once_the_leader_stops_renewing(leases):
+    leader, follower = leases
+    assert leader.acquire()
+    with freeze_time(TEST_UTCNOW + timedelta(seconds=TEST_LEASE_TTL_S + 1)):
+        assert not leader.is_held
+        assert follower.acquire()
+        assert not leader.acquire()
+
+
+def test_released_lease_is_taken_over_straight_away(leases):
+    leader, follower = leases
+    assert leader.acquire()
+    leader.release()
+    assert not leader.is_held
+    assert follower.acquire()
+
+
+def test_outbox_is_only_delivered_by_the_leader(leases):
+    leader, follower = leases
+    leader.acquire()
+    follower.acquire()
+    with patch("adaero.mail.deliver_email_outbox") as deliver_mock, patch(
+        "adaero.mail.get_tm_session"
+    ):
+        mail.leader_outbox_job(follower, {}, None, None)
+        assert 0 == deliver_mock.call_count
+        mail.leader_outbox_job(leader, {}, None, None)
+        assert 1 == deliver_mock.call_count
+
+
+def test_outbox_is_delivered_one_run_at_a_time(leases):
+    leader, _ = leases
+    leader.acquire()
+    outbox_delivery = mail.OutboxDelivery(Mock(), leader, {}, None, None, 60, 0)
+    delivering = []
+    release = threading.Event()
+
+    def deliver(*args):
+        delivering.append(threading.current_thread())
+        release.wait(5)
+
+    with patch("adaero.mail.deliver_email_outbox", side_effect=deliver), patch(
+        "adaero.mail.get_tm_session"
+    ):
+        first = threading.Thread(target=outbox_delivery.run)
+        first.start()
+        while not delivering:
+            time.sleep(0.01)
+        second = threading.Thread(target=outbox_delivery.run)
+        second.start()
+        second.join(0.1)
+        assert [first] == delivering
+        release.set()
+        first.join()
+        second.join()
+    assert [first, second] == delivering
+
+
+def test_waking_outbox_delivery_replaces_the_pending_run(leases):
+    leader, _ = leases
+    scheduler = Mock()
+    outbox_delivery = mail.OutboxDelivery(scheduler, leader, {}, None, None, 60, 5)
+    outbox_delivery.wake()
+    outbox_delivery.wake()
+    assert 2 == scheduler.add_job.call_count
+    for _, kwargs in scheduler.add_job.call_args_list:
+        assert mail.OUTBOX_NOW_JOB_ID == kwargs["id"]
+        assert kwargs["replace_existing"]
@@ -6,10 +6,12 @@ from functools import partial
 from freezegun import freeze_time
 import pytest
 import transaction
+from sqlalchemy import event
 from sqlalchemy.exc import IntegrityError
 
+from adaero.date import LONDON
 from adaero.models.all import CheckError
-from adaero.models.period import Period
+from adaero.models.period import PERIOD_CLOCK, Period
 from adaero.models import generate_period_dates
 from ..constants import TEST_UTCNOW
 from ..conftest import next_day_generator, days_from_utcnow
@@ -276,3 +278,79 @@ def test_get_current_period(
         dbsession.add(next_period)
 
     assert expected_period_id == Period.get_current_period(dbsession).id
+
+
+def test_current_period_is_cached_until_next_period_starts(func_scoped_dbsession):
+    dbsession = func_scoped_dbsession
+    with freeze_time(TEST_UTCNOW) as frozen_time:
+        prev_times = generate_period_dates(Period.REVIEW_SUBPERIOD, days_from_utcnow)
+        next_times = generate_period_dates(
+            Period.ENROLLMENT_SUBPERIOD, partial(days_from_utcnow, offset=2)
+        )
+        with transaction.manager:
+            dbsession.add(Period(id=PREV, name="prev", **prev_times))
+            dbsession.add(Period(id=NEXT, name="next", **next_times))
+        assert PREV == Period.get_current_period(dbsession).id
+
+        statements = []
+        engine = dbsession.get_bind()
+        record = lambda *args: statements.append(args[2])  # noqa: E731
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            assert PREV == Period.get_current_period(dbsession).id
+            # at most a primary key lookup, if expired from the session
+            assert all("WHERE periods.id = " in s for s in statements)
+
+            # no flush happened, but the next period has started
+            frozen_time.tick(timedelta(days=3))
+            assert NEXT == Period.get_current_period(dbsession).id
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+
+def test_current_period_cache_is_invalidated_on_period_change(func_scoped_dbsession):
+    dbsession = func_scoped_dbsession
+    with freeze_time(TEST_UTCNOW):
+        prev_times = generate_period_dates(
+            Period.REVIEW_SUBPERIOD, partial(days_from_utcnow, offset=-100)
+        )
+        with transaction.manager:
+            dbsession.add(Period(id=PREV, name="prev", **prev_times))
+        assert PREV == Period.get_current_period(dbsession).id
+        next_times = generate_period_dates(Period.ENTRY_SUBPERIOD, days_from_utcnow)
+        with transaction.manager:
+            dbsession.add(Period(id=NEXT, name="next", **next_times))
+        current_period = Period.get_current_period(dbsession)
+        assert NEXT == current_period.id
+        assert Period.ENTRY_SUBPERIOD == current_period.subperiod(LONDON)
+
+        with transaction.manager:
+            current_period = dbsession.query(Period).get(NEXT)
+            for key, value in generate_period_dates(
+                Period.APPROVAL_SUBPERIOD, days_from_utcnow
+            ).items():
+                setattr(current_period, key, value)
+        assert Period.APPROVAL_SUBPERIOD == Period.get_current_period(
+            dbsession
+        ).subperiod(LONDON)
+
+
+def test_current_period_cache_is_invalidated_once_period_change_committed(
+    func_scoped_dbsession,
+):
+    dbsession = func_scoped_dbsession
+    with freeze_time(TEST_UTCNOW):
+        prev_times = generate_period_dates(
+            Period.REVIEW_SUBPERIOD, partial(days_from_utcnow, offset=-100)
+        )
+        with transaction.manager:
+            dbsession.add(Period(id=PREV, name="prev", **prev_times))
+        assert PREV == Period.get_current_period(dbsession).id
+        committed_state = PERIOD_CLOCK._state
+        next_times = generate_period_dates(Period.ENTRY_SUBPERIOD, days_from_utcnow)
+        with transaction.manager:
+            dbsession.add(Period(id=NEXT, name="next", **next_times))
+            dbsession.flush()
+            # as refreshed by another thread before the commit
+            PERIOD_CLOCK._state = committed_state
+        assert NEXT == Period.get_current_period(dbsession).id
@@ -0,0 +1,131 @@
+from copy import copy
+from datetime import timedelta
+
+from freezegun import freeze_time
+import pytest
+import transaction
+
+from adaero import population
+from adaero.models import User, USER_CACHE
+from adaero.models.user import UserCache, UserSnapshot
+from adaero.security import ldapauth
+
+from ..constants import (
+    TEST_EMPLOYEE_USERNAME,
+    TEST_LDAP_FULL_DETAILS,
+    TEST_MANAGER_USERNAME,
+    TEST_USERNAME_KEY,
+    TEST_UTCNOW,
+)
+from ...settings import DEFAULT_TEST_SETTINGS
+
+from ..conftest import drop_everything
+
+
+@pytest.fixture
+def ldapsource():
+    return ldapauth.build_ldapauth_from_settings(DEFAULT_TEST_SETTINGS)
+
+
+@pytest.yield_fixture
+def population_session(dbsession, ldapsource):
+    drop_everything(dbsession)
+    with transaction.manager:
+        for user_details in TEST_LDAP_FULL_DETAILS.values():
+            dbsession.add(User.create_from_ldap_details(ldapsource, user_details))
+    yield dbsession
+    drop_everything(dbsession)
+
+
+def _generate_users(ldapsource):
+    return [
+        User.create_from_ldap_details(ldapsource, details)
+        for details in TEST_LDAP_FULL_DETAILS.values()
+    ]
+
+
+def _get_rows(dbsession):
+    with transaction.manager:
+        return {u.username: u.to_dict() for u in dbsession.query(User)}
+
+
+def test_only_changed_users_are_written(population_session, ldapsource):
+    dbsession = population_session
+    users = _generate_users(ldapsource)
+    assert (0, 0, 0) == population.sync_users(dbsession, users, [])[0]
+
+    users = [u for u in users if u.username != TEST_EMPLOYEE_USERNAME]
+    manager = next(u for u in users if u.username == TEST_MANAGER_USERNAME)
+    manager.position = "Head of Development"
+    new_details = copy(TEST_LDAP_FULL_DETAILS[TEST_EMPLOYEE_USERNAME])
+    new_details[TEST_USERNAME_KEY] = "newhire"
+    users.append(User.create_from_ldap_details(ldapsource, new_details))
+    generation = USER_CACHE.generation
+
+    changes, messages = population.sync_users(dbsession, users, [])
+    assert population.PopulationChanges(1, 1, 1) == changes
+    assert not messages
+    assert generation < USER_CACHE.generation
+    rows = _get_rows(dbsession)
+    assert {u.username for u in users} == set(rows)
+    assert "Head of Development" == rows[TEST_MANAGER_USERNAME]["position"]
+    # column defaults apply as when added through the ORM
+    assert rows["newhire"] == dict(users[-1].to_dict(), is_staff=False)
+
+
+def test_user_caches_of_other_processes_are_dropped(population_session, ldapsource):
+    dbsession = population_session
+    # as kept by another process
+    other_cache = UserCache()
+    users = _generate_users(ldapsource)
+    manager = next(u for u in users if u.username == TEST_MANAGER_USERNAME)
+    manager.position = "Head of Development"
+    with freeze_time(TEST_UTCNOW) as frozen:
+        other_cache.check_generation(dbsession)
+        generation = other_cache.generation
+        with transaction.manager:
+            snapshot = UserSnapshot(dbsession.query(User).get(TEST_MANAGER_USERNAME))
+        other_cache.put(snapshot, generation)
+
+        assert (0, 1, 0) == population.sync_users(dbsession, users, [])[0]
+        other_cache.check_generation(dbsession)
+        assert other_cache.get(TEST_MANAGER_USERNAME) is snapshot
+
+        frozen.tick(timedelta(seconds=UserCache.GENERATION_CHECK_INTERVAL_S))
+        other_cache.check_generation(dbsession)
+        assert other_cache.get(TEST_MANAGER_USERNAME) is None
+        assert generation < other_cache.generation
+
+
+def test_users_rejected_by_database_are_reported(population_session, ldapsource):
+    dbsession = population_session
+    users = _generate_users(ldapsource)
+    duplicate = User.create_from_ldap_details(
+        ldapsource, TEST_LDAP_FULL_DETAILS[TEST_EMPLOYEE_USERNAME]
+    )
+    duplicate.position = "Duplicate"
+    too_long = User.create_from_ldap_details(
+        ldapsource, TEST_LDAP_FULL_DETAILS[TEST_EMPLOYEE_USERNAME]
+    )
+    too_long.username = "x" * 33
+    changes, messages = population.sync_users(
+        dbsession, users + [duplicate, too_long], []
+    )
+    assert (0, 0, 0) == changes
+    assert [
+        population.DEFAULT_INVALID_USER_TMPL.format(
+            payload=duplicate.to_dict(),
+            reason="username is already in the population",
+        ),
+        population.DEFAULT_INVALID_USER_TMPL.format(
+            payload=too_long.to_dict(), reason="username is longer than 32 characters"
+        ),
+    ] == messages
+    assert "Duplicate" not in {r["position"] for r in _get_rows(dbsession).values()}
+
+
+def test_population_kept_if_no_valid_users(population_session):
+    changes, messages = population.sync_users(population_session, [], [])
+    assert (0, 0, 0) == changes
+    assert [population.DEFAULT_NO_USERS_MESSAGE] == messages
+    assert set(TEST_LDAP_FULL_DETAILS) == set(_get_rows(population_session))
@@ -0,0 +1,75 @@
+import transaction
+from sqlalchemy.sql.expression import Update
+from zope.sqlalchemy import mark_changed
+
+from adaero.models.period import Period
+from adaero.models.stats import UserPeriodStats, apply_user_period_stats_changes
+from ..conftest import next_day_generator
+
+TEST_USERNAME = "alice"
+
+
+class RacingConnection(object):
+    """Proxies a connection, inserting the stats row as a concurrent
+    transaction would right after the first update finds no row."""
+
+    def __init__(self, connection, row):
+        self._connection = connection
+        self._row = row
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def execute(self, statement, *args, **kwargs):
+        result = self._connection.execute(statement, *args, **kwargs)
+        if self._row is not None and isinstance(statement, Update):
+            table = UserPeriodStats.__table__
+            self._connection.execute(table.insert().values(**self._row))
+            self._row = None
+        return result
+
+
+def test_stats_changes_are_merged_when_concurrent_insert_wins(
+    func_scoped_dbsession
+):  # noqa: E501
+    dbsession = func_scoped_dbsession
+    next_day = next_day_generator()
+    with transaction.manager:
+        period = Period(
+            name="2017-Q4",
+            enrollment_start_utc=next(next_day),
+            entry_start_utc=next(next_day),
+            approval_start_utc=next(next_day),
+            approval_end_utc=next(next_day),
+        )
+        dbsession.add(period)
+        dbsession.flush()
+        period_id = period.id
+
+    with transaction.manager:
+        connection = RacingConnection(
+            dbsession.connection(),
+            {
+                "username": TEST_USERNAME,
+                "period_id": period_id,
+                "contributed": 2,
+                "received": 1,
+                "is_nominated": False,
+                "has_summary": False,
+            },
+        )
+        apply_user_period_stats_changes(
+            connection,
+            TEST_USERNAME,
+            period_id,
+            {"contributed": 1, "is_nominated": True},
+        )
+        mark_changed(dbsession)
+
+    with transaction.manager:
+        stats = dbsession.query(UserPeriodStats).one()
+        assert stats.username == TEST_USERNAME
+        assert stats.contributed == 3
+        assert stats.received == 1
+        assert stats.is_nominated
+        assert not stats.has_summary
@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from freezegun import freeze_time
+from mock import Mock
+import pytest
+import transaction
+
+from adaero.date import LONDON
+from adaero.models import Period, generate_period_dates, get_session_factory
+from adaero.transitions import (
+    RESYNC_NOW_JOB_ID,
+    TRANSITION_JOB_ID,
+    TransitionScheduler,
+    run_due_transitions,
+)
+from ..constants import TEST_UTCNOW
+from ..conftest import days_from_utcnow
+
+
+@pytest.fixture
+def period_in_entry(func_scoped_dbsession):
+    dbsession = func_scoped_dbsession
+    with freeze_time(TEST_UTCNOW):
+        with transaction.manager:
+            period = Period(
+                name="2017-Q4",
+                **generate_period_dates(Period.ENTRY_SUBPERIOD, days_from_utcnow)
+            )
+            dbsession.add(period)
+        with transaction.manager:
+            period = dbsession.query(Period).one()
+        yield dbsession, period
+
+
+def test_transition_hooks_run_once(period_in_entry):
+    dbsession, period = period_in_entry
+    hook = Mock()
+    (transition,) = run_due_transitions(dbsession, LONDON, [hook])
+    assert period.id == transition.period_id
+    assert Period.ENTRY_SUBPERIOD == transition.subperiod
+    hook.assert_called_once_with(dbsession, transition)
+
+    assert [] == run_due_transitions(dbsession, LONDON, [hook])
+    assert 1 == hook.call_count
+
+    with freeze_time(period.approval_start_utc + timedelta(hours=1)):
+        (transition,) = run_due_transitions(dbsession, LONDON, [hook])
+    assert Period.APPROVAL_SUBPERIOD == transition.subperiod
+    assert 2 == hook.call_count
+
+
+def test_transition_hooks_are_retried_if_one_fails(period_in_entry):
+    dbsession, _ = period_in_entry
+    hook = Mock(side_effect=[RuntimeError("SMTP server down"), None])
+    assert [] == run_due_transitions(dbsession, LONDON, [hook])
+    assert 1 == len(run_due_transitions(dbsession, LONDON, [hook]))
+    assert 2 == hook.call_count
+
+
+def test_next_transition_is_rescheduled_when_periods_change(period_in_entry):
+    dbsession, period = period_in_entry
+    scheduler = BackgroundScheduler()
+    session_factory = get_session_factory(dbsession.get_bind())
+    transitions = TransitionScheduler(scheduler, session_factory, LONDON, [], 60)
+    transitions.start()
+    try:
+        transitions.resync()
+        # London is on UTC in November
+        assert period.approval_start_utc == transitions.next_transition_utc
+        assert scheduler.get_job(TRANSITION_JOB_ID)
+        assert not scheduler.get_job(RESYNC_NOW_JOB_ID)
+
+        with transaction.manager:
+            period = dbsession.merge(period)
+            period.approval_start_utc += timedelta(days=1)
+        assert scheduler.get_job(RESYNC_NOW_JOB_ID)
+        transitions.resync()
+        assert period.approval_start_utc == transitions.next_transition_utc
+    finally:
+        transitions.stop()
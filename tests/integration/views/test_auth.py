@@ -1,11 +1,15 @@
 from __future__ import unicode_literals
 
+from sqlalchemy import event
+import transaction
+
+from adaero.models import User, USER_CACHE
 from adaero.security import (
     ANGULAR_2_XSRF_TOKEN_COOKIE_NAME,
     ANGULAR_2_XSRF_TOKEN_HEADER_NAME,
 )
 from ..constants import TEST_MANAGER_USERNAME, TEST_PASSWORD, TEST_LDAP_FULL_DETAILS
-from .conftest import successfully_login
+from .conftest import get_dbsession, successfully_login
 
 
 def test_login(ldap_mocked_app_with_users):
@@ -92,3 +96,62 @@ def test_user_data(ldap_mocked_app_with_users):
         response.json_body["data"]["principals"]
     )
     assert ANGULAR_2_XSRF_TOKEN_COOKIE_NAME in app.cookies
+
+
+def test_user_is_cached_until_users_change(ldap_mocked_app_with_users):
+    app = ldap_mocked_app_with_users
+    successfully_login(app, TEST_MANAGER_USERNAME)
+    dbsession = get_dbsession(app)
+    engine = dbsession.get_bind()
+    title = TEST_LDAP_FULL_DETAILS[TEST_MANAGER_USERNAME]["title"]
+    statements = []
+
+    def record_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def set_title(new_title):
+        with transaction.manager:
+            dbsession.query(User).filter(User.username == TEST_MANAGER_USERNAME).update(
+                {User.position: new_title}, synchronize_session=False
+            )
+
+    event.listen(engine, "before_cursor_execute", record_statement)
+    try:
+        response = app.get("/api/v1/user-data")
+        assert title == response.json_body["data"]["title"]
+        assert not [s for s in statements if "FROM users" in s]
+
+        set_title("Head of Testing")
+        response = app.get("/api/v1/user-data")
+        assert "Head of Testing" == response.json_body["data"]["title"]
+        assert "direct_report:ssholes" in response.json_body["data"]["principals"]
+    finally:
+        event.remove(engine, "before_cursor_execute", record_statement)
+        set_title(title)
+
+
+def test_user_cache_is_invalidated_once_users_change_committed(
+    ldap_mocked_app_with_users,
+):
+    app = ldap_mocked_app_with_users
+    successfully_login(app, TEST_MANAGER_USERNAME)
+    dbsession = get_dbsession(app)
+    title = TEST_LDAP_FULL_DETAILS[TEST_MANAGER_USERNAME]["title"]
+    app.get("/api/v1/user-data")
+    snapshot = USER_CACHE.get(TEST_MANAGER_USERNAME)
+    assert snapshot is not None
+
+    def set_title(new_title):
+        with transaction.manager:
+            dbsession.query(User).filter(User.username == TEST_MANAGER_USERNAME).update(
+                {User.position: new_title}, synchronize_session=False
+            )
+            # as loaded by another request before the commit
+            USER_CACHE.put(snapshot, USER_CACHE.generation)
+
+    try:
+        set_title("Head of Testing")
+        response = app.get("/api/v1/user-data")
+        assert "Head of Testing" == response.json_body["data"]["title"]
+    finally:
+        set_title(title)
@@ -1,7 +1,10 @@
 from base64 import b64decode
+from datetime import timedelta
 from email.parser import Parser
 from email.header import decode_header
+import smtplib
 
+from freezegun import freeze_time
 import pytest
 from mock import patch
 import transaction
@@ -9,8 +12,8 @@ import transaction
 from logging import getLogger as get_logger
 
 import tests.integration.constants
-from adaero import constants as app_constants
-from adaero.models import ExternalInvite, Period, User
+from adaero import constants as app_constants, mail
+from adaero.models import EmailOutbox, ExternalInvite, Period, User
 from adaero.security import (
     ANGULAR_2_XSRF_TOKEN_COOKIE_NAME,
     ANGULAR_2_XSRF_TOKEN_HEADER_NAME,
@@ -33,6 +36,7 @@ from ..constants import (
     TEST_PRODUCTION_HOSTNAME,
     TEST_PRODUCTION_USER,
     TEST_TEMPLATE_ID,
+    TEST_UTCNOW,
 )
 from tests.integration.views.test_manager import (
     add_test_period_with_template,
@@ -119,6 +123,11 @@ def test_employee_able_to_send_feedback_request_within_entry_subperiod(
             headers={ANGULAR_2_XSRF_TOKEN_HEADER_NAME: csrf_token},
             expect_errors=expected_status_code != 200,
         )
+        # the request only adds the email to the outbox
+        assert 0 == sendmail_mock.call_count
+        mail.deliver_email_outbox(
+            dbsession, ldapsource, app.app.registry.settings, delay_between_s=0
+        )
 
     if resp.status_code != 200:
         assert expected_msg == resp.json_body["message"]
@@ -155,6 +164,9 @@ def test_employee_able_to_send_feedback_request_within_entry_subperiod(
     assert invite_html.count(app_url) > 1
     assert invite_html.count(app_url) % 2 == 0
 
+    get_resp = app.get("/api/v1/external-invite")
+    assert get_resp.json_body["invitees"][0]["emailStatus"] == ExternalInvite.EMAIL_SENT
+
     after_invite_resp = app.post_json(
         "/api/v1/login",
         {"username": TEST_COMPANY_COLLEAGUE_USERNAME, "password": TEST_PASSWORD},
@@ -170,7 +182,7 @@ def test_employee_able_to_invite_twice(ldap_mocked_app_with_users):  # noqa: E50
     add_test_period_with_template(dbsession, Period.ENTRY_SUBPERIOD, template_id)
     successfully_login(app, TEST_EMPLOYEE_USERNAME)
     csrf_token = app.cookies[ANGULAR_2_XSRF_TOKEN_COOKIE_NAME]
-    with patch("smtplib.SMTP") as _:
+    with patch("smtplib.SMTP") as smtp_mock:
         success = app.post_json(
             "/api/v1/external-invite",
             {"email": TEST_COMPANY_COLLEAGUE_EMAIL},
@@ -184,6 +196,14 @@ def test_employee_able_to_invite_twice(ldap_mocked_app_with_users):  # noqa: E50
             expect_errors=True,
         )
         assert failed.status_code == 200
+        mail.deliver_email_outbox(
+            dbsession,
+            app.app.registry["ldapsource"],
+            app.app.registry.settings,
+            delay_between_s=0,
+        )
+        # the second invite replaced the email of the first
+        assert 1 == smtp_mock().sendmail.call_count
         invites = (
             dbsession.query(ExternalInvite)
             .filter(
@@ -204,6 +224,58 @@ def test_employee_able_to_invite_twice(ldap_mocked_app_with_users):  # noqa: E50
         assert invitee["email"] == TEST_COMPANY_COLLEAGUE_EMAIL
 
 
+def test_invite_recorded_before_email_sent_and_failure_exposed(
+    ldap_mocked_app_with_users
+):  # noqa: E501
+    app = ldap_mocked_app_with_users
+    dbsession = get_dbsession(app)
+    template_id = add_test_template(dbsession)
+    add_test_period_with_template(dbsession, Period.ENTRY_SUBPERIOD, template_id)
+    successfully_login(app, TEST_EMPLOYEE_USERNAME)
+    csrf_token = app.cookies[ANGULAR_2_XSRF_TOKEN_COOKIE_NAME]
+    app.app.registry.settings[app_constants.ENABLE_SEND_EMAIL_KEY] = True
+
+    def deliver_and_get_email_status():
+        mail.deliver_email_outbox(
+            dbsession,
+            app.app.registry["ldapsource"],
+            app.app.registry.settings,
+            delay_between_s=0,
+        )
+        get_resp = app.get("/api/v1/external-invite")
+        return get_resp.json_body["invitees"][0]["emailStatus"]
+
+    with patch("smtplib.SMTP") as smtp_mock, patch.object(
+        mail, "OUTBOX_MAX_ATTEMPTS", 2
+    ):
+        sendmail_mock = smtp_mock().sendmail
+        sendmail_mock.side_effect = smtplib.SMTPRecipientsRefused(
+            {TEST_COMPANY_COLLEAGUE_EMAIL: ()}
+        )
+        resp = app.post_json(
+            "/api/v1/external-invite",
+            {"email": TEST_COMPANY_COLLEAGUE_EMAIL},
+            headers={ANGULAR_2_XSRF_TOKEN_HEADER_NAME: csrf_token},
+        )
+        assert resp.status_code == 200
+        get_resp = app.get("/api/v1/external-invite")
+        invitee = get_resp.json_body["invitees"][0]
+        assert invitee["emailStatus"] == ExternalInvite.EMAIL_PENDING
+        assert 0 == sendmail_mock.call_count
+
+        # pending while the email is retried
+        assert deliver_and_get_email_status() == ExternalInvite.EMAIL_PENDING
+        with freeze_time(TEST_UTCNOW + timedelta(seconds=mail.OUTBOX_RETRY_BACKOFF_S)):
+            assert deliver_and_get_email_status() == ExternalInvite.EMAIL_FAILED
+        assert 2 == sendmail_mock.call_count
+
+    with transaction.manager:
+        email = dbsession.query(EmailOutbox).one()
+        assert EmailOutbox.FAILED == email.status
+        # invites are not confirmed to talent managers
+        assert not email.is_confirmation
+
+
 def test_external_user_able_to_give_and_amend_feedback_that_sent_them_invites(
     app_with_nominees_and_existing_feedback_form_inside_entry_subperiod
 ):  # noqa: E501
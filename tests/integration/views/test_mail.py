@@ -1,7 +1,8 @@
 from base64 import b64decode
-from datetime import datetime, time
+from datetime import datetime, time, timedelta
 from email.parser import Parser
 import os
+import smtplib
 
 from freezegun import freeze_time
 import pytest
@@ -21,7 +22,7 @@ from adaero.constants import (
     DISPLAYED_HOSTNAME_KEY,
 )
 from adaero.date import LONDON, HONG_KONG, BOSTON
-from adaero.models import Period, User
+from adaero.models import EmailOutbox, Period, User, get_tm_session
 from adaero.security import ldapauth
 from tests.settings import DEFAULT_TEST_SETTINGS
 from tests.integration.views.conftest import get_dbsession
@@ -31,6 +32,7 @@ from tests.integration.views.test_manager import (
 )
 from tests.integration.constants import (
     TEST_LDAP_FULL_DETAILS,
+    TEST_MANAGER_USERNAME,
     TEST_MANAGER_USERS,
     SUMMARISED_USERNAMES,
     TEST_UTCNOW,
@@ -440,3 +442,189 @@ def test_send_emails_according_to_configured_location(
             period.feedback_available_mail_last_sent = None
             with transaction.manager:
                 dbsession.merge(period)
+
+
+def _outbox_test_settings():
+    # talent manager needs to be outside of the employees
+    return {
+        "adaero.talent_manager_usernames": [TEST_OTHER_MANAGER_USERNAME],
+        "adaero.served_on_https": True,
+        "adaero.homebase_location": "London",
+        "adaero.enable_send_email": True,
+    }
+
+
+def _sent_to(sendmail_mock):
+    return [c[0][1][0] for c in sendmail_mock.call_args_list]
+
+
+def test_interrupted_email_delivery_resumes_where_it_stopped(
+    ldap_mocked_app_with_users, ldapsource
+):  # noqa: E501
+    app = ldap_mocked_app_with_users
+    dbsession = get_dbsession(app)
+    add_test_data_for_stats(dbsession, current_subperiod=Period.ENTRY_SUBPERIOD)
+    settings = _outbox_test_settings()
+    tm_email = TEST_LDAP_FULL_DETAILS[TEST_OTHER_MANAGER_USERNAME]["mail"]
+    record_outbox_results = mail._record_outbox_results
+
+    def record_first_batch_then_crash(*args):
+        record_outbox_results(*args)
+        raise RuntimeError("Worker restarted")
+
+    with patch("smtplib.SMTP") as smtp_mock, patch.object(mail, "OUTBOX_BATCH_SIZE", 2):
+        sendmail_mock = smtp_mock().sendmail
+        with patch.object(
+            mail, "_record_outbox_results", side_effect=record_first_batch_then_crash
+        ), pytest.raises(RuntimeError):
+            mail.check_and_send_email(
+                dbsession, ldapsource, settings, delay_s=0, delay_between_s=0
+            )
+        first_run_sent_to = _sent_to(sendmail_mock)
+        assert 2 == len(first_run_sent_to)
+
+        sendmail_mock.reset_mock()
+        mail.check_and_send_email(
+            dbsession, ldapsource, settings, delay_s=0, delay_between_s=0
+        )
+        second_run_sent_to = _sent_to(sendmail_mock)
+
+    assert tm_email == second_run_sent_to.pop(-1)
+    assert not set(first_run_sent_to) & set(second_run_sent_to)
+    with transaction.manager:
+        employee_emails = {
+            u.email
+            for u in dbsession.query(User).filter(User.is_staff == True)  # noqa
+            if u.email
+        }
+    assert employee_emails == set(first_run_sent_to + second_run_sent_to)
+
+    # the confirmation has the number of emails delivered across both runs
+    confirm_message = Parser().parsestr(sendmail_mock.call_args_list[-1][0][2])
+    confirm_plain = b64decode(confirm_message.get_payload()[0].get_payload())
+    assert confirm_plain.decode("utf-8").count(
+        "%s email addresses" % len(employee_emails)
+    )
+
+
+def test_concurrent_deliveries_send_each_email_once(
+    ldap_mocked_app_with_users, ldapsource
+):  # noqa: E501
+    app = ldap_mocked_app_with_users
+    dbsession = get_dbsession(app)
+    add_test_data_for_stats(dbsession, current_subperiod=Period.ENTRY_SUBPERIOD)
+    settings = _outbox_test_settings()
+    tm_email = TEST_LDAP_FULL_DETAILS[TEST_OTHER_MANAGER_USERNAME]["mail"]
+    other_dbsession = get_tm_session(
+        app.app.registry["dbsession_factory"], transaction.manager
+    )
+    other_runs = []
+
+    def sendmail(from_email, to_emails, message):
+        # drain the same outbox while the first batch is being sent, as
+        # another process would
+        if not other_runs:
+            other_runs.append(None)
+            with mail._build_smtp_dispatcher(settings, 0) as dispatcher:
+                mail._drain_outbox(other_dbsession, dispatcher)
+            other_runs[0] = dispatcher.num_sent
+        return {}
+
+    with patch("smtplib.SMTP") as smtp_mock, patch.object(mail, "OUTBOX_BATCH_SIZE", 2):
+        sendmail_mock = smtp_mock().sendmail
+        sendmail_mock.side_effect = sendmail
+        mail.check_and_send_email(
+            dbsession, ldapsource, settings, delay_s=0, delay_between_s=0
+        )
+    other_dbsession.close()
+
+    sent_to = _sent_to(sendmail_mock)
+    assert other_runs[0]
+    assert sorted(set(sent_to)) == sorted(sent_to)
+    assert tm_email == sent_to[-1]
+    with transaction.manager:
+        statuses = {
+            status
+            for status, in dbsession.query(EmailOutbox.status).filter(
+                EmailOutbox.is_confirmation == False  # noqa
+            )
+        }
+        num_rows = dbsession.query(EmailOutbox).count()
+    assert {EmailOutbox.SENT} == statuses
+    assert num_rows == len(sent_to)
+
+
+def test_emails_claimed_by_stopped_delivery_are_sent_again(
+    ldap_mocked_app_with_users, ldapsource
+):  # noqa: E501
+    app = ldap_mocked_app_with_users
+    dbsession = get_dbsession(app)
+    add_test_data_for_stats(dbsession, current_subperiod=Period.ENTRY_SUBPERIOD)
+    settings = _outbox_test_settings()
+    mail.enqueue_period_email(dbsession, settings)
+    claimed = mail._claim_outbox_batch(dbsession, "stopped")
+    assert claimed
+
+    with patch("smtplib.SMTP") as smtp_mock:
+        sendmail_mock = smtp_mock().sendmail
+        mail.deliver_email_outbox(dbsession, ldapsource, settings, 0)
+        assert not {row[2] for row in claimed} & set(_sent_to(sendmail_mock))
+
+        sendmail_mock.reset_mock()
+        with freeze_time(TEST_UTCNOW + timedelta(seconds=mail.OUTBOX_CLAIM_TIMEOUT_S)):
+            mail.deliver_email_outbox(dbsession, ldapsource, settings, 0)
+        sent_to = _sent_to(sendmail_mock)
+        assert {row[2] for row in claimed} <= set(sent_to)
+        # confirmed once the claimed emails are delivered
+        assert TEST_LDAP_FULL_DETAILS[TEST_OTHER_MANAGER_USERNAME]["mail"] == (
+            sent_to[-1]
+        )
+
+
+def test_failed_emails_are_retried_with_backoff(
+    ldap_mocked_app_with_users, ldapsource
+):  # noqa: E501
+    app = ldap_mocked_app_with_users
+    dbsession = get_dbsession(app)
+    add_test_data_for_stats(dbsession, current_subperiod=Period.ENTRY_SUBPERIOD)
+    settings = _outbox_test_settings()
+    tm_email = TEST_LDAP_FULL_DETAILS[TEST_OTHER_MANAGER_USERNAME]["mail"]
+    rejected_email = TEST_LDAP_FULL_DETAILS[TEST_MANAGER_USERNAME]["mail"]
+
+    def sendmail(from_email, to_emails, message):
+        if to_emails == [rejected_email]:
+            raise smtplib.SMTPRecipientsRefused({rejected_email: (550, b"Busy")})
+        return {}
+
+    with patch("smtplib.SMTP") as smtp_mock:
+        sendmail_mock = smtp_mock().sendmail
+        sendmail_mock.side_effect = sendmail
+        mail.check_and_send_email(
+            dbsession, ldapsource, settings, delay_s=0, delay_between_s=0
+        )
+        # no confirmation until the rejected email is given up on
+        assert tm_email not in _sent_to(sendmail_mock)
+        utcnow = TEST_UTCNOW
+        for attempt in range(2, mail.OUTBOX_MAX_ATTEMPTS + 1):
+            sendmail_mock.reset_mock()
+            backoff = timedelta(
+                seconds=mail.OUTBOX_RETRY_BACKOFF_S * 2 ** (attempt - 2)
+            )
+            # not retried until the backoff has passed
+            with freeze_time(utcnow + backoff - timedelta(seconds=1)):
+                mail.deliver_email_outbox(dbsession, ldapsource, settings, 0)
+            assert [] == _sent_to(sendmail_mock)
+            utcnow += backoff
+            with freeze_time(utcnow):
+                mail.deliver_email_outbox(dbsession, ldapsource, settings, 0)
+            assert rejected_email == _sent_to(sendmail_mock)[0]
+
+    assert tm_email == _sent_to(sendmail_mock)[-1]
+    with transaction.manager:
+        row = (
+            dbsession.query(EmailOutbox)
+            .filter(EmailOutbox.to_email == rejected_email)
+            .one()
+        )
+        assert EmailOutbox.FAILED == row.status
+        assert mail.OUTBOX_MAX_ATTEMPTS == row.attempts
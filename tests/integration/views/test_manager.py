@@ -6,10 +6,16 @@ from datetime import datetime, timedelta
 from functools import partial
 
 from faker import Faker
+from mock import patch
+import pandas as pd
 import pytest
 import transaction
 
-from adaero.constants import MANAGER_VIEW_HISTORY_LIMIT
+from adaero.constants import (
+    HOMEBASE_LOCATION_KEY,
+    MANAGER_VIEW_HISTORY_LIMIT,
+    STATS_ENGINE_KEY,
+)
 from adaero.date import datetimeformat
 from adaero.models import (
     FeedbackAnswer,
@@ -17,6 +23,7 @@ from adaero.models import (
     Nominee,
     Period,
     User,
+    UserPeriodStats,
     generate_period_dates,
 )
 from adaero.security import (
@@ -53,6 +60,16 @@ from tests.integration.views.conftest import (
     add_previous_test_summary,
 )
 from tests.integration.conftest import get_dbsession
+from tests.settings import DEFAULT_TEST_SETTINGS
+from adaero.stats import (
+    AGGREGATE_STATS_ENGINE,
+    CROSS_JOIN_STATS_ENGINE,
+    STATS_ENGINES,
+    backfill_user_period_stats,
+    freeze_closed_periods,
+    freeze_period_stats,
+)
+from adaero.views.talent_manager import USER_ORDERED_COLUMNS
 
 fake = Faker()
 
@@ -411,6 +428,97 @@ def test_manager_can_get_own_team_feedback_stats_during_approval_period(
     assert response.json_body == expected
 
 
+@pytest.mark.parametrize("stats_engine", sorted(STATS_ENGINES.keys()))
+def test_manager_can_get_own_team_feedback_stats_with_each_stats_engine(
+    ldap_mocked_app_with_users, stats_engine
+):  # noqa: E501
+    app = successfully_login(ldap_mocked_app_with_users, TEST_MANAGER_USERNAME)
+    dbsession = get_dbsession(app)
+    add_test_data_for_stats(dbsession)
+    _add_extra_periods(dbsession)
+    with patch.dict(app.app.registry.settings, {STATS_ENGINE_KEY: stats_engine}):
+        response = app.get("/api/v1/team-stats")
+    assert response.json_body == ADD_TEST_DATA_FOR_STATS_EXPECTED_STATE
+
+
+def test_stats_engines_build_identical_dataframes(ldap_mocked_app_with_users):
+    dbsession = get_dbsession(ldap_mocked_app_with_users)
+    add_test_data_for_stats(dbsession)
+    _add_extra_periods(dbsession)
+    with transaction.manager:
+        usernames = [u.username for u in dbsession.query(User).all()]
+    dfs = []
+    for build_func in STATS_ENGINES.values():
+        df = build_func(dbsession, usernames, USER_ORDERED_COLUMNS)
+        dfs.append(df.sort_values(["username", "period_name"]).reset_index(drop=True))
+    for df in dfs[1:]:
+        pd.testing.assert_frame_equal(dfs[0], df)
+
+
+def test_backfill_user_period_stats_matches_incremental_updates(
+    ldap_mocked_app_with_users
+):  # noqa: E501
+    dbsession = get_dbsession(ldap_mocked_app_with_users)
+    add_test_data_for_stats(dbsession)
+
+    def fetch_rows():
+        with transaction.manager:
+            return sorted(
+                (
+                    r.username,
+                    r.period_id,
+                    r.contributed,
+                    r.received,
+                    r.is_nominated,
+                    r.has_summary,
+                )
+                for r in dbsession.query(UserPeriodStats).all()
+            )
+
+    incremental_rows = fetch_rows()
+    assert len(incremental_rows)
+    num_rows = backfill_user_period_stats(dbsession)
+    assert num_rows == len(incremental_rows)
+    assert fetch_rows() == incremental_rows
+
+
+def test_frozen_period_stats_are_used_until_refrozen(ldap_mocked_app_with_users):
+    dbsession = get_dbsession(ldap_mocked_app_with_users)
+    add_test_data_for_stats(dbsession)
+    with transaction.manager:
+        usernames = [u.username for u in dbsession.query(User).all()]
+
+    def fetch_contributed(stats_engine):
+        df = STATS_ENGINES[stats_engine](dbsession, usernames, USER_ORDERED_COLUMNS)
+        row = df[
+            (df["username"] == TEST_EMPLOYEE_USERNAME)
+            & (df["period_name"] == TEST_PREVIOUS_PERIOD_NAME)
+        ]
+        return row["contributed"].iloc[0]
+
+    # only the previous period is closed
+    location = DEFAULT_TEST_SETTINGS[HOMEBASE_LOCATION_KEY]
+    assert freeze_closed_periods(dbsession, location) == [TEST_PREVIOUS_PERIOD_NAME]
+    assert freeze_closed_periods(dbsession, location) == []
+    for stats_engine in STATS_ENGINES:
+        assert fetch_contributed(stats_engine) == 7
+
+    # a late correction is ignored until the period is re-frozen
+    with transaction.manager:
+        _generate_num_of_forms(
+            dbsession,
+            TEST_PREVIOUS_PERIOD_ID,
+            1,
+            to_username=TEST_MANAGER_USERNAME,
+            from_username=TEST_EMPLOYEE_USERNAME,
+        )
+    assert fetch_contributed(CROSS_JOIN_STATS_ENGINE) == 8
+    assert fetch_contributed(AGGREGATE_STATS_ENGINE) == 7
+    freeze_period_stats(dbsession, TEST_PREVIOUS_PERIOD_ID)
+    for stats_engine in STATS_ENGINES:
+        assert fetch_contributed(stats_engine) == 8
+
+
 def test_manager_can_get_own_team_feedback_stats_outside_approval_period(
     ldap_mocked_app_with_users
 ):  # noqa: E501
@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from freezegun import freeze_time
+import pytest
+import webtest
+
+import adaero
+from adaero.constants import (
+    SESSION_CLEANUP_INTERVAL_S_KEY,
+    SESSION_TIMEOUT_S_KEY,
+    SESSION_TYPE_KEY,
+)
+from adaero.security import (
+    ANGULAR_2_XSRF_TOKEN_COOKIE_NAME,
+    ANGULAR_2_XSRF_TOKEN_HEADER_NAME,
+)
+from adaero.session import (
+    COOKIE_SESSION_TYPE,
+    SESSION_COOKIE_NAME,
+    SQL_SESSION_TYPE,
+    purge_expired_sessions,
+)
+from tests.settings import DEFAULT_TEST_SETTINGS
+from ..constants import TEST_MANAGER_USERNAME, TEST_UTCNOW
+from .conftest import get_dbsession, successfully_login
+
+TEST_SESSION_TIMEOUT_S = 60 * 60
+
+
+def _build_app(session_type):
+    settings = dict(DEFAULT_TEST_SETTINGS)
+    settings[SESSION_TYPE_KEY] = session_type
+    settings[SESSION_TIMEOUT_S_KEY] = TEST_SESSION_TIMEOUT_S
+    settings[SESSION_CLEANUP_INTERVAL_S_KEY] = 0
+    # session cookies are only sent back over HTTPS
+    return webtest.TestApp(
+        adaero.main({}, **settings), extra_environ={"wsgi.url_scheme": "https"}
+    )
+
+
+@pytest.fixture
+def two_apps_sharing_sessions(new_ldap_mocked_app_with_users, session_type):
+    """Two instances of the app as if run by separate workers, relying on the
+    users and LDAP patches of `new_ldap_mocked_app_with_users`"""
+    app_1, app_2 = _build_app(session_type), _build_app(session_type)
+    # a single browser load balanced across both instances
+    app_2.cookiejar = app_1.cookiejar
+    return app_1, app_2
+
+
+@pytest.mark.parametrize("session_type", [SQL_SESSION_TYPE, COOKIE_SESSION_TYPE])
+def test_session_is_shared_between_app_instances(two_apps_sharing_sessions):
+    app_1, app_2 = two_apps_sharing_sessions
+    successfully_login(app_1, TEST_MANAGER_USERNAME)
+
+    response = app_2.get("/api/v1/user-data")
+    assert response.json_body["success"]
+    # CSRF token issued by one instance is accepted by the other
+    csrf_token = app_1.cookies[ANGULAR_2_XSRF_TOKEN_COOKIE_NAME]
+    app_2.post("/api/v1/logout", headers={ANGULAR_2_XSRF_TOKEN_HEADER_NAME: csrf_token})
+    response = app_2.get("/api/v1/user-data", expect_errors=True)
+    assert response.status_code == 401
+
+
+@pytest.mark.parametrize("session_type", [SQL_SESSION_TYPE])
+def test_sql_session_logout_and_expiry(two_apps_sharing_sessions):
+    app_1, app_2 = two_apps_sharing_sessions
+    successfully_login(app_1, TEST_MANAGER_USERNAME)
+    session_cookie = app_1.cookies[SESSION_COOKIE_NAME]
+    csrf_token = app_1.cookies[ANGULAR_2_XSRF_TOKEN_COOKIE_NAME]
+    app_2.post("/api/v1/logout", headers={ANGULAR_2_XSRF_TOKEN_HEADER_NAME: csrf_token})
+    # the session is cleared server side, so replaying the cookie from before
+    # the logout does not log back in
+    app_1.cookiejar.clear()
+    app_1.set_cookie(SESSION_COOKIE_NAME, session_cookie)
+    response = app_1.get("/api/v1/user-data", expect_errors=True)
+    assert response.status_code == 401
+
+    successfully_login(app_1, TEST_MANAGER_USERNAME)
+    engine = get_dbsession(app_1).get_bind()
+    with freeze_time(TEST_UTCNOW + timedelta(seconds=TEST_SESSION_TIMEOUT_S + 1)):
+        response = app_1.get("/api/v1/user-data", expect_errors=True)
+        assert response.status_code == 401
+        assert purge_expired_sessions(engine) >= 1
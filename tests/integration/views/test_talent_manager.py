@@ -1,6 +1,9 @@
+import csv
+from datetime import datetime, timedelta
+from io import StringIO
 import os.path
 
-from mock import patch
+from mock import Mock, patch
 import pytest
 import transaction
 
@@ -8,7 +11,7 @@ from adaero.security import (
     ANGULAR_2_XSRF_TOKEN_COOKIE_NAME,
     ANGULAR_2_XSRF_TOKEN_HEADER_NAME
 )
-from adaero.models import FeedbackForm, FeedbackAnswer, Period
+from adaero.models import EmailOutbox, FeedbackForm, FeedbackAnswer, Period
 from tests.integration.views.conftest import (
     add_test_template,
     add_test_period_with_template,
@@ -19,6 +22,7 @@ from tests.integration.constants import (
     TEST_EMPLOYEE_USERNAME,
     TEST_MANAGER_USERNAME,
     TEST_TALENT_MANAGER_USERNAME,
+    TEST_PERIOD_NAME,
     TEST_PREVIOUS_PERIOD_ID,
     TEST_EMPLOYEE_3_USERNAME,
     QUESTION_IDS_AND_TEMPLATES,
@@ -145,6 +149,18 @@ def test_talent_manager_can_get_company_feedback_stats_csv(
     assert response.body == open(TEST_CSV_FILEPATH, "rb").read()
 
 
+def test_company_feedback_stats_csv_is_streamed_in_chunks(
+    ldap_mocked_app_with_users
+):  # noqa: E501
+    app = successfully_login(ldap_mocked_app_with_users, TEST_TALENT_MANAGER_USERNAME)
+    dbsession = get_dbsession(app)
+    add_test_data_for_stats(dbsession)
+    with patch("adaero.views.talent_manager.COMPANY_STATS_CSV_CHUNK_SIZE", 2):
+        response = app.get("/api/v1/company-feedback-stats.csv")
+    assert response.content_type == "text/csv"
+    assert response.body == open(TEST_CSV_FILEPATH, "rb").read()
+
+
 def test_talent_manager_can_get_company_raw_feedback(
     ldap_mocked_app_with_users
 ):  # noqa: E501
@@ -202,6 +218,38 @@ def test_talent_manager_can_get_company_raw_feedback(
     assert body.count(raw_answer_row) == 1
 
 
+def test_talent_manager_can_filter_company_raw_feedback(
+    ldap_mocked_app_with_users
+):  # noqa: E501
+    app = successfully_login(ldap_mocked_app_with_users, TEST_TALENT_MANAGER_USERNAME)
+    dbsession = get_dbsession(app)
+    add_test_data_for_stats(dbsession)
+
+    def get_rows(**params):
+        response = app.get("/api/v1/company-raw-feedback.csv", params=params)
+        assert response.content_type == "text/csv"
+        rows = list(csv.DictReader(StringIO(response.body.decode())))
+        return [(row["name"], row["content"]) for row in rows]
+
+    # chunk size chosen so that the rows do not divide evenly into chunks
+    with patch("adaero.views.talent_manager.RAW_FEEDBACK_CSV_CHUNK_SIZE", 7):
+        all_rows = get_rows()
+        current_rows = get_rows(period=TEST_PERIOD_NAME)
+        previous_rows = get_rows(period=TEST_PREVIOUS_PERIOD_NAME)
+        since = (datetime.utcnow() - timedelta(days=100)).strftime("%Y-%m-%d")
+        since_rows = get_rows(since=since)
+    assert {name for name, _ in current_rows} == {TEST_PERIOD_NAME}
+    assert {name for name, _ in previous_rows} == {TEST_PREVIOUS_PERIOD_NAME}
+    assert sorted(current_rows + previous_rows) == sorted(all_rows)
+    assert since_rows == current_rows
+    response = app.get(
+        "/api/v1/company-raw-feedback.csv",
+        params={"since": "yesterday"},
+        expect_errors=True,
+    )
+    assert response.status_code == 400
+
+
 def test_talent_manager_can_correct_summarised_feedback_from_another_manager(
     ldap_mocked_app_with_users
 ):  # noqa: E501
@@ -224,9 +272,12 @@ def test_talent_manager_can_correct_summarised_feedback_from_another_manager(
 
 @pytest.mark.parametrize("template_key", tuple(EMAIL_TEMPLATE_MAP.keys()))
 def test_talent_manager_can_mass_email(ldap_mocked_app_with_users, template_key):
-    with patch("smtplib.SMTP"), patch(
+    outbox_delivery = Mock()
+    with patch("smtplib.SMTP") as smtp_mock, patch(
         "socket.gethostname"
-    ) as gethostname_mock, patch("getpass.getuser") as getuser_mock:
+    ) as gethostname_mock, patch("getpass.getuser") as getuser_mock, patch.dict(
+        ldap_mocked_app_with_users.app.registry, {"outbox_delivery": outbox_delivery}
+    ):
         gethostname_mock.return_value = TEST_PRODUCTION_HOSTNAME
         getuser_mock.return_value = TEST_PRODUCTION_USER
         app = successfully_login(ldap_mocked_app_with_users, TEST_TALENT_MANAGER_USERNAME)
@@ -238,4 +289,33 @@ def test_talent_manager_can_mass_email(ldap_mocked_app_with_users, template_key)
             "/api/v1/send-email", {"templateKey": template_key}, headers={ANGULAR_2_XSRF_TOKEN_HEADER_NAME: csrf_token},
         )
         assert response.json_body["success"]
+        # left to the email job of the leader
+        assert 0 == smtp_mock().sendmail.call_count
+    assert 1 == outbox_delivery.wake.call_count
+    with transaction.manager:
+        statuses = {
+            status
+            for status, in dbsession.query(EmailOutbox.status).filter(
+                EmailOutbox.template_code == EMAIL_TEMPLATE_MAP[template_key]["code"]
+            )
+        }
+    assert statuses <= {EmailOutbox.PENDING}
+
+
+def test_employee_cannot_get_diagnostics(ldap_mocked_app_with_users):
+    app = successfully_login(ldap_mocked_app_with_users, TEST_EMPLOYEE_USERNAME)
+    response = app.get("/api/v1/diagnostics", expect_errors=True)
+    assert response.status_code == 403
+
 
+def test_talent_manager_can_get_pool_diagnostics(ldap_mocked_app_with_users):
+    app = successfully_login(ldap_mocked_app_with_users, TEST_TALENT_MANAGER_USERNAME)
+    response = app.get("/api/v1/diagnostics")
+    # tests run against sqlite, which does not use a `QueuePool`
+    assert response.json_body["pool"]["poolClass"]
+    assert set(response.json_body["directory"]) == {
+        "hits",
+        "negativeHits",
+        "misses",
+        "size",
+    }
@@ -0,0 +1,115 @@
+"""Compare sending emails one after the other over a single SMTP connection,
+as `check_and_send_email` used to less its fixed sleeps, against
+`adaero.smtp.SMTPDispatcher`, using a local stub SMTP server that takes
+`--latency-ms` to accept each message like a real relay would.
+
+    python -m tests.scripts.benchmark_email_dispatch --emails 2000
+"""
+
+import smtplib
+import socketserver
+import threading
+import time
+
+import click
+
+from adaero.smtp import SMTPDispatcher
+
+TEST_FROM = "noreply@example.com"
+MESSAGE = "Subject: Benchmark\r\n\r\n" + "Please provide feedback.\r\n" * 40
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """Accepts any message, replying to each after `server.latency_s`"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.reply("220 stub ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250 stub")
+            elif command == b"DATA":
+                self.reply("354 end with <CRLF>.<CRLF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                time.sleep(self.server.latency_s)
+                self.server.count()
+                self.reply("250 queued")
+            elif command == b"QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("250 ok")
+
+
+class StubSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency_s):
+        socketserver.ThreadingTCPServer.__init__(
+            self, ("localhost", 0), StubSMTPHandler
+        )
+        self.latency_s = latency_s
+        self.num_received = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.num_received += 1
+
+
+def send_serially(port, num_emails):
+    connection = smtplib.SMTP()
+    connection.connect("localhost", port)
+    for i in range(num_emails):
+        connection.sendmail(TEST_FROM, ["user%s@example.com" % i], MESSAGE)
+    connection.quit()
+
+
+def send_with_dispatcher(port, num_emails, connections, rate_per_s):
+    dispatcher = SMTPDispatcher(connections, rate_per_s, port=port)
+    with dispatcher:
+        for i in range(num_emails):
+            dispatcher.send(TEST_FROM, ["user%s@example.com" % i], MESSAGE)
+    assert dispatcher.num_sent == num_emails
+
+
+@click.command()
+@click.option("--emails", default=2000, show_default=True)
+@click.option("--connections", default=8, show_default=True)
+@click.option("--rate-per-s", default=0.0, show_default=True)
+@click.option("--latency-ms", default=5.0, show_default=True)
+def main(emails, connections, rate_per_s, latency_ms):
+    server = StubSMTPServer(latency_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    try:
+        for name, send in [
+            ("serial", lambda: send_serially(port, emails)),
+            (
+                "dispatcher",
+                lambda: send_with_dispatcher(port, emails, connections, rate_per_s),
+            ),
+        ]:
+            start_s = time.time()
+            send()
+            total_s = time.time() - start_s
+            print(
+                "%-12s %s emails in %.2fs, %.0f emails/s"
+                % (name, emails, total_s, emails / total_s)
+            )
+        assert server.num_received == 2 * emails
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
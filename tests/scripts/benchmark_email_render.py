@@ -0,0 +1,87 @@
+"""Compare rendering the period email for each recipient, as
+`_render_period_emails` used to, against rendering it once per location with
+`adaero.mail.CompiledMessage` and substituting the recipient fields. No email
+is sent.
+
+    python -m tests.scripts.benchmark_email_render --emails 50000
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import click
+
+from adaero import mail
+from adaero.constants import EMAIL_TEMPLATE_MAP
+from adaero.date import CUSTOM_LOC_TO_PYTZ_LOC
+from adaero.models import Period, User
+
+TEST_FROM = "noreply@example.com"
+TEST_SUBJECT = "Example Feedback: Please provide feedback"
+TEST_START = datetime(2017, 11, 20, 9)
+CONTEXT = {
+    "period": Period(
+        name="2017-Q4",
+        enrollment_start_utc=TEST_START,
+        entry_start_utc=TEST_START + timedelta(days=7),
+        approval_start_utc=TEST_START + timedelta(days=14),
+        approval_end_utc=TEST_START + timedelta(days=21),
+    ),
+    "app_host": "https://feedback.example.com",
+    "company_name": "Example",
+}
+
+
+def render_per_recipient(template, users):
+    for user in users:
+        html = template.render(user=user, **CONTEXT)
+        yield mail._generate_message_root(html, TEST_FROM, TEST_SUBJECT).as_string()
+
+
+def render_compiled(template, users):
+    compiled_by_location = {}
+    for user in users:
+        compiled = compiled_by_location.get(user.location)
+        if compiled is None:
+            compiled = compiled_by_location[user.location] = mail.CompiledMessage(
+                template, user.location, TEST_FROM, TEST_SUBJECT, **CONTEXT
+            )
+        yield compiled.render(user)
+
+
+@click.command()
+@click.option("--emails", default=50000, show_default=True)
+@click.option(
+    "--template-key",
+    default="entry_start",
+    type=click.Choice(sorted(EMAIL_TEMPLATE_MAP)),
+    show_default=True,
+)
+def main(emails, template_key):
+    template = mail._build_template_env().get_template(
+        "email/%s" % EMAIL_TEMPLATE_MAP[template_key]["template"]
+    )
+    locations = sorted(CUSTOM_LOC_TO_PYTZ_LOC)
+    users = [
+        User(
+            first_name="User%s" % i,
+            last_name="Example",
+            location=locations[i % len(locations)],
+        )
+        for i in range(emails)
+    ]
+    for name, render in [
+        ("per-recipient", render_per_recipient),
+        ("compiled", render_compiled),
+    ]:
+        start_s = time.time()
+        num_bytes = sum(len(message) for message in render(template, users))
+        total_s = time.time() - start_s
+        print(
+            "%-14s %s emails (%.1f MB) in %.2fs, %.0f emails/s"
+            % (name, emails, num_bytes / 1e6, total_s, emails / total_s)
+        )
+
+
+if __name__ == "__main__":
+    main()
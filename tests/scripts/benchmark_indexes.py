@@ -0,0 +1,137 @@
+"""Show the query plans and timings of the hot `forms`, `nominees` and
+`einvites` lookups on a seeded SQLite database, before and after creating
+the composite indexes declared on the models.
+
+    python -m tests.scripts.benchmark_indexes --users 2000 --periods 10
+"""
+
+import os
+import random
+import shutil
+import tempfile
+import timeit
+
+import click
+from sqlalchemy import create_engine, text
+
+from adaero.models import ExternalInvite, FeedbackForm, Nominee, Period
+from adaero.models.all import Base
+
+INDEXED_TABLES = [FeedbackForm.__table__, ExternalInvite.__table__]
+
+LOOKUPS = [
+    (
+        "summary check",
+        "SELECT id FROM forms WHERE period_id = :period_id "
+        "AND to_username = :username AND is_summary = 1",
+    ),
+    (
+        "received feedback",
+        "SELECT id FROM forms WHERE period_id = :period_id "
+        "AND to_username = :username AND is_summary = 0",
+    ),
+    (
+        "given feedback",
+        "SELECT id FROM forms WHERE period_id = :period_id "
+        "AND from_username = :username",
+    ),
+    (
+        "nominee",
+        "SELECT id FROM nominees WHERE p_id = :period_id AND username = :username",
+    ),
+    (
+        "external invites",
+        "SELECT id FROM einvites WHERE period_id = :period_id "
+        "AND to_username = :username",
+    ),
+]
+
+
+def seed(engine, num_users, num_periods, forms_per_user, seed_=0):
+    rand = random.Random(seed_)
+    usernames = ["user%06d" % i for i in range(num_users)]
+    periods, forms, nominees, invites = [], [], [], []
+    for period_id in range(1, num_periods + 1):
+        periods.append({"id": period_id, "name": "P%03d" % period_id})
+        for username in usernames:
+            nominees.append(
+                {"id": len(nominees) + 1, "username": username, "p_id": period_id}
+            )
+            for to_username in rand.sample(usernames, forms_per_user):
+                if to_username == username:
+                    continue
+                forms.append(
+                    {
+                        "id": len(forms) + 1,
+                        "period_id": period_id,
+                        "from_username": username,
+                        "to_username": to_username,
+                        "is_summary": False,
+                    }
+                )
+            invites.append(
+                {
+                    "id": len(invites) + 1,
+                    "period_id": period_id,
+                    "from_username": username,
+                    "to_username": rand.choice(usernames),
+                }
+            )
+    with engine.begin() as connection:
+        connection.execute(Period.__table__.insert(), periods)
+        connection.execute(FeedbackForm.__table__.insert(), forms)
+        connection.execute(Nominee.__table__.insert(), nominees)
+        connection.execute(ExternalInvite.__table__.insert(), invites)
+    return usernames
+
+
+def run_lookups(engine, usernames, num_periods, num_lookups):
+    rand = random.Random(1)
+    params = [
+        {"period_id": rand.randint(1, num_periods), "username": rand.choice(usernames)}
+        for _ in range(num_lookups)
+    ]
+    with engine.connect() as connection:
+        for name, sql in LOOKUPS:
+            plan = connection.execute(
+                text("EXPLAIN QUERY PLAN " + sql), params[0]
+            ).fetchall()
+            statement = text(sql)
+            seconds = timeit.timeit(
+                lambda: [connection.execute(statement, p).fetchall() for p in params],
+                number=1,
+            )
+            print(
+                "  %-18s %8.2fms/query  %s"
+                % (name, seconds * 1000 / num_lookups, plan[-1][-1])
+            )
+
+
+@click.command()
+@click.option("--users", default=2000, show_default=True)
+@click.option("--periods", default=10, show_default=True)
+@click.option("--forms-per-user", default=5, show_default=True)
+@click.option("--lookups", default=200, show_default=True)
+def main(users, periods, forms_per_user, lookups):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        engine = create_engine("sqlite:///" + os.path.join(tmpdir, "benchmark.db"))
+        Base.metadata.create_all(engine)
+        for table in INDEXED_TABLES:
+            for index in table.indexes:
+                index.drop(engine)
+        usernames = seed(engine, users, periods, forms_per_user)
+        print("Before")
+        run_lookups(engine, usernames, periods, lookups)
+        for table in INDEXED_TABLES:
+            for index in table.indexes:
+                index.create(engine)
+        engine.execute("ANALYZE")
+        print("After")
+        run_lookups(engine, usernames, periods, lookups)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""Compare reconciling the users of a population CSV, as
+`generate_required_users` and `remove_duplicate_users` do once its rows are
+resolved, against the list scans they used to make, on synthetic rows where
+one in `--outside-every` managers is outside of the population and one in
+`--duplicate-every` rows repeats an employee ID.
+
+    python -m tests.scripts.benchmark_population_reconciliation --rows 20000
+"""
+
+import time
+
+import click
+import mock
+
+from adaero import population
+from adaero.models.user import User
+from adaero.security import ldapauth
+from tests.fake_ldap import FakeLDAPConnection
+from tests.integration.constants import (
+    TEST_BUSINESS_UNIT_KEY,
+    TEST_DEPARTMENT_KEY,
+    TEST_LOCATION_KEY,
+    TEST_MANAGER_KEY,
+    TEST_UID_KEY,
+    TEST_USERNAME_KEY,
+)
+from tests.settings import DEFAULT_TEST_SETTINGS
+
+# reports per manager
+SPAN_OF_CONTROL = 8
+
+
+def generate_rows(num_rows, outside_every, duplicate_every):
+    """
+    Returns
+    -------
+    Tuple of the rows, as returned by `convert_population_csv_to_user_rows`,
+    and the LDAP details of the managers outside of the population
+    """
+    rows = []
+    outside_managers = []
+    for i in range(num_rows):
+        manager_index = i // SPAN_OF_CONTROL
+        if manager_index % outside_every == 0:
+            manager = "outside%s" % manager_index
+            if i % SPAN_OF_CONTROL == 0:
+                outside_managers.append(
+                    {
+                        "distinguishedName": "CN=%s,OU=People,O=foo" % manager,
+                        "givenName": "Outside%s" % manager_index,
+                        "sn": "Manager",
+                        "mail": "%s@example.com" % manager,
+                        "title": "Manager",
+                        TEST_USERNAME_KEY: manager,
+                        TEST_UID_KEY: str(900000 + manager_index),
+                        TEST_MANAGER_KEY: None,
+                        TEST_LOCATION_KEY: "London",
+                        TEST_DEPARTMENT_KEY: "App Development",
+                        TEST_BUSINESS_UNIT_KEY: "Beta",
+                    }
+                )
+        else:
+            manager = "user%s" % manager_index
+        uid = i - 1 if i and i % duplicate_every == 0 else i
+        rows.append(
+            {
+                "first_name": "First%s" % i,
+                "last_name": "Last%s" % i,
+                "position": "Developer",
+                "employee_id": str(100000 + uid),
+                "business_unit": "Alpha",
+                "email": "user%s@example.com" % i,
+                "department": "App Development",
+                "is_staff": True,
+                "manager_username": manager,
+                "username": "user%s" % i,
+                "location": "London",
+            }
+        )
+    return rows, outside_managers
+
+
+def generate_required_users_quadratic(ldapsource, rows, messages):
+    """`generate_required_users` as it used to be, with the lookups of the
+    missing managers batched as they are now"""
+    users = [User(**row) for row in rows]
+    usernames = {u.username for u in users}
+    ldap_by_username = ldapsource.get_ldap_users_by_kvs(
+        ldapsource.username_key,
+        [
+            u.manager_username
+            for u in users
+            if u.is_staff and u.manager_username not in usernames
+        ],
+    )
+    new_one_up_managers = set()
+    manager_usernames = set()
+    for u in users:
+        if u.manager_username:
+            manager_usernames.add(u.manager_username)
+        if (
+            u.manager_username in usernames
+            or u.manager_username in [mu.username for mu in new_one_up_managers]
+            or not u.manager_username
+        ):
+            continue
+        if not u.is_staff:
+            messages.append(
+                population.DEFAULT_MANAGER_ONLY_TMPL.format(
+                    uid=u.employee_id, display_name=u.display_name
+                )
+            )
+        else:
+            m_ldap_data = ldap_by_username.get(u.manager_username)
+            mu = User.create_from_ldap_details(ldapsource, m_ldap_data)
+            messages.append(
+                population.DEFAULT_MISSING_MANAGER_TMPL.format(
+                    uid=mu.employee_id, display_name=mu.display_name
+                )
+            )
+            new_one_up_managers.add(mu)
+    users.extend(list(new_one_up_managers))
+    for u in users:
+        u.has_direct_reports = u.username in manager_usernames
+    return users, messages
+
+
+def remove_duplicate_users_quadratic(users, messages):
+    """`remove_duplicate_users` as it used to be"""
+    employee_id_row_map = {}
+    processed_users = []
+    for i, u in enumerate(users):
+        row_num = i + 2
+        if u.employee_id in list(employee_id_row_map.keys()):
+            messages.append(
+                population.DEFAULT_DUPLICATE_USER_TMPL.format(
+                    row_num=row_num, first_row_num=employee_id_row_map[u.employee_id]
+                )
+            )
+        else:
+            employee_id_row_map[u.employee_id] = row_num
+            processed_users.append(u)
+    return processed_users, messages
+
+
+def reconcile(ldapsource, rows, generate, remove):
+    users, messages = generate(ldapsource, rows, [])
+    return remove(users, messages)
+
+
+@click.command()
+@click.option(
+    "--rows", "num_rows", multiple=True, type=int, default=[1000, 10000, 50000]
+)
+@click.option("--outside-every", default=50, show_default=True)
+@click.option("--duplicate-every", default=1000, show_default=True)
+@click.option(
+    "--max-quadratic-rows",
+    default=20000,
+    show_default=True,
+    help="Skip the previous implementation above this many rows",
+)
+def main(num_rows, outside_every, duplicate_every, max_quadratic_rows):
+    implementations = [
+        (
+            "before",
+            generate_required_users_quadratic,
+            remove_duplicate_users_quadratic,
+        ),
+        (
+            "after",
+            population.generate_required_users,
+            population.remove_duplicate_users,
+        ),
+    ]
+    for n in num_rows:
+        rows, outside_managers = generate_rows(n, outside_every, duplicate_every)
+        results = []
+        for name, generate, remove in implementations:
+            if name == "before" and n > max_quadratic_rows:
+                print("%-6s %6s rows skipped" % (name, n))
+                continue
+            connection = FakeLDAPConnection(outside_managers)
+            ldapsource = ldapauth.build_ldapauth_from_settings(DEFAULT_TEST_SETTINGS)
+            with mock.patch("ldap.initialize", return_value=connection):
+                start_s = time.time()
+                users, messages = reconcile(ldapsource, rows, generate, remove)
+                total_s = time.time() - start_s
+            results.append((sorted(u.username for u in users), sorted(messages)))
+            print(
+                "%-6s %6s rows in %.2fs, %s users and %s messages"
+                % (name, n, total_s, len(users), len(messages))
+            )
+        assert all(r == results[0] for r in results)
+
+
+if __name__ == "__main__":
+    main()
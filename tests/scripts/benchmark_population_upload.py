@@ -0,0 +1,120 @@
+"""Compare resolving a population CSV with two LDAP searches per row, as
+`convert_population_csv_to_user_rows` used to, against the batched lookups it
+now makes, using an in-process fake directory that takes `--latency-ms` to
+answer each bind and search.
+
+    python -m tests.scripts.benchmark_population_upload --users 15000
+"""
+
+import csv
+import time
+from io import StringIO
+
+import click
+import mock
+
+from adaero import population
+from adaero.security import ldapauth
+from tests.fake_ldap import FakeLDAPConnection
+from tests.integration.constants import (
+    TEST_BUSINESS_UNIT_KEY,
+    TEST_DEPARTMENT_KEY,
+    TEST_LOCATION_KEY,
+    TEST_MANAGER_KEY,
+    TEST_UID_KEY,
+    TEST_USERNAME_KEY,
+)
+from tests.settings import DEFAULT_TEST_SETTINGS
+
+# reports per manager
+SPAN_OF_CONTROL = 8
+
+
+def generate_directory(num_users):
+    users = []
+    for i in range(num_users):
+        manager = "user%s" % ((i - 1) // SPAN_OF_CONTROL) if i else None
+        users.append(
+            {
+                "distinguishedName": "CN=user%s,OU=People,O=foo" % i,
+                "displayName": "User %s" % i,
+                "givenName": "First%s" % i,
+                "sn": "Last%s" % i,
+                "mail": "user%s@example.com" % i,
+                "title": "Developer",
+                TEST_USERNAME_KEY: "user%s" % i,
+                TEST_UID_KEY: str(100000 + i),
+                TEST_MANAGER_KEY: manager,
+                TEST_LOCATION_KEY: "London",
+                TEST_DEPARTMENT_KEY: "App Development",
+                TEST_BUSINESS_UNIT_KEY: "Alpha",
+            }
+        )
+    return users
+
+
+def generate_csv(directory):
+    uid_by_username = {u[TEST_USERNAME_KEY]: u[TEST_UID_KEY] for u in directory}
+    f = StringIO()
+    writer = csv.DictWriter(f, fieldnames=population.FIELDNAMES)
+    writer.writeheader()
+    for u in directory:
+        writer.writerow(
+            {
+                "first_name": u["givenName"],
+                "last_name": u["sn"],
+                "position": u["title"],
+                "employee_id": u[TEST_UID_KEY],
+                "business_unit": u[TEST_BUSINESS_UNIT_KEY],
+                "email": u["mail"],
+                "department": u[TEST_DEPARTMENT_KEY],
+                "is_staff": "True",
+                population.MANAGER_ID: uid_by_username.get(u[TEST_MANAGER_KEY], ""),
+            }
+        )
+    return f.getvalue()
+
+
+def resolve_per_row(ldapsource, contents):
+    """The lookups `convert_population_csv_to_user_rows` used to make"""
+    num_found = 0
+    for row in csv.DictReader(StringIO(contents)):
+        if row[population.MANAGER_ID]:
+            ldapsource.get_ldap_user_by_kv(
+                ldapsource.uid_key, row[population.MANAGER_ID]
+            )
+        if ldapsource.get_ldap_user_by_kv(ldapsource.uid_key, row["employee_id"]):
+            num_found += 1
+    return num_found
+
+
+def resolve_batched(ldapsource, contents):
+    rows, messages = population.convert_population_csv_to_user_rows(
+        ldapsource, contents, []
+    )
+    assert not messages, messages[:5]
+    return len(rows)
+
+
+@click.command()
+@click.option("--users", default=15000, show_default=True)
+@click.option("--latency-ms", default=0.5, show_default=True)
+def main(users, latency_ms):
+    directory = generate_directory(users)
+    contents = generate_csv(directory)
+    for name, resolve in [("per row", resolve_per_row), ("batched", resolve_batched)]:
+        connection = FakeLDAPConnection(directory, latency_ms / 1000)
+        ldapsource = ldapauth.build_ldapauth_from_settings(DEFAULT_TEST_SETTINGS)
+        start_s = time.time()
+        with mock.patch("ldap.initialize", return_value=connection):
+            num_found = resolve(ldapsource, contents)
+        total_s = time.time() - start_s
+        assert num_found == users
+        print(
+            "%-8s %s rows in %.2fs, %s binds and %s searches"
+            % (name, users, total_s, connection.num_binds, connection.num_searches)
+        )
+
+
+if __name__ == "__main__":
+    main()
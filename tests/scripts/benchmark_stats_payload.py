@@ -0,0 +1,118 @@
+"""Compare building the stats payload values row by row, as
+`generate_stats_payload_from_dataframe` used to, against
+`adaero.stats.build_stats_values`, on a synthetic company sized dataframe.
+
+    python -m tests.scripts.benchmark_stats_payload --users 20000 --periods 30
+"""
+
+from collections import defaultdict, OrderedDict
+from datetime import datetime, timedelta
+import timeit
+
+import click
+import numpy as np
+import pandas as pd
+
+from adaero.models.period import Period
+from adaero.stats import build_stats_values
+
+
+def build_stats_values_by_row(df, current_period_name, current_subperiod):
+    stats_dict = defaultdict(list)
+    for (
+        username,
+        first_name,
+        last_name,
+        _,
+        period_name,
+        contributed,
+        received,
+        has_summary,
+    ) in df.sort_values(["start_date"]).values:
+        current_user = stats_dict[username]
+        if not len(current_user):
+            display_name = " ".join([first_name, last_name])
+            stats_dict[username].append(
+                {"displayName": display_name, "username": username}
+            )
+        stats_dict[username].extend([contributed, received])
+        if period_name == current_period_name:
+            button = {
+                "buttonText": "Review feedback",
+                "username": username,
+                "enable": True,
+                "hasExistingSummary": False,
+            }
+            if current_subperiod not in [
+                Period.APPROVAL_SUBPERIOD,
+                Period.REVIEW_SUBPERIOD,
+            ]:
+                button["buttonText"] = "Not in approval or review period"
+                button["enable"] = False
+            elif received == -1:  # not nominated
+                button["buttonText"] = "Not enrolled for feedback"
+                button["enable"] = False
+            elif has_summary:
+                button["buttonText"] = "Review existing summary"
+                button["enable"] = True
+                button["hasExistingSummary"] = True
+            stats_dict[username].append(button)
+    ordered_dict = OrderedDict()
+    for key, value in sorted(stats_dict.items(), key=lambda k_v: k_v[0]):
+        ordered_dict[key] = value
+    return list(ordered_dict.values())
+
+
+def build_synthetic_stats_df(num_users, num_periods, seed=0):
+    random = np.random.RandomState(seed)
+    num_rows = num_users * num_periods
+    usernames = np.array(["user%06d" % i for i in range(num_users)], dtype=object)
+    period_names = np.array(["P%03d" % i for i in range(num_periods)], dtype=object)
+    start_dates = np.array(
+        [datetime(2010, 1, 1) + timedelta(days=90 * i) for i in range(num_periods)]
+    )
+    received = random.randint(0, 10, num_rows)
+    received[random.rand(num_rows) < 0.3] = -1
+    df = pd.DataFrame(
+        {
+            "username": np.repeat(usernames, num_periods),
+            "first_name": "First",
+            "last_name": np.repeat(usernames, num_periods),
+            "start_date": np.tile(start_dates, num_users),
+            "period_name": np.tile(period_names, num_users),
+            "contributed": random.randint(0, 10, num_rows),
+            "received": received,
+            "has_summary": random.rand(num_rows) < 0.5,
+        }
+    )
+    # rows come back from the stats engines in no particular order
+    return df.sample(frac=1, random_state=random), period_names[-1]
+
+
+@click.command()
+@click.option("--users", default=20000, show_default=True)
+@click.option("--periods", default=30, show_default=True)
+@click.option("--repeat", default=3, show_default=True)
+def main(users, periods, repeat):
+    df, current_period_name = build_synthetic_stats_df(users, periods)
+    subperiod = Period.APPROVAL_SUBPERIOD
+    assert build_stats_values(
+        df, current_period_name, subperiod
+    ) == build_stats_values_by_row(df, current_period_name, subperiod)
+    print("%s users x %s periods = %s rows" % (users, periods, len(df)))
+    for name, build_func in [
+        ("row by row", build_stats_values_by_row),
+        ("vectorized", build_stats_values),
+    ]:
+        best = min(
+            timeit.repeat(
+                lambda: build_func(df, current_period_name, subperiod),
+                number=1,
+                repeat=repeat,
+            )
+        )
+        print("%-12s %.3fs" % (name, best))
+
+
+if __name__ == "__main__":
+    main()
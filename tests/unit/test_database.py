@@ -0,0 +1,48 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, exc
+
+from adaero.database import InstrumentedQueuePool, get_pool_status
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine(
+        "sqlite://",
+        creator=lambda: sqlite3.connect(":memory:", check_same_thread=False),
+        poolclass=InstrumentedQueuePool,
+        pool_size=1,
+        max_overflow=1,
+        # time out straight away, as the clock may be frozen by other tests
+        pool_timeout=0,
+    )
+    yield engine
+    engine.dispose()
+
+
+def test_pool_status_reports_usage_and_waits(engine):
+    first = engine.connect()
+    second = engine.connect()
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    status = get_pool_status(engine)
+    assert "InstrumentedQueuePool" == status["poolClass"]
+    assert 1 == status["size"]
+    assert 2 == status["checkedOut"]
+    assert 1 == status["overflow"]
+    assert 2 == status["checkouts"]
+    assert 1 == status["timeouts"]
+
+    second.close()
+    first.close()
+    status = get_pool_status(engine)
+    assert 0 == status["checkedOut"]
+    assert 0 == status["overflow"]
+
+
+def test_pool_stats_are_kept_when_the_pool_is_recreated(engine):
+    engine.connect().close()
+    engine.dispose()
+    engine.connect().close()
+    assert 2 == get_pool_status(engine)["checkouts"]
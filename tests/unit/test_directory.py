@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+
+from freezegun import freeze_time
+import mock
+
+from adaero import directory
+from ..integration.constants import (
+    TEST_EMPLOYEE_USERNAME,
+    TEST_LDAP_FULL_DETAILS,
+    TEST_MANAGER_USERNAME,
+    TEST_UID_KEY,
+    TEST_USERNAME_KEY,
+)
+
+TEST_NOW = datetime(2017, 11, 22, 9, 23)
+
+
+def build_directory(**kwargs):
+    ldapsource = mock.Mock()
+    ldapsource.username_key = TEST_USERNAME_KEY
+    ldapsource.uid_key = TEST_UID_KEY
+    ldapsource.get_ldap_user_by_username.side_effect = TEST_LDAP_FULL_DETAILS.get
+    cache = directory.MemoryDirectoryCache(**kwargs)
+    return directory.CachedLDAPAuth(ldapsource, cache), ldapsource
+
+
+def test_lookups_are_cached_until_ttl():
+    cached, ldapsource = build_directory(ttl_s=60)
+    with freeze_time(TEST_NOW) as frozen:
+        for _ in range(3):
+            user = cached.get_ldap_user_by_username(TEST_EMPLOYEE_USERNAME)
+            assert user == TEST_LDAP_FULL_DETAILS[TEST_EMPLOYEE_USERNAME]
+        # usernames match regardless of case, like in LDAP
+        cached.get_ldap_user_by_username(TEST_EMPLOYEE_USERNAME.upper())
+        assert ldapsource.get_ldap_user_by_username.call_count == 1
+        frozen.tick(timedelta(seconds=61))
+        cached.get_ldap_user_by_username(TEST_EMPLOYEE_USERNAME)
+        assert ldapsource.get_ldap_user_by_username.call_count == 2
+    assert cached.get_status() == {
+        "hits": 3,
+        "negativeHits": 0,
+        "misses": 2,
+        "size": 1,
+    }
+
+
+def test_missing_users_are_cached_for_negative_ttl():
+    cached, ldapsource = build_directory(ttl_s=300, negative_ttl_s=10)
+    with freeze_time(TEST_NOW) as frozen:
+        assert cached.get_ldap_user_by_username("nobody") is None
+        assert cached.get_ldap_user_by_username("nobody") is None
+        assert ldapsource.get_ldap_user_by_username.call_count == 1
+        frozen.tick(timedelta(seconds=11))
+        assert cached.get_ldap_user_by_username("nobody") is None
+        assert ldapsource.get_ldap_user_by_username.call_count == 2
+    assert cached.get_status()["negativeHits"] == 1
+
+
+def test_least_recently_used_lookups_are_evicted():
+    cached, ldapsource = build_directory(max_size=2)
+    with freeze_time(TEST_NOW):
+        for username in [TEST_EMPLOYEE_USERNAME, TEST_MANAGER_USERNAME]:
+            cached.get_ldap_user_by_username(username)
+        cached.get_ldap_user_by_username(TEST_EMPLOYEE_USERNAME)
+        cached.get_ldap_user_by_username("nobody")
+        assert ldapsource.get_ldap_user_by_username.call_count == 3
+        cached.get_ldap_user_by_username(TEST_EMPLOYEE_USERNAME)
+        assert ldapsource.get_ldap_user_by_username.call_count == 3
+        cached.get_ldap_user_by_username(TEST_MANAGER_USERNAME)
+        assert ldapsource.get_ldap_user_by_username.call_count == 4
+
+
+def test_invalidate_drops_all_lookups():
+    cached, ldapsource = build_directory()
+    with freeze_time(TEST_NOW):
+        cached.get_ldap_user_by_username(TEST_EMPLOYEE_USERNAME)
+        cached.invalidate()
+        cached.get_ldap_user_by_username(TEST_EMPLOYEE_USERNAME)
+    assert ldapsource.get_ldap_user_by_username.call_count == 2
+    assert cached.get_status()["size"] == 1
+
+
+def test_batched_lookups_only_fetch_values_not_cached():
+    cached, ldapsource = build_directory()
+    details_by_uid = {d[TEST_UID_KEY]: d for d in TEST_LDAP_FULL_DETAILS.values()}
+    ldapsource.get_ldap_users_by_kvs.side_effect = lambda param, values: {
+        v: details_by_uid[v] for v in values if v in details_by_uid
+    }
+    employee_uid = TEST_LDAP_FULL_DETAILS[TEST_EMPLOYEE_USERNAME][TEST_UID_KEY]
+    manager_uid = TEST_LDAP_FULL_DETAILS[TEST_MANAGER_USERNAME][TEST_UID_KEY]
+    with freeze_time(TEST_NOW):
+        found = cached.get_ldap_users_by_kvs(TEST_UID_KEY, [employee_uid, "000000"])
+        assert list(found) == [employee_uid]
+        found = cached.get_ldap_users_by_kvs(
+            TEST_UID_KEY, [employee_uid, manager_uid, "000000", ""]
+        )
+        assert sorted(found) == sorted([employee_uid, manager_uid])
+        assert cached.get_ldap_user_by_kv(TEST_UID_KEY, manager_uid)
+    fetched = [c[0][1] for c in ldapsource.get_ldap_users_by_kvs.call_args_list]
+    assert sorted(fetched[0]) == sorted([employee_uid, "000000"])
+    assert fetched[1] == [manager_uid]
+    assert not ldapsource.get_ldap_user_by_kv.called
+
+
+def test_other_attributes_are_delegated():
+    cached, ldapsource = build_directory()
+    assert cached.username_key == TEST_USERNAME_KEY
+    cached.auth_user(TEST_EMPLOYEE_USERNAME, "password")
+    ldapsource.auth_user.assert_called_once_with(TEST_EMPLOYEE_USERNAME, "password")
+
+
+def test_cache_can_be_disabled():
+    assert directory.build_directory_cache({"adaero.ldap_cache_ttl_s": "0"}) is None
+    cache = directory.build_directory_cache({"adaero.ldap_cache_size": "10"})
+    assert isinstance(cache, directory.MemoryDirectoryCache)
+    assert cache.max_size == 10
@@ -0,0 +1,279 @@
+# -*- encoding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from datetime import datetime, timedelta
+import threading
+
+from freezegun import freeze_time
+import ldap
+import mock
+import pytest
+
+from adaero.security import ldapauth, ldappool
+from ..fake_ldap import FakeLDAPConnection
+from ..integration.constants import (
+    TEST_BUSINESS_UNIT_KEY,
+    TEST_LDAP_FULL_DETAILS,
+    TEST_EMPLOYEE_USERNAME,
+    TEST_MANAGER_KEY,
+    TEST_MANAGER_USERNAME,
+    TEST_UID_KEY,
+    TEST_USERNAME_KEY,
+)
+from ..settings import DEFAULT_TEST_SETTINGS
+
+# captured before the integration tests patch it for their whole session
+AUTH_USER = ldapauth.LDAPAuth.auth_user
+
+
+@pytest.fixture
+def connection():
+    connection = FakeLDAPConnection(TEST_LDAP_FULL_DETAILS.values())
+    with mock.patch("ldap.initialize", return_value=connection):
+        yield connection
+
+
+@pytest.fixture
+def ldapsource(connection):
+    return ldapauth.build_ldapauth_from_settings(DEFAULT_TEST_SETTINGS)
+
+
+def test_get_ldap_users_by_kvs_searches_in_batches_over_one_bind(
+    ldapsource, connection
+):  # noqa: E501
+    uids = sorted(d[TEST_UID_KEY] for d in TEST_LDAP_FULL_DETAILS.values())
+    found = ldapsource.get_ldap_users_by_kvs(
+        TEST_UID_KEY, uids + uids[:2] + ["000000", "", None], batch_size=3
+    )
+    assert sorted(found) == uids
+    for uid, details in found.items():
+        assert details[TEST_UID_KEY] == uid
+    assert connection.num_binds == 1
+    # duplicates and empty values are not looked up
+    num_values = len(uids) + 1
+    assert connection.num_searches == (num_values + 2) // 3
+    assert all(f.startswith("(|(%s=" % TEST_UID_KEY) for f in connection.filters)
+
+
+def test_get_ldap_users_by_kvs_matches_case_insensitively_and_escapes(ldapsource):
+    found = ldapsource.get_ldap_users_by_kvs(
+        TEST_USERNAME_KEY, ["SSholes", "*", "cdalton)(username=*"]
+    )
+    assert list(found) == ["SSholes"]
+    assert found["SSholes"][TEST_USERNAME_KEY] == "ssholes"
+
+
+def test_get_ldap_users_by_kvs_skips_directory_if_nothing_to_look_up(
+    ldapsource, connection
+):  # noqa: E501
+    assert ldapsource.get_ldap_users_by_kvs(TEST_UID_KEY, ["", None]) == {}
+    assert connection.num_binds == 0
+    assert connection.num_searches == 0
+
+
+def test_lookups_reuse_pooled_connection_bound_once(ldapsource, connection):
+    for _ in range(3):
+        user = ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, TEST_EMPLOYEE_USERNAME)
+        assert user[TEST_USERNAME_KEY] == TEST_EMPLOYEE_USERNAME
+    assert connection.num_binds == 1
+    assert connection.num_searches == 3
+
+
+def test_authentication_does_not_use_pooled_connections(ldapsource, connection):
+    ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, TEST_EMPLOYEE_USERNAME)
+    user_connection = FakeLDAPConnection([])
+    with mock.patch("ldap.initialize", return_value=user_connection):
+        assert AUTH_USER(ldapsource, TEST_EMPLOYEE_USERNAME, "password")
+        assert not AUTH_USER(ldapsource, TEST_EMPLOYEE_USERNAME, "")
+    assert user_connection.num_binds == 1
+    assert connection.num_binds == 1
+    ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, TEST_MANAGER_USERNAME)
+    assert connection.num_binds == 1
+
+
+def test_pool_reconnects_when_server_down(ldapsource):
+    first = FakeLDAPConnection(TEST_LDAP_FULL_DETAILS.values())
+    second = FakeLDAPConnection(TEST_LDAP_FULL_DETAILS.values())
+    with mock.patch("ldap.initialize", side_effect=[first, second]):
+        ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, TEST_EMPLOYEE_USERNAME)
+        first.is_down = True
+        user = ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, TEST_MANAGER_USERNAME)
+        assert user[TEST_USERNAME_KEY] == TEST_MANAGER_USERNAME
+        ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, TEST_EMPLOYEE_USERNAME)
+    assert first.num_searches == 1
+    assert second.num_binds == 1
+    assert second.num_searches == 2
+
+
+def test_pool_checks_idle_connections_before_reuse(connection):
+    pool = ldappool.LDAPConnectionPool("ldap://localhost", "admin", "admin_pw")
+    replacement = FakeLDAPConnection([])
+    with mock.patch("adaero.security.ldappool.time.monotonic") as monotonic_mock:
+        monotonic_mock.return_value = 0
+        with pool.connection() as checked_out:
+            assert checked_out is connection
+        monotonic_mock.return_value = ldappool.HEALTH_CHECK_IDLE_S - 1
+        with pool.connection() as checked_out:
+            assert checked_out is connection
+        monotonic_mock.return_value = 10 * ldappool.HEALTH_CHECK_IDLE_S
+        connection.is_down = True
+        with mock.patch("ldap.initialize", return_value=replacement):
+            with pool.connection() as checked_out:
+                assert checked_out is replacement
+    assert pool.num_connects == 2
+
+
+@pytest.mark.parametrize(
+    "error, is_reused",
+    (
+        (ldap.SIZELIMIT_EXCEEDED(), True),
+        (ldap.TIMEOUT(), False),
+        (ldap.SERVER_DOWN(), False),
+        (ValueError("Unexpected response"), False),
+        (KeyboardInterrupt(), False),
+    ),
+)
+def test_pool_only_reuses_connection_after_server_reported_errors(
+    connection, error, is_reused
+):
+    pool = ldappool.LDAPConnectionPool("ldap://localhost", "admin", "admin_pw")
+    replacement = FakeLDAPConnection([])
+    with mock.patch.object(connection, "unbind_s") as unbind_mock:
+        with pytest.raises(type(error)):
+            with pool.connection():
+                raise error
+        assert unbind_mock.call_count == (0 if is_reused else 1)
+    with mock.patch("ldap.initialize", return_value=replacement):
+        with pool.connection() as checked_out:
+            assert checked_out is (connection if is_reused else replacement)
+    # the slot of the failed checkout was released
+    with pool.connection():
+        pass
+
+
+def test_pool_hands_each_connection_to_one_thread_at_a_time():
+    size = 2
+    connections = [FakeLDAPConnection([]) for _ in range(size)]
+    pool = ldappool.LDAPConnectionPool("ldap://localhost", "admin", "admin_pw", size)
+    in_use = []
+    overlaps = []
+    lock = threading.Lock()
+
+    def use():
+        for _ in range(50):
+            with pool.connection() as connection:
+                with lock:
+                    if connection in in_use or len(in_use) >= size:
+                        overlaps.append(connection)
+                    in_use.append(connection)
+                with lock:
+                    in_use.remove(connection)
+
+    with mock.patch("ldap.initialize", side_effect=connections):
+        threads = [threading.Thread(target=use) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert not overlaps
+    assert pool.num_connects <= size
+
+
+def test_server_reported_down(ldapsource, connection):
+    assert ldapsource.check_server_is_up()
+    connection.is_down = True
+    with mock.patch("adaero.security.ldappool.time.monotonic", return_value=1e9):
+        assert not ldapsource.check_server_is_up()
+
+
+def _generate_directory_with_manager_dns(num_managers, reports_per_manager):
+    users = []
+    for i in range(num_managers):
+        for j in range(reports_per_manager + 1):
+            username = "m%s" % i if not j else "m%sr%s" % (i, j)
+            manager = "CN=Manager, %s,OU=People,O=foo" % i if j else None
+            users.append(
+                {
+                    "cn": "Manager, %s" % i if not j else username,
+                    TEST_USERNAME_KEY: username,
+                    TEST_MANAGER_KEY: manager,
+                }
+            )
+    return users
+
+
+def test_manager_dns_resolved_in_batches_and_remembered(ldapsource):
+    num_managers = ldapauth.DEFAULT_SEARCH_BATCH_SIZE + 20
+    users = _generate_directory_with_manager_dns(num_managers, 3)
+    connection = FakeLDAPConnection(users)
+    reports = [u[TEST_USERNAME_KEY] for u in users if u[TEST_MANAGER_KEY]]
+    with mock.patch("ldap.initialize", return_value=connection):
+        found = ldapsource.get_ldap_users_by_kvs(TEST_USERNAME_KEY, reports)
+        assert len(found) == len(reports)
+        for username, details in found.items():
+            assert details[TEST_MANAGER_KEY] == username.split("r")[0]
+        # one search for the reports and two for their distinct managers
+        assert connection.num_searches == (len(reports) + 99) // 100 + 2
+        assert connection.filters[-1].startswith("(|(cn=")
+
+        num_searches = connection.num_searches
+        user = ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, "m0r1")
+        assert user[TEST_MANAGER_KEY] == "m0"
+        assert connection.num_searches == num_searches + 1
+
+        ldapsource.invalidate()
+        ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, "m0r1")
+        assert connection.num_searches == num_searches + 3
+
+
+def test_manager_dns_forgotten_after_ttl(ldapsource):
+    connection = FakeLDAPConnection(_generate_directory_with_manager_dns(1, 1))
+    utcnow = datetime(2026, 1, 1)
+    with mock.patch("ldap.initialize", return_value=connection):
+        with freeze_time(utcnow):
+            ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, "m0r1")
+        num_searches = connection.num_searches
+        ttl = timedelta(seconds=ldapauth.DEFAULT_MANAGER_TTL_S)
+        with freeze_time(utcnow + ttl - timedelta(seconds=1)):
+            ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, "m0r1")
+        assert connection.num_searches == num_searches + 1
+        with freeze_time(utcnow + ttl):
+            user = ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, "m0r1")
+        assert user[TEST_MANAGER_KEY] == "m0"
+        assert connection.num_searches == num_searches + 3
+
+
+def test_unknown_manager_dn_raises(ldapsource):
+    users = _generate_directory_with_manager_dns(1, 1)
+    users[1][TEST_MANAGER_KEY] = "CN=Nobody,OU=People,O=foo"
+    with mock.patch("ldap.initialize", return_value=FakeLDAPConnection(users)):
+        with pytest.raises(Exception, match="Nobody"):
+            ldapsource.get_ldap_user_by_kv(TEST_USERNAME_KEY, "m0r1")
+
+
+def test_users_of_business_unit_fetched_a_page_at_a_time(ldapsource):
+    users = [
+        {
+            "distinguishedName": "CN=user%s,OU=People,O=foo" % i,
+            "cn": "user%s" % i,
+            TEST_USERNAME_KEY: "user%s" % i,
+            TEST_MANAGER_KEY: None,
+            TEST_BUSINESS_UNIT_KEY: "Alpha" if i % 5 else "Beta",
+        }
+        for i in range(30)
+    ]
+    connection = FakeLDAPConnection(users, size_limit=10)
+    ldapsource.page_size = 10
+    with mock.patch("ldap.initialize", return_value=connection):
+        with pytest.raises(ldap.SIZELIMIT_EXCEEDED):
+            connection.search_st(
+                "", ldap.SCOPE_SUBTREE, "(%s=Alpha)" % TEST_BUSINESS_UNIT_KEY
+            )
+        num_searches = connection.num_searches
+
+        pages = ldapsource.iter_ldap_user_pages("Alpha")
+        assert 10 == len(next(pages))
+        assert num_searches + 1 == connection.num_searches
+        assert [10, 4] == [len(page) for page in pages]
+        assert num_searches + 3 == connection.num_searches
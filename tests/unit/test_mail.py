@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from email.parser import Parser
+
+import pytest
+
+from adaero import mail
+from adaero.constants import EMAIL_TEMPLATE_MAP
+from adaero.date import HONG_KONG, LONDON
+from adaero.models import Period, User
+
+TEST_FROM = "noreply@example.com"
+TEST_SUBJECT = "Example Feedback: Please provide feedback"
+TEST_APP_HOST = "https://feedback.example.com"
+TEST_START = datetime(2017, 11, 20, 9)
+TEST_PERIOD = Period(
+    name="2017-Q4",
+    enrollment_start_utc=TEST_START,
+    entry_start_utc=TEST_START + timedelta(days=7),
+    approval_start_utc=TEST_START + timedelta(days=14),
+    approval_end_utc=TEST_START + timedelta(days=21),
+)
+
+
+def _get_parts(message_str):
+    message_root = Parser().parsestr(message_str)
+    plain, html = message_root.get_payload()
+    return (
+        message_root["From"],
+        message_root["Subject"],
+        plain.get_payload(decode=True).decode("utf-8"),
+        html.get_payload(decode=True).decode("utf-8"),
+    )
+
+
+@pytest.mark.parametrize("template_info", list(EMAIL_TEMPLATE_MAP.values()))
+@pytest.mark.parametrize("location", [LONDON, HONG_KONG, None])
+def test_compiled_message_matches_rendering_per_recipient(template_info, location):
+    template = mail._build_template_env().get_template(
+        "email/%s" % template_info["template"]
+    )
+    context = {
+        "period": TEST_PERIOD,
+        "app_host": TEST_APP_HOST,
+        "company_name": "Example",
+    }
+    compiled = mail.CompiledMessage(
+        template, location, TEST_FROM, TEST_SUBJECT, **context
+    )
+    for first_name in ["Alice", "Zoë <Ops> & Co", ""]:
+        user = User(first_name=first_name, last_name="Smith", location=location)
+        html = template.render(user=user, **context)
+        expected = mail._generate_message_root(html, TEST_FROM, TEST_SUBJECT)
+
+        assert _get_parts(expected.as_string()) == _get_parts(compiled.render(user))
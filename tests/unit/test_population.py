@@ -2,22 +2,32 @@
 
 from __future__ import unicode_literals
 from copy import copy
+import csv
+from io import StringIO
 import os
 
 import mock
 import pytest
 
-from adaero import population
+from adaero import constants, population
 from adaero.security import ldapauth
 from adaero.models import User
+from ..fake_ldap import FakeLDAPConnection
 from ..integration.constants import (
     TEST_LDAP_FULL_DETAILS,
     NOMINATED_USERNAME,
+    TEST_BUSINESS_UNIT_KEY,
+    TEST_DEPARTMENT_KEY,
+    TEST_LOCATION_KEY,
+    TEST_MANAGER_KEY,
     TEST_USERNAME_KEY,
     TEST_UID_KEY,
 )
 from ..settings import DEFAULT_TEST_SETTINGS
 
+# captured before the integration tests patch it for their whole session
+GET_ALL_LDAP_USERS = ldapauth.LDAPAuth.get_all_ldap_users
+
 
 HIERARCHY_CSV_FILEPATH = os.path.join(os.path.dirname(__file__), "population.csv")
 
@@ -39,35 +49,90 @@ def _get_ldap_user_by_kv_mck(k, v):
         return details_by_id.get(v)
 
 
+def _batched(get_ldap_user_by_kv_mck):
+    """Mock `get_ldap_users_by_kvs` with a mock of `get_ldap_user_by_kv`"""
+
+    def get_ldap_users_by_kvs_mck(k, values):
+        found = {v: get_ldap_user_by_kv_mck(k, v) for v in set(values) if v}
+        return {v: details for v, details in found.items() if details}
+
+    return get_ldap_users_by_kvs_mck
+
+
 def build_ldapsource():
     return ldapauth.build_ldapauth_from_settings(DEFAULT_TEST_SETTINGS)
 
 
 @mock.patch(
     "adaero.security.ldapauth.LDAPAuth.get_all_ldap_users",
-    return_value=TEST_LDAP_FULL_DETAILS.values(),
-)
-@mock.patch("adaero.population.find_external_managers", return_value=[])
-@mock.patch(
-    "adaero.security.ldapauth.LDAPAuth.get_ldap_user_by_username",
-    side_effect=_get_ldap_user_by_username_mck,
+    # rows are written in the order of the source
+    return_value=sorted(
+        TEST_LDAP_FULL_DETAILS.values(), key=lambda d: (d["sn"], d["givenName"])
+    ),
 )
 @mock.patch(
-    "adaero.security.ldapauth.LDAPAuth.get_ldap_user_by_uid",
-    side_effect=_get_ldap_user_by_uid_mck,
+    "adaero.security.ldapauth.LDAPAuth.get_ldap_users_by_kvs",
+    side_effect=_batched(_get_ldap_user_by_kv_mck),
 )
-def test_correct_csv_is_generated(mck_3_, mck_2_, fem_mck, galu_mck):
+def test_correct_csv_is_generated(kvs_mck, galu_mck):
     ldapsource = build_ldapsource()
     expected = open(HIERARCHY_CSV_FILEPATH, newline="\r\n").read()
-    generated = (
+    generated = "".join(
         population.generate_population_csv_from_business_unit(ldapsource, None)
-        .getvalue()
-        .strip()
-    )
-    assert 1 == fem_mck.call_count
+    ).strip()
+    # managers outside of the population are looked up in one go
+    assert 1 == kvs_mck.call_count
     assert expected == generated
 
 
+def _generate_business_unit(num_reports):
+    """Reports in business unit Alpha of two managers in business unit Beta"""
+    users = []
+    for i in range(num_reports + 2):
+        is_manager = i < 2
+        users.append(
+            {
+                "distinguishedName": "CN=user%s,OU=People,O=foo" % i,
+                "givenName": "First%s" % i,
+                "sn": "Last%s" % i,
+                "mail": "user%s@example.com" % i,
+                "title": "Developer",
+                TEST_USERNAME_KEY: "user%s" % i,
+                TEST_UID_KEY: str(100000 + i),
+                TEST_MANAGER_KEY: None if is_manager else "user%s" % (i % 2),
+                TEST_LOCATION_KEY: "London",
+                TEST_DEPARTMENT_KEY: "App Development",
+                TEST_BUSINESS_UNIT_KEY: "Beta" if is_manager else "Alpha",
+            }
+        )
+    return users
+
+
+def test_population_csv_streamed_as_pages_arrive():
+    connection = FakeLDAPConnection(_generate_business_unit(12), size_limit=5)
+    settings = dict(DEFAULT_TEST_SETTINGS)
+    settings[constants.LDAP_PAGE_SIZE_KEY] = 5
+    ldapsource = ldapauth.build_ldapauth_from_settings(settings)
+    with mock.patch(
+        "adaero.security.ldapauth.LDAPAuth.get_all_ldap_users", GET_ALL_LDAP_USERS
+    ), mock.patch.object(population, "POPULATION_CSV_CHUNK_SIZE", 5), mock.patch(
+        "ldap.initialize", return_value=connection
+    ):
+        chunks = population.generate_population_csv_from_business_unit(
+            ldapsource, "Alpha"
+        )
+        first_chunk = next(chunks)
+        # the first page and the managers of its users
+        assert 2 == connection.num_searches
+        rows = list(csv.DictReader(StringIO(first_chunk + "".join(chunks))))
+    # three pages, the managers being looked up with the first
+    assert 4 == connection.num_searches
+    assert ["Alpha"] * 12 + ["Beta"] * 2 == [r["business_unit"] for r in rows]
+    assert ["100000", "100001"] * 6 + ["", ""] == [
+        r[population.MANAGER_ID] for r in rows
+    ]
+
+
 def _generate_user_list():
     ldapsource = ldapauth.build_ldapauth_from_settings(DEFAULT_TEST_SETTINGS)
     users = []
@@ -88,8 +153,8 @@ def _generate_user_rows():
 
 
 @mock.patch(
-    "adaero.security.ldapauth.LDAPAuth.get_ldap_user_by_kv",
-    side_effect=_get_ldap_user_by_kv_mck,
+    "adaero.security.ldapauth.LDAPAuth.get_ldap_users_by_kvs",
+    side_effect=_batched(_get_ldap_user_by_kv_mck),
 )
 def test_correct_list_of_users_are_parsed(_):
     expected = _generate_user_rows()
@@ -125,8 +190,8 @@ def test_population_conversion_catches_users_without_ldap():
         return details_by_id.get(id_)
 
     with mock.patch(
-        "adaero.security.ldapauth.LDAPAuth." "get_ldap_user_by_kv",
-        side_effect=_get_ldap_user_by_employee_id_mck,
+        "adaero.security.ldapauth.LDAPAuth.get_ldap_users_by_kvs",
+        side_effect=_batched(_get_ldap_user_by_employee_id_mck),
     ):
         expected = _generate_user_list()
         ldapsource = ldapauth.build_ldapauth_from_settings(DEFAULT_TEST_SETTINGS)
@@ -147,6 +212,32 @@ def test_population_conversion_catches_users_without_ldap():
             assert e.first_name == e.first_name
 
 
+def test_population_conversion_resolves_users_in_batches():
+    directory = [
+        d
+        for d in TEST_LDAP_FULL_DETAILS.values()
+        if d[TEST_UID_KEY] != USER_TO_REMOVE_EMPLOYEE_ID
+    ]
+    connection = FakeLDAPConnection(directory)
+    ldapsource = ldapauth.build_ldapauth_from_settings(DEFAULT_TEST_SETTINGS)
+    input_ = open(HIERARCHY_CSV_FILEPATH).read().strip()
+    num_rows = len(input_.splitlines())
+    input_ += "\nBad,Manager,Dev,123456,Alpha,bm@example.com,Dev,True,000000\n"
+    with mock.patch("ldap.initialize", return_value=connection):
+        generated, messages = population.convert_population_csv_to_user_rows(
+            ldapsource, input_, []
+        )
+    assert messages == [
+        population.MISSING_USER_TMPL.format(row_num=USER_TO_REMOVE_ROW_NUM),
+        population.DEFAULT_INVALID_MANAGER_TMPL.format(
+            row_num=num_rows + 1, manager_uid="000000"
+        ),
+    ]
+    assert len(generated) == num_rows - 1
+    assert connection.num_binds == 1
+    assert connection.num_searches == 1
+
+
 def test_population_validation_catches_duplicate_users():
     def _get_ldap_user_by_employee_id_mck(k, id_):
         if k != TEST_UID_KEY:
@@ -155,8 +246,8 @@ def test_population_validation_catches_duplicate_users():
         return details_by_id.get(id_)
 
     with mock.patch(
-        "adaero.security.ldapauth.LDAPAuth." "get_ldap_user_by_kv",
-        side_effect=_get_ldap_user_by_employee_id_mck,
+        "adaero.security.ldapauth.LDAPAuth.get_ldap_users_by_kvs",
+        side_effect=_batched(_get_ldap_user_by_employee_id_mck),
     ):
         ldapsource = ldapauth.build_ldapauth_from_settings(DEFAULT_TEST_SETTINGS)
         input_ = _generate_user_list()
@@ -182,8 +273,8 @@ def test_population_validation_catches_duplicate_users():
 
 
 @mock.patch(
-    "adaero.security.ldapauth.LDAPAuth." "get_ldap_user_by_kv",
-    side_effect=_get_ldap_user_by_kv_mck,
+    "adaero.security.ldapauth.LDAPAuth.get_ldap_users_by_kvs",
+    side_effect=_batched(_get_ldap_user_by_kv_mck),
 )
 def test_user_generation_manages_non_staff_properly(_):
     input_ = _generate_user_rows()
@@ -216,8 +307,8 @@ def test_user_generation_manages_non_staff_properly(_):
 
 
 @mock.patch(
-    "adaero.security.ldapauth.LDAPAuth." "get_ldap_user_by_kv",
-    side_effect=_get_ldap_user_by_kv_mck,
+    "adaero.security.ldapauth.LDAPAuth.get_ldap_users_by_kvs",
+    side_effect=_batched(_get_ldap_user_by_kv_mck),
 )
 def test_user_generation_generates_missing_managers(_):
     input_ = _generate_user_rows()
@@ -244,6 +335,32 @@ def test_user_generation_generates_missing_managers(_):
         assert e.username == g.username
 
 
+def test_user_generation_adds_missing_managers_once_in_order_referenced():
+    directory = _generate_business_unit(12)
+    managers = {d[TEST_USERNAME_KEY]: d for d in directory[:2]}
+    ldapsource = build_ldapsource()
+    rows = []
+    for details in reversed(directory[2:]):
+        row = User.create_from_ldap_details(ldapsource, details).to_dict()
+        row["is_staff"] = True
+        rows.append(row)
+    with mock.patch(
+        "adaero.security.ldapauth.LDAPAuth.get_ldap_users_by_kvs",
+        side_effect=lambda k, values: {v: managers[v] for v in values},
+    ):
+        generated, messages = population.generate_required_users(ldapsource, rows, [])
+    assert [r["username"] for r in rows] + ["user1", "user0"] == [
+        u.username for u in generated
+    ]
+    assert [
+        population.DEFAULT_MISSING_MANAGER_TMPL.format(
+            uid=managers[username][TEST_UID_KEY], display_name="First%s Last%s" % (i, i)
+        )
+        for i, username in [(1, "user1"), (0, "user0")]
+    ] == messages
+    assert [False] * 12 + [True, True] == [u.has_direct_reports for u in generated]
+
+
 def test_population_validation_catches_invalid_headers():
     field_names = copy(population.FIELDNAMES)
     missing = field_names.pop(0)
@@ -0,0 +1,88 @@
+import smtplib
+
+import mock
+import pytest
+
+from adaero.smtp import SMTPDispatcher, TokenBucket
+
+TEST_FROM = "noreply@example.com"
+
+
+def _send_all(dispatcher, num):
+    with dispatcher:
+        for i in range(num):
+            dispatcher.send(TEST_FROM, ["user%s@example.com" % i], "message %s" % i)
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now_s = 1000.0
+
+    def monotonic(self):
+        return self.now_s
+
+    def sleep(self, seconds):
+        self.now_s += seconds
+
+
+def test_token_bucket_limits_rate_after_burst():
+    clock = FakeClock()
+    with mock.patch("adaero.smtp.time", clock):
+        bucket = TokenBucket(100, burst=5)
+        for _ in range(5):
+            bucket.acquire()
+        assert 1000.0 == clock.now_s
+        for _ in range(10):
+            bucket.acquire()
+        assert 1000.1 == pytest.approx(clock.now_s)
+        # tokens are saved up again while idle
+        clock.sleep(1)
+        for _ in range(5):
+            bucket.acquire()
+        assert 1001.1 == pytest.approx(clock.now_s)
+
+
+def test_token_bucket_without_rate_does_not_wait():
+    clock = FakeClock()
+    with mock.patch("adaero.smtp.time", clock):
+        bucket = TokenBucket(0)
+        for _ in range(1000):
+            bucket.acquire()
+    assert 1000.0 == clock.now_s
+
+
+def test_dispatcher_reuses_a_connection_per_worker():
+    with mock.patch("smtplib.SMTP") as smtp_mock:
+        dispatcher = SMTPDispatcher(num_connections=3)
+        _send_all(dispatcher, 30)
+    assert 30 == dispatcher.num_sent
+    assert 30 == smtp_mock.return_value.sendmail.call_count
+    assert smtp_mock.call_count <= 3
+
+
+def test_dispatcher_reconnects_when_the_server_drops_the_connection():
+    dropped = mock.MagicMock()
+    dropped.sendmail.side_effect = smtplib.SMTPServerDisconnected("dropped")
+    healthy = mock.MagicMock()
+    with mock.patch("smtplib.SMTP", side_effect=[dropped, healthy]), mock.patch(
+        "adaero.smtp.RECONNECT_DELAY_S", 0
+    ):
+        dispatcher = SMTPDispatcher(num_connections=1)
+        _send_all(dispatcher, 5)
+    assert 5 == dispatcher.num_sent
+    assert 0 == dispatcher.num_failed
+    dropped.close.assert_called_once_with()
+    assert 5 == healthy.sendmail.call_count
+
+
+def test_dispatcher_does_not_retry_rejected_emails():
+    with mock.patch("smtplib.SMTP") as smtp_mock:
+        smtp_mock.return_value.sendmail.side_effect = [
+            smtplib.SMTPRecipientsRefused({}),
+            {},
+        ]
+        dispatcher = SMTPDispatcher(num_connections=1)
+        _send_all(dispatcher, 2)
+    assert 1 == dispatcher.num_sent
+    assert 1 == dispatcher.num_failed
+    assert 1 == smtp_mock.call_count
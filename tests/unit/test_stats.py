@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from adaero.models.period import Period
+from adaero.stats import build_stats_values
+
+STATS_DATAFRAME_COLUMNS = [
+    "username",
+    "first_name",
+    "last_name",
+    "start_date",
+    "period_name",
+    "contributed",
+    "received",
+    "has_summary",
+]
+
+
+def _build_stats_df():
+    rows = []
+    users = [
+        # username, first_name, last_name, received, has_summary
+        ("cdoe", "Chris", "Doe", -1, False),
+        ("adoe", "Alex", "Doe", 3, True),
+        ("bdoe", "Bo", "Doe", 2, False),
+    ]
+    periods = [("Q2", datetime(2018, 4, 1)), ("Q1", datetime(2018, 1, 1))]
+    for username, first_name, last_name, received, has_summary in users:
+        for i, (period_name, start_date) in enumerate(periods):
+            rows.append(
+                (
+                    username,
+                    first_name,
+                    last_name,
+                    start_date,
+                    period_name,
+                    len(username) + i,
+                    received if period_name == "Q2" else 1,
+                    has_summary if period_name == "Q2" else False,
+                )
+            )
+    return pd.DataFrame(rows, columns=STATS_DATAFRAME_COLUMNS)
+
+
+def _button(username, text, enable, has_existing_summary=False):
+    return {
+        "buttonText": text,
+        "username": username,
+        "enable": enable,
+        "hasExistingSummary": has_existing_summary,
+    }
+
+
+@pytest.mark.parametrize(
+    "subperiod, expected_buttons",
+    [
+        (
+            Period.APPROVAL_SUBPERIOD,
+            [
+                _button("adoe", "Review existing summary", True, True),
+                _button("bdoe", "Review feedback", True),
+                _button("cdoe", "Not enrolled for feedback", False),
+            ],
+        ),
+        (
+            Period.ENTRY_SUBPERIOD,
+            [
+                _button("adoe", "Not in approval or review period", False),
+                _button("bdoe", "Not in approval or review period", False),
+                _button("cdoe", "Not in approval or review period", False),
+            ],
+        ),
+    ],
+)
+def test_build_stats_values(subperiod, expected_buttons):
+    values = build_stats_values(_build_stats_df(), "Q2", subperiod)
+    assert [row[:-1] for row in values] == [
+        [{"displayName": "Alex Doe", "username": "adoe"}, 5, 1, 4, 3],
+        [{"displayName": "Bo Doe", "username": "bdoe"}, 5, 1, 4, 2],
+        [{"displayName": "Chris Doe", "username": "cdoe"}, 5, 1, 4, -1],
+    ]
+    assert [row[-1] for row in values] == expected_buttons
+
+
+def test_build_stats_values_without_current_period():
+    values = build_stats_values(_build_stats_df(), "Q3", Period.APPROVAL_SUBPERIOD)
+    assert [len(row) for row in values] == [5, 5, 5]
+
+
+def test_build_stats_values_with_no_stats():
+    df = pd.DataFrame([], columns=STATS_DATAFRAME_COLUMNS)
+    assert build_stats_values(df, "Q2", Period.APPROVAL_SUBPERIOD) == []